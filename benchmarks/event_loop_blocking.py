@@ -0,0 +1,116 @@
+"""
+对比同步 / 异步数据库会话对事件循环的阻塞
+
+用法：
+    python -m benchmarks.event_loop_blocking [--url URL] [--requests 50] [--concurrency 10]
+
+模拟多个并发请求执行慢查询，同时用一个心跳协程测量事件循环的调度延迟：
+- sync: 在 async 函数中直接调用同步 Session（迁移前的路由写法）
+- async: 使用 AsyncSession（asyncpg / aiosqlite）
+
+“阻塞时间”为心跳延迟超过阈值的累计值，数值越小说明其他协程
+（Graph / AI 调用等）越不会被数据库查询拖住。
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database.models import DATABASE_URL, get_async_database_url
+
+TICK_SECONDS = 0.005
+BLOCK_THRESHOLD_SECONDS = 0.01
+
+
+def slow_query(dialect: str, seconds: float):
+    """构造一条大约耗时 seconds 秒的查询"""
+    if dialect == "postgresql":
+        return text("SELECT pg_sleep(:seconds)").bindparams(seconds=seconds)
+    if dialect == "sqlite":
+        # SQLite 没有 sleep，用递归 CTE 消耗 CPU（约 200 万行/秒）
+        return text(
+            "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c "
+            "WHERE x < :n) SELECT count(*) FROM c"
+        ).bindparams(n=int(seconds * 2_000_000))
+    raise RuntimeError(f"不支持的数据库: {dialect}")
+
+
+async def monitor(stop: asyncio.Event, stats: dict):
+    """心跳协程：记录每次调度比预期晚了多久"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        lag = time.perf_counter() - start - TICK_SECONDS
+        stats["ticks"] += 1
+        stats["max_lag"] = max(stats["max_lag"], lag)
+        if lag > BLOCK_THRESHOLD_SECONDS:
+            stats["blocked"] += lag
+
+
+async def run_scenario(name: str, worker, requests: int, concurrency: int) -> dict:
+    stats = {"ticks": 0, "max_lag": 0.0, "blocked": 0.0}
+    stop = asyncio.Event()
+    heartbeat = asyncio.create_task(monitor(stop, stats))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_request():
+        async with semaphore:
+            await worker()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_request() for _ in range(requests)))
+    stats["wall"] = time.perf_counter() - start
+
+    stop.set()
+    await heartbeat
+    stats["name"] = name
+    return stats
+
+
+async def main(url: str, requests: int, concurrency: int, query_seconds: float):
+    pool = {} if url.startswith("sqlite") else {"pool_size": concurrency, "max_overflow": 0}
+    sync_engine = create_engine(url, **pool)
+    async_engine = create_async_engine(get_async_database_url(url), **pool)
+    stmt = slow_query(sync_engine.dialect.name, query_seconds)
+
+    async def sync_worker():
+        with sync_engine.connect() as connection:
+            connection.execute(stmt).scalar()
+
+    async def async_worker():
+        async with async_engine.connect() as connection:
+            await connection.scalar(stmt)
+
+    # 预热连接池
+    await sync_worker()
+    await async_worker()
+
+    results = [
+        await run_scenario("sync", sync_worker, requests, concurrency),
+        await run_scenario("async", async_worker, requests, concurrency),
+    ]
+
+    sync_engine.dispose()
+    await async_engine.dispose()
+
+    print(f"数据库: {sync_engine.dialect.name}, 请求数: {requests}, 并发: {concurrency}")
+    print(f"{'模式':<8}{'总耗时(s)':>12}{'阻塞时间(s)':>14}{'最大延迟(ms)':>16}{'心跳次数':>10}")
+    for r in results:
+        print(
+            f"{r['name']:<8}{r['wall']:>12.3f}{r['blocked']:>14.3f}"
+            f"{r['max_lag'] * 1000:>16.1f}{r['ticks']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比同步 / 异步数据库会话对事件循环的阻塞")
+    parser.add_argument("--url", default=os.getenv("DATABASE_URL", DATABASE_URL))
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--query-seconds", type=float, default=0.05)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.url, args.requests, args.concurrency, args.query_seconds))
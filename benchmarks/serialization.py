@@ -0,0 +1,162 @@
+"""
+对比 JSON 序列化方式和压缩后的传输大小
+
+用法：
+    python -m benchmarks.serialization [--rounds 200] [--body-kb 300]
+
+两种典型响应：
+- list: GET /api/emails 一页 50 封邮件（全部列表字段）
+- detail: GET /api/emails/{id}，正文为 --body-kb KB 的 HTML
+
+序列化方式：
+- stdlib: jsonable_encoder + json.dumps（FastAPI 默认的 JSONResponse）
+- orjson: 直接用 ORJSONResponse（邮件列表 / 详情走 utils.http_cache 时的路径）
+- model+orjson: 按 response_model 校验和转换后再用 orjson 输出（其他接口的路径）
+
+传输大小为序列化结果分别不压缩、gzip、brotli（已安装时）后的字节数。
+"""
+import argparse
+import gzip
+import random
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from config import settings
+from routers.schemas import EmailDetail, EmailListResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+WORDS = (
+    "invoice meeting report 发票 会议 报告 project update schedule 请查收 附件 "
+    "quarterly review 审批 合同 deadline reminder 通知 payment confirmation"
+).split()
+
+
+def _text(n_words: int) -> str:
+    return " ".join(random.choice(WORDS) for _ in range(n_words))
+
+
+def list_payload(n: int = 50) -> dict:
+    now = datetime.utcnow()
+    emails = [
+        {
+            "id": 100000 + i,
+            "message_id": f"AAMkAGI2TG93AAA{i:020d}=",
+            "subject": _text(8),
+            "sender_email": f"sender{i}@example.com",
+            "sender_name": f"Sender {i}",
+            "received_at": (now - timedelta(minutes=i)).isoformat(),
+            "has_attachments": i % 3 == 0,
+            "is_read": i % 2 == 0,
+            "is_processed": i % 4 == 0,
+            "sent": i % 5 == 0,
+            "body_preview": _text(40)[:200],
+        }
+        for i in range(n)
+    ]
+    return {
+        "count": n,
+        "estimated_total": 12345,
+        "next_cursor": "eyJyIjoiMjAyNi0xMC0xOVQwMDowMDowMCIsImkiOjEwMDA0OX0",
+        "prev_cursor": None,
+        "next": "https://example.com/api/emails?cursor=eyJyIjoiMjAyNi0xMC0xOVQwMDowMDowMCIsImkiOjEwMDA0OX0",
+        "prev": None,
+        "emails": emails,
+    }
+
+
+def detail_payload(body_kb: int) -> dict:
+    paragraphs = []
+    size = 0
+    while size < body_kb * 1024:
+        paragraph = f'<p style="margin:0 0 12px 0;font-family:Arial">{_text(60)}</p>\n'
+        paragraphs.append(paragraph)
+        size += len(paragraph.encode())
+    body_html = "<html><body>" + "".join(paragraphs) + "</body></html>"
+    return {
+        "id": 100001,
+        "message_id": "AAMkAGI2TG93AAA00000000000000000001=",
+        "subject": _text(8),
+        "sender_email": "sender@example.com",
+        "sender_name": "Sender",
+        "received_at": datetime.utcnow().isoformat(),
+        "body_html": body_html,
+        "body_text": _text(40),
+        "has_attachments": True,
+        "attachments": [
+            {
+                "id": f"att{i}",
+                "name": f"file{i}.pdf",
+                "size": 123456,
+                "content_type": "application/pdf",
+            }
+            for i in range(3)
+        ],
+        "is_read": True,
+        "is_processed": True,
+        "sent": True,
+        "processed_content": _text(120),
+    }
+
+
+def _time(func, rounds: int) -> float:
+    """平均每次耗时（毫秒）"""
+    func()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def run(name: str, payload: dict, model, rounds: int):
+    serializers = {
+        "stdlib": lambda: JSONResponse(jsonable_encoder(payload)).body,
+        "orjson": lambda: ORJSONResponse(payload).body,
+        "model+orjson": lambda: ORJSONResponse(
+            model.model_validate(payload).model_dump(mode="json")
+        ).body,
+    }
+
+    print(f"\n[{name}]")
+    print(f"{'序列化':<14}{'耗时(ms)':>10}{'原始(B)':>10}{'gzip(B)':>10}{'br(B)':>10}")
+    for label, serialize in serializers.items():
+        ms = _time(serialize, rounds)
+        body = serialize()
+        gzipped = len(gzip.compress(body, compresslevel=settings.COMPRESSION_GZIP_LEVEL))
+        brotlied = (
+            len(brotli.compress(body, quality=settings.COMPRESSION_BROTLI_QUALITY))
+            if brotli
+            else "-"
+        )
+        print(f"{label:<14}{ms:>10.3f}{len(body):>10}{gzipped:>10}{brotlied:>10}")
+
+    body = serializers["orjson"]()
+    rounds = max(rounds // 10, 1)
+    gzip_ms = _time(
+        lambda: gzip.compress(body, compresslevel=settings.COMPRESSION_GZIP_LEVEL), rounds
+    )
+    line = f"压缩耗时: gzip-{settings.COMPRESSION_GZIP_LEVEL} {gzip_ms:.3f} ms"
+    if brotli:
+        br_ms = _time(
+            lambda: brotli.compress(body, quality=settings.COMPRESSION_BROTLI_QUALITY),
+            rounds,
+        )
+        line += f", br-{settings.COMPRESSION_BROTLI_QUALITY} {br_ms:.3f} ms"
+    print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比 JSON 序列化方式和压缩后的传输大小")
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--body-kb", type=int, default=300)
+    args = parser.parse_args()
+
+    random.seed(0)
+    run("list: 50 封邮件", list_payload(50), EmailListResponse, args.rounds)
+    run(f"detail: {args.body_kb} KB 正文", detail_payload(args.body_kb), EmailDetail, args.rounds)
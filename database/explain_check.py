@@ -0,0 +1,126 @@
+"""
+检查热点查询是否命中索引
+
+用法：
+    python -m database.explain_check [--user-id 1]
+
+对 routers 中的热点查询执行 EXPLAIN，确认使用了迁移中创建的索引；
+任一查询未命中时以非零状态退出，可用于部署前检查或 CI。
+PostgreSQL 上会临时关闭 seqscan，避免小表上规划器选择全表扫描导致误报。
+"""
+import argparse
+import json
+import sys
+
+from sqlalchemy import select, text
+
+from database.models import engine, Email, FetchLog, SendLog
+
+
+def hot_queries(user_id: int) -> list:
+    """(名称, 查询, 期望使用的索引)"""
+    return [
+        (
+            "邮件列表 (user_id + received_at DESC)",
+            select(Email.id, Email.subject)
+            .where(Email.user_id == user_id)
+            .order_by(Email.received_at.desc(), Email.id.desc())
+            .limit(50),
+            "ix_emails_user_received",
+        ),
+        (
+            "待处理邮件 (user_id + is_processed + sent)",
+            select(Email.id)
+            .where(
+                Email.user_id == user_id,
+                Email.is_processed == False,
+                Email.sent == False,
+                Email.id > 0,
+            )
+            .order_by(Email.id)
+            .limit(50),
+            "ix_emails_user_pending",
+        ),
+        (
+            "抓取日志 (user_id + created_at DESC)",
+            select(FetchLog.id)
+            .where(FetchLog.user_id == user_id)
+            .order_by(FetchLog.created_at.desc())
+            .limit(20),
+            "ix_fetch_logs_user_created",
+        ),
+        (
+            "发送日志 (user_id + created_at DESC)",
+            select(SendLog.id)
+            .where(SendLog.user_id == user_id)
+            .order_by(SendLog.created_at.desc())
+            .limit(20),
+            "ix_send_logs_user_created",
+        ),
+    ]
+
+
+def _collect_index_names(plan, names: set):
+    """递归收集 PostgreSQL JSON 执行计划中用到的索引"""
+    if isinstance(plan, dict):
+        if "Index Name" in plan:
+            names.add(plan["Index Name"])
+        for value in plan.values():
+            _collect_index_names(value, names)
+    elif isinstance(plan, list):
+        for item in plan:
+            _collect_index_names(item, names)
+
+
+def explain_indexes(connection, stmt) -> tuple:
+    """返回 (使用到的索引集合, 执行计划文本)"""
+    sql = str(
+        stmt.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True})
+    )
+
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SET LOCAL enable_seqscan = off"))
+        raw = connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+        plan = raw if isinstance(raw, list) else json.loads(raw)
+        names = set()
+        _collect_index_names(plan, names)
+        return names, json.dumps(plan, ensure_ascii=False, indent=2)
+
+    if connection.dialect.name == "sqlite":
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+        details = [row[-1] for row in rows]
+        names = set()
+        for detail in details:
+            for marker in ("USING COVERING INDEX ", "USING INDEX "):
+                if marker in detail:
+                    names.add(detail.split(marker, 1)[1].split(" ", 1)[0])
+        return names, "\n".join(details)
+
+    raise RuntimeError(f"不支持的数据库: {connection.dialect.name}")
+
+
+def check(user_id: int = 1, verbose: bool = False) -> bool:
+    ok = True
+    with engine.connect() as connection:
+        for name, stmt, expected in hot_queries(user_id):
+            with connection.begin():
+                used, plan = explain_indexes(connection, stmt)
+
+            if expected in used:
+                print(f"✅ {name}: {expected}")
+            else:
+                ok = False
+                print(f"❌ {name}: 未使用 {expected}（实际: {', '.join(used) or '全表扫描'}）")
+
+            if verbose or expected not in used:
+                print(plan)
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="检查热点查询是否命中索引")
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    sys.exit(0 if check(args.user_id, args.verbose) else 1)
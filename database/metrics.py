@@ -0,0 +1,222 @@
+"""
+数据库连接池与查询指标
+
+- 连接池：等待获取连接的耗时（直方图）、获取超时次数，以及抓取时读取的
+  pool_size / checked_out / overflow 等当前值
+- 查询：每条 SQL 的执行耗时（直方图），超过 DB_SLOW_QUERY_MS 的计数并打印
+
+由 /metrics 以 Prometheus 文本格式输出。
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event, exc, text
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from config import settings
+
+# 直方图分桶（秒）
+CHECKOUT_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """累计分桶直方图（按 label 分组，线程安全）"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, label: str, value: float):
+        with self._lock:
+            counts, total = self._series.get(label, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._series[label] = (counts, total + value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {label: (list(c), s) for label, (c, s) in self._series.items()}
+
+
+class Counter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, label: str, amount: int = 1):
+        with self._lock:
+            self._values[label] = self._values.get(label, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+
+checkout_wait = Histogram(CHECKOUT_WAIT_BUCKETS)
+checkout_timeouts = Counter()
+query_duration = Histogram(QUERY_DURATION_BUCKETS)
+slow_queries = Counter()
+
+# 已注册的引擎 {名称: 同步 Engine}，抓取指标时读取连接池当前状态
+_engines = {}
+
+
+class _TimedCheckoutMixin:
+    """记录从连接池获取连接的等待时间（含新建连接），超时单独计数"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            checkout_timeouts.inc(self._orig_logging_name or "default")
+            raise
+        finally:
+            checkout_wait.observe(
+                self._orig_logging_name or "default", time.perf_counter() - start
+            )
+
+
+class InstrumentedQueuePool(_TimedCheckoutMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def instrument_engine(engine, name: str):
+    """
+    注册引擎并监听查询耗时（异步引擎传入 async_engine.sync_engine）
+
+    连接池的等待时间需在创建引擎时指定 poolclass 和 pool_logging_name=name。
+    """
+    _engines[name] = engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_query_start", None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        query_duration.observe(name, elapsed)
+
+        if settings.DB_SLOW_QUERY_MS and elapsed * 1000 >= settings.DB_SLOW_QUERY_MS:
+            slow_queries.inc(name)
+            sql = " ".join(statement.split())
+            print(f"🐢 慢查询 [{name}] {elapsed * 1000:.0f} ms: {sql[:300]}")
+
+
+def pool_status() -> dict:
+    """各连接池当前状态（NullPool 等无连接池的引擎不包含在内）"""
+    status = {}
+    for name, engine in _engines.items():
+        pool = engine.pool
+        if not isinstance(pool, QueuePool):
+            continue
+        status[name] = {
+            "size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            # overflow() 在连接数未达到 pool_size 时为负数
+            "overflow": max(pool.overflow(), 0),
+        }
+    return status
+
+
+def _render_histogram(lines: list, metric: str, histogram: Histogram, label: str):
+    for value, (counts, total) in sorted(histogram.snapshot().items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{metric}_bucket{{{label}="{value}",le="+Inf"}} {cumulative}')
+        lines.append(f'{metric}_sum{{{label}="{value}"}} {total:.6f}')
+        lines.append(f'{metric}_count{{{label}="{value}"}} {cumulative}')
+
+
+def render_prometheus() -> str:
+    """Prometheus 文本格式（text/plain; version=0.0.4）"""
+    lines = []
+
+    gauges = {
+        "size": "连接池常驻连接数 (pool_size)",
+        "max_overflow": "允许的溢出连接数 (max_overflow)",
+        "checked_out": "正在使用的连接数",
+        "checked_in": "空闲连接数",
+        "overflow": "当前溢出连接数",
+    }
+    status = pool_status()
+    for key, help_text in gauges.items():
+        metric = f"db_pool_{key}"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        for name, values in sorted(status.items()):
+            lines.append(f'{metric}{{pool="{name}"}} {values[key]}')
+
+    lines.append("# HELP db_pool_checkout_wait_seconds 从连接池获取连接的等待时间")
+    lines.append("# TYPE db_pool_checkout_wait_seconds histogram")
+    _render_histogram(lines, "db_pool_checkout_wait_seconds", checkout_wait, "pool")
+
+    lines.append("# HELP db_pool_checkout_timeouts_total 获取连接超时次数")
+    lines.append("# TYPE db_pool_checkout_timeouts_total counter")
+    for name, value in sorted(checkout_timeouts.snapshot().items()):
+        lines.append(f'db_pool_checkout_timeouts_total{{pool="{name}"}} {value}')
+
+    lines.append("# HELP db_query_duration_seconds SQL 执行耗时")
+    lines.append("# TYPE db_query_duration_seconds histogram")
+    _render_histogram(lines, "db_query_duration_seconds", query_duration, "pool")
+
+    lines.append("# HELP db_slow_queries_total 超过 DB_SLOW_QUERY_MS 的查询数")
+    lines.append("# TYPE db_slow_queries_total counter")
+    for name, value in sorted(slow_queries.snapshot().items()):
+        lines.append(f'db_slow_queries_total{{pool="{name}"}} {value}')
+
+    return "\n".join(lines) + "\n"
+
+
+def check_pool_budget(engine) -> None:
+    """
+    启动时检查连接池总量是否超过 PostgreSQL 的 max_connections
+
+    每个进程最多占用 Σ(pool_size + max_overflow)，乘以 WEB_CONCURRENCY 个进程；
+    超出时打印按当前进程数均分后的建议值。
+    """
+    if engine.dialect.name != "postgresql":
+        return
+
+    with engine.connect() as connection:
+        max_connections = int(connection.execute(text("SHOW max_connections")).scalar())
+        reserved = int(
+            connection.execute(text("SHOW superuser_reserved_connections")).scalar()
+        )
+    available = max_connections - reserved
+
+    # 同步引擎（迁移、保留任务）+ 异步主库连接池；从库有各自的 max_connections
+    per_process = (settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW) * 2
+    required = per_process * settings.WEB_CONCURRENCY
+    if required <= available:
+        print(
+            f"📊 数据库连接预算: {required}/{available} "
+            f"({settings.WEB_CONCURRENCY} 个进程 × {per_process})"
+        )
+        return
+
+    # 常驻连接和溢出连接按 1:2 分配
+    per_pool = max(available // (settings.WEB_CONCURRENCY * 2), 1)
+    suggested_size = max(per_pool // 3, 1)
+    print(
+        f"⚠️ 连接池上限 {required} 超过数据库可用连接数 {available}，"
+        f"高峰时会出现获取连接超时。建议 DB_POOL_SIZE={suggested_size} "
+        f"DB_MAX_OVERFLOW={max(per_pool - suggested_size, 0)}，"
+        "或在前面加 PgBouncer"
+    )
@@ -1,17 +1,37 @@
 from fastapi import FastAPI, Request, Depends, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import (
+    HTMLResponse,
+    ORJSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+)
 from starlette.middleware.sessions import SessionMiddleware
 from sqlalchemy.orm import Session
+import asyncio
+import hmac
 import uvicorn
 
-from database.models import init_db, get_db, User, UserConfig
+from database.models import (
+    init_db,
+    get_db,
+    engine,
+    async_engine,
+    async_read_engines,
+    User,
+    UserConfig,
+)
+from database.metrics import check_pool_budget, render_prometheus
 from config import settings
+from utils.compression import CompressionMiddleware
+from utils.templates import STATIC_DIR, CachedStaticFiles, preload_templates, templates
 
 # 初始化 FastAPI 应用
+# JSON 响应默认用 orjson 序列化（配合 response_model，不经过 jsonable_encoder）
 app = FastAPI(
-    title=settings.APP_NAME, description="Outlook 邮件自动处理工具", version="1.0.0"
+    title=settings.APP_NAME,
+    description="Outlook 邮件自动处理工具",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 # 添加 Session 中间件（用于 OAuth state 验证和用户登录状态）
@@ -21,16 +41,23 @@ app.add_middleware(
     max_age=3600 * 24 * 7,  # 7 天有效期
 )
 
-# 静态文件和模板
-try:
-    app.mount("/static", StaticFiles(directory="static"), name="static")
-except:
-    pass  # 目录不存在时跳过
+# 响应压缩（最外层，压缩最终输出）
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+    gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+    brotli_quality=settings.COMPRESSION_BROTLI_QUALITY,
+)
 
-templates = Jinja2Templates(directory="templates")
+# 静态文件和模板（模板环境与控制台、邮件共用，见 utils/templates.py）
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
 
 # 导入路由
 from routers import auth, dashboard, api
+from services.outbox import run_outbox_worker
+from services.retention import run_retention_worker
+from services.token_refresh import run_token_refresh_worker
+from utils.token_cache import token_cache
 
 app.include_router(auth.router, prefix="/auth", tags=["认证"])
 app.include_router(dashboard.router, prefix="/dashboard", tags=["控制台"])
@@ -40,25 +67,68 @@ app.include_router(api.router, prefix="/api", tags=["API"])
 @app.on_event("startup")
 async def startup_event():
     """应用启动时初始化数据库"""
-    import time
+    # 抓取 / 处理任务的进度和取消句柄在进程内，多进程时需要 Redis 共享（services/run_registry.py）
+    if settings.WEB_CONCURRENCY > 1 and not settings.REDIS_URL:
+        raise RuntimeError(
+            f"WEB_CONCURRENCY={settings.WEB_CONCURRENCY} 时必须配置 REDIS_URL，"
+            "否则任务进度和取消请求可能落到没有该任务的进程；单进程部署请设置 WEB_CONCURRENCY=1"
+        )
+
     max_retries = 3
     retry_delay = 2
 
     for attempt in range(max_retries):
         try:
-            init_db()
+            # 迁移使用同步引擎，放到线程中执行
+            await asyncio.to_thread(init_db)
+            # 预编译模板（写入字节码缓存）
+            preload_templates()
+            # 检查连接池总量是否超过数据库 max_connections
+            try:
+                await asyncio.to_thread(check_pool_budget, engine)
+            except Exception as e:
+                print(f"连接预算检查失败: {e}")
+            # 启动发件箱后台发送
+            app.state.outbox_task = asyncio.create_task(run_outbox_worker())
+            # 数据保留（分区维护、过期数据归档）
+            app.state.retention_task = asyncio.create_task(run_retention_worker())
+            # 过期前主动刷新 OAuth Token
+            app.state.token_refresh_task = asyncio.create_task(
+                run_token_refresh_worker()
+            )
+            # 其他进程刷新 / 登出时删除本进程的 Token 缓存
+            app.state.token_cache_task = asyncio.create_task(
+                token_cache.run_invalidation_listener()
+            )
             print(f"🚀 {settings.APP_NAME} 启动成功！")
             print(f"📊 数据库: {settings.DATABASE_URL[:30]}...")
             break
         except Exception as e:
             if attempt < max_retries - 1:
                 print(f"⚠️ 数据库连接失败 (尝试 {attempt + 1}/{max_retries}): {str(e)[:100]}")
-                time.sleep(retry_delay)
+                await asyncio.sleep(retry_delay)
             else:
                 print(f"❌ 数据库连接失败: {str(e)[:200]}")
                 raise
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """停止后台任务并关闭数据库连接池"""
+    for name in (
+        "outbox_task",
+        "retention_task",
+        "token_refresh_task",
+        "token_cache_task",
+    ):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    await async_engine.dispose()
+    for read_engine in async_read_engines:
+        await read_engine.dispose()
+
+
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
     """首页 - 重定向到登录或控制台"""
@@ -73,6 +143,27 @@ async def health_check():
     return {"status": "ok", "app": settings.APP_NAME}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    """
+    数据库连接池和查询指标（Prometheus 文本格式）
+
+    指标包含慢查询次数和连接池状态，需要 METRICS_TOKEN（Authorization: Bearer）；
+    未配置或令牌不符时返回 404，不暴露接口是否存在。
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    expected = settings.METRICS_TOKEN.encode()
+    if (
+        not expected
+        or scheme.lower() != "bearer"
+        or not hmac.compare_digest(token.strip().encode(), expected)
+    ):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(
+        render_prometheus(), media_type="text/plain; version=0.0.4"
+    )
+
+
 if __name__ == "__main__":
     import os
     port = int(os.getenv("PORT", 8000))
@@ -0,0 +1,74 @@
+from alembic import context
+from sqlalchemy import create_engine, pool
+
+from database.models import Base, DATABASE_URL
+
+config = context.config
+target_metadata = Base.metadata
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """忽略 ORM 中未声明的全文检索对象（PostgreSQL 生成列 / SQLite FTS5 表）"""
+    if type_ == "table" and name.startswith("email_search_fts"):
+        return False
+    if type_ == "column" and name == "search_vector":
+        return False
+    if type_ == "index" and name == "ix_email_search_vector":
+        return False
+    return True
+
+
+def run_migrations_offline():
+    """生成 SQL 脚本（alembic upgrade head --sql）"""
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        include_object=include_object,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    """连接数据库执行迁移；应用启动时由 init_db 传入已有连接"""
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        _run(connection)
+        return
+
+    engine = create_engine(DATABASE_URL, poolclass=pool.NullPool)
+    with engine.connect() as connection:
+        _run(connection)
+
+
+def _run(connection):
+    is_sqlite = connection.dialect.name == "sqlite"
+    if is_sqlite:
+        # batch 模式会重建表，开启外键时 DROP TABLE 会级联删除子表数据
+        connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        connection.commit()
+
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        include_object=include_object,
+        render_as_batch=is_sqlite,
+    )
+
+    try:
+        with context.begin_transaction():
+            context.run_migrations()
+    finally:
+        if is_sqlite:
+            connection.commit()
+            connection.exec_driver_sql("PRAGMA foreign_keys=ON")
+            connection.commit()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
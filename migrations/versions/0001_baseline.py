@@ -0,0 +1,112 @@
+"""baseline schema (create_all 时代的表结构)
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19
+
+已经用 create_all 建表的数据库会在启动时被自动 stamp 到该版本。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("name", sa.String(), nullable=True),
+        sa.Column("access_token", sa.Text(), nullable=True),
+        sa.Column("refresh_token", sa.Text(), nullable=True),
+        sa.Column("token_expires_at", sa.DateTime(), nullable=True),
+        sa.Column("is_active", sa.Boolean(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("last_login", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    op.create_table(
+        "user_configs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), unique=True),
+        sa.Column("days_to_scrape", sa.Integer(), nullable=True),
+        sa.Column("folders_to_scrape", sa.JSON(), nullable=True),
+        sa.Column("sender_filter", sa.JSON(), nullable=True),
+        sa.Column("keyword_filter", sa.JSON(), nullable=True),
+        sa.Column("only_unread", sa.Boolean(), nullable=True),
+        sa.Column("include_attachments", sa.Boolean(), nullable=True),
+        sa.Column("smtp_recipient", sa.String(), nullable=True),
+        sa.Column("ai_enabled", sa.Boolean(), nullable=True),
+        sa.Column("ai_mode", sa.String(), nullable=True),
+        sa.Column("target_language", sa.String(), nullable=True),
+        sa.Column("auto_fetch", sa.Boolean(), nullable=True),
+        sa.Column("fetch_interval_hours", sa.Integer(), nullable=True),
+    )
+    op.create_index("ix_user_configs_id", "user_configs", ["id"])
+
+    op.create_table(
+        "emails",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("message_id", sa.String(), nullable=True),
+        sa.Column("subject", sa.String(), nullable=True),
+        sa.Column("sender_email", sa.String(), nullable=True),
+        sa.Column("sender_name", sa.String(), nullable=True),
+        sa.Column("received_at", sa.DateTime(), nullable=True),
+        sa.Column("body_html", sa.Text(), nullable=True),
+        sa.Column("body_text", sa.Text(), nullable=True),
+        sa.Column("has_attachments", sa.Boolean(), nullable=True),
+        sa.Column("attachments", sa.JSON(), nullable=True),
+        sa.Column("is_read", sa.Boolean(), nullable=True),
+        sa.Column("is_processed", sa.Boolean(), nullable=True),
+        sa.Column("processed_at", sa.DateTime(), nullable=True),
+        sa.Column("processed_content", sa.Text(), nullable=True),
+        sa.Column("sent", sa.Boolean(), nullable=True),
+        sa.Column("sent_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_emails_id", "emails", ["id"])
+    op.create_index("ix_emails_message_id", "emails", ["message_id"], unique=True)
+
+    op.create_table(
+        "send_logs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column(
+            "email_id", sa.Integer(), sa.ForeignKey("emails.id"), nullable=True
+        ),
+        sa.Column("recipient", sa.String(), nullable=False),
+        sa.Column("subject", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("error_message", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_send_logs_id", "send_logs", ["id"])
+
+    op.create_table(
+        "fetch_logs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("total_emails", sa.Integer(), nullable=True),
+        sa.Column("new_emails", sa.Integer(), nullable=True),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("error_message", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_fetch_logs_id", "fetch_logs", ["id"])
+
+
+def downgrade():
+    op.drop_table("fetch_logs")
+    op.drop_table("send_logs")
+    op.drop_table("emails")
+    op.drop_table("user_configs")
+    op.drop_table("users")
@@ -0,0 +1,64 @@
+"""attachment inline threshold and outbox table
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19
+
+这两处改动早于迁移工具引入，部分数据库可能已由 create_all 建好，
+因此先检查是否存在。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    columns = {c["name"] for c in inspector.get_columns("user_configs")}
+    if "attachment_inline_max_mb" not in columns:
+        op.add_column(
+            "user_configs",
+            sa.Column("attachment_inline_max_mb", sa.Integer(), nullable=True),
+        )
+
+    if not inspector.has_table("outbox"):
+        op.create_table(
+            "outbox",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+            sa.Column(
+                "email_id",
+                sa.Integer(),
+                sa.ForeignKey("emails.id", ondelete="CASCADE"),
+                nullable=True,
+            ),
+            sa.Column("idempotency_key", sa.String(), nullable=False, unique=True),
+            sa.Column("recipient", sa.String(), nullable=False),
+            sa.Column("subject", sa.String(), nullable=False),
+            sa.Column("body_html", sa.Text(), nullable=True),
+            sa.Column("body_text", sa.Text(), nullable=True),
+            sa.Column("attachments", sa.JSON(), nullable=True),
+            sa.Column("status", sa.String(), nullable=True),
+            sa.Column("attempts", sa.Integer(), nullable=True),
+            sa.Column("next_attempt_at", sa.DateTime(), nullable=True),
+            sa.Column("claimed_at", sa.DateTime(), nullable=True),
+            sa.Column("last_error", sa.Text(), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+            sa.Column("sent_at", sa.DateTime(), nullable=True),
+        )
+        op.create_index("ix_outbox_id", "outbox", ["id"])
+        op.create_index("ix_outbox_user_id", "outbox", ["user_id"])
+        op.create_index("ix_outbox_status", "outbox", ["status"])
+
+
+def downgrade():
+    op.drop_table("outbox")
+    with op.batch_alter_table("user_configs") as batch_op:
+        batch_op.drop_column("attachment_inline_max_mb")
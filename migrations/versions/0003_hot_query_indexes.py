@@ -0,0 +1,81 @@
+"""composite and partial indexes for hot email / log queries
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19
+
+- emails (user_id, received_at DESC, id DESC): 邮件列表排序
+- emails (user_id, id) WHERE 未处理且未发送: 待处理邮件（只索引待处理行）
+- fetch_logs / send_logs (user_id, created_at DESC): 按用户查看日志
+- outbox (next_attempt_at, id) WHERE pending/sending: 发件箱认领
+
+PostgreSQL 上使用 CREATE INDEX CONCURRENTLY，不阻塞线上写入。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+# 谓词需与 ORM 生成的 SQL 一致（SQLite 中布尔值渲染为 0/1）
+PENDING_WHERE = sa.text("is_processed = false AND sent = false")
+PENDING_WHERE_SQLITE = sa.text("is_processed = 0 AND sent = 0")
+OUTBOX_DUE_WHERE = sa.text("status IN ('pending', 'sending')")
+
+
+def upgrade():
+    is_pg = op.get_bind().dialect.name == "postgresql"
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_emails_user_received",
+            "emails",
+            ["user_id", sa.text("received_at DESC"), sa.text("id DESC")],
+            postgresql_concurrently=is_pg,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_emails_user_pending",
+            "emails",
+            ["user_id", "id"],
+            postgresql_where=PENDING_WHERE,
+            sqlite_where=PENDING_WHERE_SQLITE,
+            postgresql_concurrently=is_pg,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_fetch_logs_user_created",
+            "fetch_logs",
+            ["user_id", sa.text("created_at DESC")],
+            postgresql_concurrently=is_pg,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_send_logs_user_created",
+            "send_logs",
+            ["user_id", sa.text("created_at DESC")],
+            postgresql_concurrently=is_pg,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_outbox_due",
+            "outbox",
+            ["next_attempt_at", "id"],
+            postgresql_where=OUTBOX_DUE_WHERE,
+            sqlite_where=OUTBOX_DUE_WHERE,
+            postgresql_concurrently=is_pg,
+            if_not_exists=True,
+        )
+
+
+def downgrade():
+    op.drop_index("ix_outbox_due", table_name="outbox")
+    op.drop_index("ix_send_logs_user_created", table_name="send_logs")
+    op.drop_index("ix_fetch_logs_user_created", table_name="fetch_logs")
+    op.drop_index("ix_emails_user_pending", table_name="emails")
+    op.drop_index("ix_emails_user_received", table_name="emails")
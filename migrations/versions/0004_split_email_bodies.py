@@ -0,0 +1,157 @@
+"""move email bodies to a compressed side table
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19
+
+body_html / body_text / processed_content 从 emails 移到 email_bodies，
+zlib 压缩存储；emails 新增 body_preview 供列表使用。
+
+PostgreSQL 上删除列不会立即归还空间，迁移完成后可在低峰期执行
+VACUUM FULL emails（会锁表）或使用 pg_repack 收缩表文件。
+"""
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+BATCH_SIZE = 500
+PREVIEW_LENGTH = 255
+
+emails = sa.table(
+    "emails",
+    sa.column("id", sa.Integer),
+    sa.column("body_html", sa.Text),
+    sa.column("body_text", sa.Text),
+    sa.column("processed_content", sa.Text),
+    sa.column("body_preview", sa.String),
+)
+
+email_bodies = sa.table(
+    "email_bodies",
+    sa.column("email_id", sa.Integer),
+    sa.column("body_html", sa.LargeBinary),
+    sa.column("body_text", sa.LargeBinary),
+    sa.column("processed_content", sa.LargeBinary),
+)
+
+
+def _compress(value):
+    return zlib.compress(value.encode("utf-8"), 6) if value is not None else None
+
+
+def _decompress(value):
+    return zlib.decompress(value).decode("utf-8") if value is not None else None
+
+
+def upgrade():
+    op.create_table(
+        "email_bodies",
+        sa.Column(
+            "email_id",
+            sa.Integer(),
+            sa.ForeignKey("emails.id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column("body_html", sa.LargeBinary(), nullable=True),
+        sa.Column("body_text", sa.LargeBinary(), nullable=True),
+        sa.Column("processed_content", sa.LargeBinary(), nullable=True),
+    )
+    op.add_column("emails", sa.Column("body_preview", sa.String(255), nullable=True))
+
+    # 分批搬迁，避免一次性读入整张表
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(
+                emails.c.id,
+                emails.c.body_html,
+                emails.c.body_text,
+                emails.c.processed_content,
+            )
+            .where(emails.c.id > last_id)
+            .order_by(emails.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+
+        bind.execute(
+            email_bodies.insert(),
+            [
+                {
+                    "email_id": row.id,
+                    "body_html": _compress(row.body_html),
+                    "body_text": _compress(row.body_text),
+                    "processed_content": _compress(row.processed_content),
+                }
+                for row in rows
+            ],
+        )
+        bind.execute(
+            emails.update()
+            .where(emails.c.id == sa.bindparam("_id"))
+            .values(body_preview=sa.bindparam("_preview")),
+            [
+                {"_id": row.id, "_preview": (row.body_text or "")[:PREVIEW_LENGTH]}
+                for row in rows
+            ],
+        )
+        last_id = rows[-1].id
+
+    with op.batch_alter_table("emails") as batch_op:
+        batch_op.drop_column("body_html")
+        batch_op.drop_column("body_text")
+        batch_op.drop_column("processed_content")
+
+
+def downgrade():
+    with op.batch_alter_table("emails") as batch_op:
+        batch_op.add_column(sa.Column("body_html", sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column("body_text", sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column("processed_content", sa.Text(), nullable=True))
+
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(email_bodies)
+            .where(email_bodies.c.email_id > last_id)
+            .order_by(email_bodies.c.email_id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+
+        bind.execute(
+            emails.update()
+            .where(emails.c.id == sa.bindparam("_id"))
+            .values(
+                body_html=sa.bindparam("_html"),
+                body_text=sa.bindparam("_text"),
+                processed_content=sa.bindparam("_processed"),
+            ),
+            [
+                {
+                    "_id": row.email_id,
+                    "_html": _decompress(row.body_html),
+                    "_text": _decompress(row.body_text),
+                    "_processed": _decompress(row.processed_content),
+                }
+                for row in rows
+            ],
+        )
+        last_id = rows[-1].email_id
+
+    with op.batch_alter_table("emails") as batch_op:
+        batch_op.drop_column("body_preview")
+    op.drop_table("email_bodies")
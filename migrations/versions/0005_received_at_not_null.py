@@ -0,0 +1,34 @@
+"""backfill emails.received_at and make it NOT NULL
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19
+
+keyset 分页按 (received_at, id) 比较，NULL 会打乱顺序，
+缺失的接收时间用 created_at 补齐。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "UPDATE emails SET received_at = COALESCE(created_at, CURRENT_TIMESTAMP) "
+        "WHERE received_at IS NULL"
+    )
+    with op.batch_alter_table("emails") as batch_op:
+        batch_op.alter_column(
+            "received_at", existing_type=sa.DateTime(), nullable=False
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("emails") as batch_op:
+        batch_op.alter_column("received_at", existing_type=sa.DateTime(), nullable=True)
@@ -0,0 +1,194 @@
+"""full-text search table for fetched emails
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19
+
+email_search 保存主题、发件人和清洗后的正文（email_bodies 为压缩存储，无法直接建索引）。
+
+- PostgreSQL: 生成列 search_vector (tsvector, 需要 PostgreSQL 12+) + GIN 索引，
+  权重 主题 A / 发件人 B / 正文 C
+- SQLite: FTS5 外部内容表 email_search_fts，由触发器与 email_search 保持同步
+
+已有邮件从 email_bodies 分批回填。
+"""
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+from utils.text import html_to_text
+
+
+# revision identifiers, used by Alembic.
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+BATCH_SIZE = 500
+BODY_MAX_CHARS = 20000
+
+SEARCH_VECTOR = """
+    setweight(to_tsvector('simple', coalesce(subject, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(sender, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(body, '')), 'C')
+"""
+
+SQLITE_FTS = [
+    """
+    CREATE VIRTUAL TABLE email_search_fts USING fts5(
+        subject, sender, body,
+        content='email_search', content_rowid='email_id', tokenize='unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER email_search_ai AFTER INSERT ON email_search BEGIN
+        INSERT INTO email_search_fts(rowid, subject, sender, body)
+        VALUES (new.email_id, new.subject, new.sender, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER email_search_ad AFTER DELETE ON email_search BEGIN
+        INSERT INTO email_search_fts(email_search_fts, rowid, subject, sender, body)
+        VALUES ('delete', old.email_id, old.subject, old.sender, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER email_search_au AFTER UPDATE ON email_search BEGIN
+        INSERT INTO email_search_fts(email_search_fts, rowid, subject, sender, body)
+        VALUES ('delete', old.email_id, old.subject, old.sender, old.body);
+        INSERT INTO email_search_fts(rowid, subject, sender, body)
+        VALUES (new.email_id, new.subject, new.sender, new.body);
+    END
+    """,
+]
+
+emails = sa.table(
+    "emails",
+    sa.column("id", sa.Integer),
+    sa.column("user_id", sa.Integer),
+    sa.column("subject", sa.String),
+    sa.column("sender_email", sa.String),
+    sa.column("sender_name", sa.String),
+)
+
+email_bodies = sa.table(
+    "email_bodies",
+    sa.column("email_id", sa.Integer),
+    sa.column("body_html", sa.LargeBinary),
+    sa.column("body_text", sa.LargeBinary),
+)
+
+email_search = sa.table(
+    "email_search",
+    sa.column("email_id", sa.Integer),
+    sa.column("user_id", sa.Integer),
+    sa.column("subject", sa.Text),
+    sa.column("sender", sa.Text),
+    sa.column("body", sa.Text),
+)
+
+
+def _decompress(value):
+    return zlib.decompress(value).decode("utf-8") if value is not None else None
+
+
+def _sender(name, address):
+    parts = [name or "", address or ""]
+    if address and "@" in address:
+        parts.extend(address.split("@", 1))
+    return " ".join(p for p in parts if p)
+
+
+def upgrade():
+    bind = op.get_bind()
+    dialect = bind.dialect.name
+
+    op.create_table(
+        "email_search",
+        sa.Column(
+            "email_id",
+            sa.Integer(),
+            sa.ForeignKey("emails.id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("subject", sa.Text(), nullable=True),
+        sa.Column("sender", sa.Text(), nullable=True),
+        sa.Column("body", sa.Text(), nullable=True),
+    )
+
+    if dialect == "postgresql":
+        op.execute(
+            "ALTER TABLE email_search ADD COLUMN search_vector tsvector "
+            f"GENERATED ALWAYS AS ({SEARCH_VECTOR}) STORED"
+        )
+    elif dialect == "sqlite":
+        for statement in SQLITE_FTS:
+            op.execute(statement)
+
+    # 回填已有邮件
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(
+                emails.c.id,
+                emails.c.user_id,
+                emails.c.subject,
+                emails.c.sender_email,
+                emails.c.sender_name,
+                email_bodies.c.body_html,
+                email_bodies.c.body_text,
+            )
+            .select_from(
+                emails.outerjoin(email_bodies, email_bodies.c.email_id == emails.c.id)
+            )
+            .where(emails.c.id > last_id, emails.c.user_id.isnot(None))
+            .order_by(emails.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+
+        bind.execute(
+            email_search.insert(),
+            [
+                {
+                    "email_id": row.id,
+                    "user_id": row.user_id,
+                    "subject": row.subject or "",
+                    "sender": _sender(row.sender_name, row.sender_email),
+                    "body": (
+                        html_to_text(_decompress(row.body_html))
+                        or html_to_text(_decompress(row.body_text))
+                    )[:BODY_MAX_CHARS],
+                }
+                for row in rows
+            ],
+        )
+        last_id = rows[-1].id
+
+    # 回填完成后再建 GIN 索引
+    if dialect == "postgresql":
+        op.create_index(
+            "ix_email_search_vector",
+            "email_search",
+            ["search_vector"],
+            postgresql_using="gin",
+        )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "postgresql":
+        op.drop_index("ix_email_search_vector", table_name="email_search")
+    elif dialect == "sqlite":
+        op.execute("DROP TRIGGER IF EXISTS email_search_au")
+        op.execute("DROP TRIGGER IF EXISTS email_search_ad")
+        op.execute("DROP TRIGGER IF EXISTS email_search_ai")
+        op.execute("DROP TABLE IF EXISTS email_search_fts")
+
+    op.drop_table("email_search")
@@ -0,0 +1,235 @@
+"""monthly partitions for send_logs / fetch_logs
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19
+
+PostgreSQL 上把 send_logs / fetch_logs 重建为按 created_at 月度分区的表
+（主键变为 (id, created_at)），过期数据由 services/retention 整个分区导出后删除。
+覆盖已有数据到未来 3 个月的分区会一并创建，另建 DEFAULT 分区兜底。
+
+emails 不做分区：email_bodies / email_search / outbox / send_logs 通过外键引用
+emails.id，message_id 也需全表唯一，分区表的主键和唯一约束必须包含分区键，
+因此 emails 由保留任务分批删除。
+
+同时：
+- created_at 回填并改为 NOT NULL（分区键）
+- send_logs.email_id 外键改为 ON DELETE SET NULL，删除邮件时保留发送日志
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+PREMAKE_MONTHS = 3
+
+
+def _send_logs_columns(email_fk_ondelete):
+    return [
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column(
+            "email_id",
+            sa.Integer(),
+            sa.ForeignKey("emails.id", ondelete=email_fk_ondelete),
+            nullable=True,
+        ),
+        sa.Column("recipient", sa.String(), nullable=False),
+        sa.Column("subject", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("error_message", sa.Text(), nullable=True),
+    ]
+
+
+def _send_logs_indexes():
+    return [
+        sa.Index("ix_send_logs_id", "id"),
+        sa.Index("ix_send_logs_user_created", "user_id", sa.text("created_at DESC")),
+    ]
+
+
+def _fetch_logs_columns():
+    return [
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("total_emails", sa.Integer(), nullable=True),
+        sa.Column("new_emails", sa.Integer(), nullable=True),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("error_message", sa.Text(), nullable=True),
+    ]
+
+
+TABLES = {
+    "send_logs": lambda: _send_logs_columns("SET NULL"),
+    "fetch_logs": _fetch_logs_columns,
+}
+
+
+def _add_months(value: datetime, months: int) -> datetime:
+    month = value.month - 1 + months
+    return value.replace(
+        year=value.year + month // 12, month=month % 12 + 1, day=1,
+        hour=0, minute=0, second=0, microsecond=0,
+    )
+
+
+def _partition_table(table: str, bind):
+    legacy = f"{table}_legacy"
+    sequence = bind.execute(
+        sa.text(f"SELECT pg_get_serial_sequence('{table}', 'id')")
+    ).scalar()
+
+    # 索引名在 schema 内唯一，先给旧表的索引改名
+    op.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    op.execute(f"ALTER INDEX IF EXISTS {table}_pkey RENAME TO {legacy}_pkey")
+    op.execute(f"ALTER INDEX IF EXISTS ix_{table}_id RENAME TO ix_{legacy}_id")
+    op.execute(
+        f"ALTER INDEX IF EXISTS ix_{table}_user_created "
+        f"RENAME TO ix_{legacy}_user_created"
+    )
+
+    op.create_table(
+        table,
+        sa.Column(
+            "id",
+            sa.Integer(),
+            server_default=sa.text(f"nextval('{sequence}'::regclass)"),
+            nullable=False,
+        ),
+        *TABLES[table](),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id", "created_at"),
+        postgresql_partition_by="RANGE (created_at)",
+    )
+    op.create_index(f"ix_{table}_id", table, ["id"])
+    op.create_index(
+        f"ix_{table}_user_created", table, ["user_id", sa.text("created_at DESC")]
+    )
+
+    # 覆盖已有数据到未来几个月的分区
+    oldest = bind.execute(sa.text(f"SELECT min(created_at) FROM {legacy}")).scalar()
+    now = datetime.utcnow()
+    month = _add_months(oldest or now, 0)
+    last = _add_months(now, PREMAKE_MONTHS)
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE {table}_p{month:%Y_%m} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') "
+            f"TO ('{_add_months(month, 1):%Y-%m-%d}')"
+        )
+        month = _add_months(month, 1)
+    op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+    columns = ", ".join(
+        ["id"] + [c.name for c in TABLES[table]()] + ["created_at"]
+    )
+    select_columns = columns.replace(
+        "created_at", "COALESCE(created_at, CURRENT_TIMESTAMP)"
+    )
+    op.execute(
+        f"INSERT INTO {table} ({columns}) SELECT {select_columns} FROM {legacy}"
+    )
+
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+    op.execute(f"DROP TABLE {legacy}")
+
+
+def _unpartition_table(table: str, bind):
+    partitioned = f"{table}_partitioned"
+    sequence = bind.execute(
+        sa.text(f"SELECT pg_get_serial_sequence('{table}', 'id')")
+    ).scalar()
+
+    op.execute(f"ALTER TABLE {table} RENAME TO {partitioned}")
+    op.execute(f"ALTER INDEX IF EXISTS {table}_pkey RENAME TO {partitioned}_pkey")
+    op.execute(f"ALTER INDEX IF EXISTS ix_{table}_id RENAME TO ix_{partitioned}_id")
+    op.execute(
+        f"ALTER INDEX IF EXISTS ix_{table}_user_created "
+        f"RENAME TO ix_{partitioned}_user_created"
+    )
+
+    columns = (
+        _send_logs_columns(None) if table == "send_logs" else _fetch_logs_columns()
+    )
+    op.create_table(
+        table,
+        sa.Column(
+            "id",
+            sa.Integer(),
+            server_default=sa.text(f"nextval('{sequence}'::regclass)"),
+            primary_key=True,
+        ),
+        *columns,
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index(f"ix_{table}_id", table, ["id"])
+    op.create_index(
+        f"ix_{table}_user_created", table, ["user_id", sa.text("created_at DESC")]
+    )
+
+    names = ", ".join(["id"] + [c.name for c in columns] + ["created_at"])
+    op.execute(f"INSERT INTO {table} ({names}) SELECT {names} FROM {partitioned}")
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+    op.execute(f"DROP TABLE {partitioned}")
+
+
+def upgrade():
+    bind = op.get_bind()
+
+    if bind.dialect.name == "postgresql":
+        for table in TABLES:
+            _partition_table(table, bind)
+        return
+
+    # 其他数据库：只回填 created_at 并修改外键
+    for table in TABLES:
+        op.execute(
+            f"UPDATE {table} SET created_at = CURRENT_TIMESTAMP "
+            "WHERE created_at IS NULL"
+        )
+
+    # copy_from 不反射索引，需要一并声明
+    send_logs = sa.Table(
+        "send_logs",
+        sa.MetaData(),
+        sa.Column("id", sa.Integer(), primary_key=True),
+        *_send_logs_columns("SET NULL"),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        *_send_logs_indexes(),
+    )
+    with op.batch_alter_table(
+        "send_logs", copy_from=send_logs, recreate="always"
+    ) as batch_op:
+        batch_op.alter_column("created_at", existing_type=sa.DateTime(), nullable=False)
+    with op.batch_alter_table("fetch_logs") as batch_op:
+        batch_op.alter_column("created_at", existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    bind = op.get_bind()
+
+    if bind.dialect.name == "postgresql":
+        for table in TABLES:
+            _unpartition_table(table, bind)
+        return
+
+    send_logs = sa.Table(
+        "send_logs",
+        sa.MetaData(),
+        sa.Column("id", sa.Integer(), primary_key=True),
+        *_send_logs_columns(None),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        *_send_logs_indexes(),
+    )
+    with op.batch_alter_table(
+        "send_logs", copy_from=send_logs, recreate="always"
+    ) as batch_op:
+        batch_op.alter_column("created_at", existing_type=sa.DateTime(), nullable=True)
+    with op.batch_alter_table("fetch_logs") as batch_op:
+        batch_op.alter_column("created_at", existing_type=sa.DateTime(), nullable=True)
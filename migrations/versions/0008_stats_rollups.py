@@ -0,0 +1,106 @@
+"""hourly and total fetch/send statistics
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19
+
+stats_hourly (user_id, hour) 和 stats_totals (user_id) 在写入日志时累加，
+/api/stats 只按主键读取，不扫描日志表。已有的 fetch_logs / send_logs 一次性汇总回填
+（耗时和延迟没有历史数据，从 0 开始累计）。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+COUNTERS = [
+    ("fetch_runs", sa.Integer()),
+    ("fetch_failed", sa.Integer()),
+    ("fetched", sa.Integer()),
+    ("new_emails", sa.Integer()),
+    ("processed", sa.Integer()),
+    ("process_failed", sa.Integer()),
+    ("sent", sa.Integer()),
+    ("send_failed", sa.Integer()),
+    ("fetch_ms", sa.BigInteger()),
+    ("send_ms", sa.BigInteger()),
+    ("delivery_delay_s", sa.BigInteger()),
+]
+
+
+def _counter_columns():
+    return [
+        sa.Column(name, type_, nullable=False, server_default="0")
+        for name, type_ in COUNTERS
+    ]
+
+
+def _hour(dialect: str) -> str:
+    """截断到整点；SQLite 上格式需与 SQLAlchemy 写入的 DateTime 字符串一致"""
+    if dialect == "postgresql":
+        return "date_trunc('hour', created_at)"
+    return "strftime('%Y-%m-%d %H:00:00.000000', created_at)"
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    op.create_table(
+        "stats_hourly",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("hour", sa.DateTime(), primary_key=True),
+        *_counter_columns(),
+    )
+    op.create_table(
+        "stats_totals",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        *_counter_columns(),
+    )
+
+    hour = _hour(dialect)
+    op.execute(
+        "INSERT INTO stats_hourly (user_id, hour, fetch_runs, fetch_failed, fetched, new_emails) "
+        f"SELECT user_id, {hour}, count(*), "
+        "sum(CASE WHEN status = 'failed' THEN 1 ELSE 0 END), "
+        "coalesce(sum(total_emails), 0), coalesce(sum(new_emails), 0) "
+        f"FROM fetch_logs WHERE user_id IS NOT NULL GROUP BY user_id, {hour}"
+    )
+    # SQLite 的 INSERT ... SELECT ... ON CONFLICT 要求 SELECT 带 WHERE 子句（消除语法歧义）
+    op.execute(
+        "INSERT INTO stats_hourly (user_id, hour, sent, send_failed) "
+        f"SELECT user_id, {hour}, "
+        "sum(CASE WHEN status = 'success' THEN 1 ELSE 0 END), "
+        "sum(CASE WHEN status = 'failed' THEN 1 ELSE 0 END) "
+        f"FROM send_logs WHERE user_id IS NOT NULL GROUP BY user_id, {hour} "
+        "ON CONFLICT (user_id, hour) DO UPDATE SET "
+        "sent = stats_hourly.sent + excluded.sent, "
+        "send_failed = stats_hourly.send_failed + excluded.send_failed"
+    )
+    processed_hour = hour.replace("created_at", "processed_at")
+    op.execute(
+        "INSERT INTO stats_hourly (user_id, hour, processed) "
+        f"SELECT user_id, {processed_hour}, count(*) FROM emails "
+        "WHERE user_id IS NOT NULL AND processed_at IS NOT NULL "
+        f"GROUP BY user_id, {processed_hour} "
+        "ON CONFLICT (user_id, hour) DO UPDATE SET "
+        "processed = stats_hourly.processed + excluded.processed"
+    )
+
+    names = ", ".join(name for name, _ in COUNTERS)
+    sums = ", ".join(f"sum({name})" for name, _ in COUNTERS)
+    op.execute(
+        f"INSERT INTO stats_totals (user_id, updated_at, {names}) "
+        f"SELECT user_id, CURRENT_TIMESTAMP, {sums} FROM stats_hourly GROUP BY user_id"
+    )
+
+
+def downgrade():
+    op.drop_table("stats_totals")
+    op.drop_table("stats_hourly")
@@ -0,0 +1,31 @@
+"""per-user data version counter
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19
+
+user_data_versions 记录每个用户邮件 / 配置的变更次数，只读接口据此生成 ETag。
+已有用户没有记录时版本视为 0，第一次变更时插入。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "user_data_versions",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("version", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table("user_data_versions")
@@ -0,0 +1,54 @@
+"""trigram indexes for CJK substring search
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19
+
+simple 分词把连续的汉字当作一个词，含中日韩文字的搜索词 / 关键词改用子串匹配
+（ILIKE，见 services/search.py）。PostgreSQL 上为 email_search 的主题、发件人和正文
+建 pg_trgm GIN 索引；没有 pg_trgm 扩展或没有创建权限时跳过，子串匹配仍可用，
+只是按用户扫描。SQLite 上不需要改动。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = ("subject", "sender", "body")
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+
+    with op.get_context().autocommit_block():
+        try:
+            op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except sa.exc.DBAPIError as e:
+            print(f"⚠️  无法启用 pg_trgm，中文子串搜索不使用索引: {e}")
+            return
+
+        for column in COLUMNS:
+            op.create_index(
+                f"ix_email_search_{column}_trgm",
+                "email_search",
+                [sa.text(f"{column} gin_trgm_ops")],
+                postgresql_using="gin",
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    for column in COLUMNS:
+        op.execute(f"DROP INDEX IF EXISTS ix_email_search_{column}_trgm")
@@ -1,79 +1,330 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database.models import get_db, Email, FetchLog, SendLog
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from sqlalchemy.orm import selectinload
+from database.models import (
+    AsyncSessionLocal,
+    get_async_db,
+    get_async_read_db,
+    mark_recent_write,
+    User,
+    Email,
+    FetchLog,
+    SendLog,
+    Outbox,
+)
 from routers.auth import get_current_user
+from routers.schemas import (
+    BulkMarkRequest,
+    BulkResult,
+    BulkSelection,
+    EmailDetail,
+    EmailListResponse,
+    FetchResult,
+    MessageResponse,
+    OutboxRetryResult,
+    ProcessResult,
+    SearchResponse,
+    StatsResponse,
+)
 from services.outlook import OutlookService
 from services.ai_processor import ai_processor
 from services.smtp_sender import smtp_sender
-from utils import decrypt_token, get_cached_token
+from services.outbox import enqueue_email, drain_outbox, is_enqueued
+from services.stats import record_stats, get_user_stats
+from services.data_version import bump_data_version
+from services.user_cache import user_cache
+from services.run_guard import run_guard
+from services.progress import ProgressRun
+from services.bulk import (
+    bulk_delete,
+    bulk_mark,
+    bulk_requeue,
+    selection_conditions,
+)
+from services.export import FORMATS, export_filename, iter_export, reserve_export_slot
+from services.search import (
+    build_search_document,
+    count_keyword_matches,
+    keyword_condition,
+    normalize_keywords,
+    search_emails,
+)
+from services.attachment_cache import (
+    attachment_cache,
+    make_attachment_link,
+    load_attachment_link,
+)
+from utils import get_access_token
+from utils.dates import to_naive_utc
+from utils.http_cache import conditional_request
+from utils.pagination import paginate_emails, estimate_email_count, InvalidCursor
+from config import settings
 from datetime import datetime
-import base64
-import httpx
+from typing import Optional
+import asyncio
+import orjson
+import time
 
 router = APIRouter()
 
 
-@router.get("/emails")
+# 邮件列表可选字段（fields 参数），只查询需要的列，不加载 ORM 对象
+EMAIL_LIST_FIELDS = {
+    "id": Email.id,
+    "message_id": Email.message_id,
+    "subject": Email.subject,
+    "sender_email": Email.sender_email,
+    "sender_name": Email.sender_name,
+    "received_at": Email.received_at,
+    "has_attachments": Email.has_attachments,
+    "is_read": Email.is_read,
+    "is_processed": Email.is_processed,
+    "sent": Email.sent,
+    "body_preview": Email.body_preview,
+}
+
+
+def _serialize_list_field(name: str, value):
+    if name == "received_at":
+        return value.isoformat() if value else None
+    if name == "body_preview" and value and len(value) > 200:
+        return value[:200] + "..."
+    return value
+
+
+@router.get("/emails", response_model=EmailListResponse)
 async def get_emails(
-    skip: int = 0,
+    request: Request,
     limit: int = 50,
+    cursor: Optional[str] = None,
+    skip: int = 0,
+    fields: Optional[str] = None,
+    with_total: bool = False,
     user=Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
 ):
-    """获取用户的邮件列表"""
-    emails = (
-        db.query(Email)
-        .filter(Email.user_id == user.id)
-        .order_by(Email.received_at.desc())
-        .offset(skip)
-        .limit(limit)
-        .all()
-    )
+    """
+    获取用户的邮件列表
 
-    return {
-        "total": len(emails),
+    cursor: 上一次响应中的 next_cursor / prev_cursor（keyset 分页）
+    skip: 旧的 OFFSET 分页参数，仅在未提供 cursor 时生效（已弃用）
+    fields: 逗号分隔的字段列表（如 id,subject,received_at），默认返回全部列表字段
+    with_total: 是否返回估算的邮件总数
+    """
+    # 数据版本未变时返回 304 / 缓存的响应，不再查询
+    cond = await conditional_request(request, db, user.id)
+    if cond.response is not None:
+        return cond.response
+
+    if fields:
+        names = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in names if f not in EMAIL_LIST_FIELDS]
+        if unknown:
+            raise HTTPException(
+                status_code=400, detail=f"不支持的字段: {', '.join(unknown)}"
+            )
+    else:
+        names = list(EMAIL_LIST_FIELDS)
+
+    limit = max(1, min(limit, 200))
+
+    # 分页键始终查询，输出时只返回请求的字段
+    columns = [EMAIL_LIST_FIELDS[name] for name in names]
+    columns += [Email.received_at.label("received_at"), Email.id.label("id")]
+    stmt = select(*columns).where(Email.user_id == user.id)
+
+    if skip and not cursor:
+        rows = (
+            await db.execute(
+                stmt.order_by(Email.received_at.desc(), Email.id.desc())
+                .offset(skip)
+                .limit(limit)
+            )
+        ).all()
+        next_cursor = prev_cursor = None
+    else:
+        try:
+            rows, next_cursor, prev_cursor = await paginate_emails(
+                db, stmt, cursor, limit
+            )
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    def page_link(page_cursor):
+        if not page_cursor:
+            return None
+        return str(
+            request.url.remove_query_params("skip").include_query_params(
+                cursor=page_cursor
+            )
+        )
+
+    result = {
+        "count": len(rows),
+        "estimated_total": await estimate_email_count(db, user.id)
+        if with_total
+        else None,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "next": page_link(next_cursor),
+        "prev": page_link(prev_cursor),
         "emails": [
             {
-                "id": e.id,
-                "message_id": e.message_id,
-                "subject": e.subject,
-                "sender_email": e.sender_email,
-                "sender_name": e.sender_name,
-                "received_at": e.received_at.isoformat() if e.received_at else None,
-                "has_attachments": e.has_attachments,
-                "is_read": e.is_read,
-                "is_processed": e.is_processed,
-                "sent": e.sent,
-                "body_preview": e.body_text[:200] + "..."
-                if e.body_text and len(e.body_text) > 200
-                else e.body_text,
+                name: _serialize_list_field(name, value)
+                for name, value in zip(names, row)
             }
-            for e in emails
+            for row in rows
         ],
     }
+    return cond.respond(result)
+
+
+@router.get("/search", response_model=SearchResponse)
+async def search(
+    q: str,
+    limit: int = 20,
+    offset: int = 0,
+    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    """
+    全文检索邮件（主题、发件人、正文），按相关度排序
+
+    q: 搜索词，支持 "短语"、OR（PostgreSQL 上还支持 -排除词）
+    返回的 subject_highlight / snippet 已做 HTML 转义，命中部分用 <mark> 包裹
+    """
+    q = q.strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="搜索词不能为空")
+
+    limit = max(1, min(limit, settings.SEARCH_MAX_RESULTS))
+    offset = max(0, offset)
+
+    results = await search_emails(db, user.id, q, limit=limit, offset=offset)
+
+    return {
+        "query": q,
+        "count": len(results),
+        "offset": offset,
+        "next_offset": offset + limit if len(results) == limit else None,
+        "results": results,
+    }
+
+
+@router.get("/stats", response_model=StatsResponse)
+async def get_stats(
+    hours: int = 24,
+    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    """
+    抓取/处理/发送统计
+
+    hours: 返回最近多少小时的逐小时数据（1-720）
+    数据来自写入时累加的汇总表，耗时与历史日志量无关
+    """
+    hours = max(1, min(hours, 720))
+    return await get_user_stats(db, user.id, hours)
+
+
+@router.get("/export")
+async def export_emails(
+    format: str = "ndjson",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    compress: bool = False,
+    user=Depends(get_current_user),
+):
+    """
+    流式导出当前用户的全部邮件
+
+    format: ndjson（每行一封邮件的 JSON）或 mbox（mboxrd，可直接导入邮件客户端）
+    since / until: 按收件时间筛选（since <= received_at < until）
+    compress: 为 true 时输出 .gz 文件
+    """
+    if format not in FORMATS:
+        raise HTTPException(
+            status_code=400, detail=f"不支持的导出格式，可选: {', '.join(FORMATS)}"
+        )
+    # 在返回响应前占用名额，同时到达的请求不会都通过检查
+    slot = reserve_export_slot()
+    if slot is None:
+        raise HTTPException(
+            status_code=429, detail="导出任务过多，请稍后重试", headers={"Retry-After": "30"}
+        )
+
+    filename = export_filename(format, compress)
+    return StreamingResponse(
+        iter_export(
+            user.id, format, since=since, until=until, compress=compress, slot=slot
+        ),
+        media_type="application/gzip" if compress else FORMATS[format][0],
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-store",
+        },
+        background=BackgroundTask(slot.release),
+    )
+
+
+async def _in_new_session(
+    func, user_id: int, progress: ProgressRun, connection: AsyncConnection
+):
+    """
+    在独立会话中运行任务（单飞任务可能比发起它的请求活得更久）
+
+    会话绑定在 run_guard 为任务打开的连接上（PostgreSQL 上该连接持有任务锁）
+    """
+    async with AsyncSessionLocal(bind=connection) as db:
+        user = await user_cache.get_user(db, user_id)
+        return await func(user, db, progress)
+
+
+@router.post(
+    "/fetch", response_model=FetchResult, response_model_exclude_unset=True
+)
+async def fetch_emails(request: Request, user=Depends(get_current_user)):
+    """手动触发邮件抓取（同一用户的并发触发合并为一次，返回同一结果）"""
+    # 任务在独立会话中写入，不经过 get_async_db，这里记录写入时间（开始和结束时）
+    mark_recent_write(request)
+    result = await run_guard.run(
+        "fetch",
+        user.id,
+        lambda progress, connection: _in_new_session(
+            _fetch_emails, user.id, progress, connection
+        ),
+    )
+    mark_recent_write(request)
+    return result
 
 
-@router.post("/fetch")
-async def fetch_emails(user=Depends(get_current_user), db: Session = Depends(get_db)):
-    """手动触发邮件抓取"""
-    from database.models import UserConfig
+async def _fetch_emails(
+    user: User, db: AsyncSession, progress: Optional[ProgressRun] = None
+):
+    """抓取邮件（进度事件见 GET /api/runs/fetch/events）"""
+    progress = progress or ProgressRun("fetch", user.id)
 
-    # 获取用户配置
-    config = db.query(UserConfig).filter(UserConfig.user_id == user.id).first()
+    # 获取用户配置（短期缓存）
+    config = await user_cache.get_config(db, user.id)
     if not config:
         raise HTTPException(status_code=400, detail="用户配置不存在")
 
     # 获取 access token
-    access_token = get_cached_token(user.id)
+    access_token = await get_access_token(user)
     if not access_token:
-        access_token = decrypt_token(user.access_token)
-        if not access_token:
-            raise HTTPException(status_code=401, detail="无法获取访问令牌，请重新登录")
+        raise HTTPException(status_code=401, detail="无法获取访问令牌，请重新登录")
 
     # 创建抓取日志
     fetch_log = FetchLog(user_id=user.id, status="running")
     db.add(fetch_log)
-    db.commit()
+    await db.commit()
+    fetch_log_id = fetch_log.id
+    user_id = user.id  # 回滚后 user 会过期，失败处理中不能再访问其属性
+    started = time.monotonic()
 
     try:
         # 创建 Outlook 服务实例
@@ -81,11 +332,16 @@ async def fetch_emails(user=Depends(get_current_user), db: Session = Depends(get
 
         total_emails = 0
         new_emails = 0
+        created = []
 
         # 遍历配置的文件夹
-        for folder in config.folders_to_scrape:
+        folders = config.folders_to_scrape
+        for folder_index, folder in enumerate(folders, 1):
+            progress.emit(
+                "folder", folder=folder, index=folder_index, total=len(folders)
+            )
             try:
-                # 获取邮件列表
+                # 获取邮件列表（一页）
                 messages = await outlook.get_messages(
                     folder=folder,
                     days=config.days_to_scrape,
@@ -95,23 +351,29 @@ async def fetch_emails(user=Depends(get_current_user), db: Session = Depends(get
                 )
 
                 total_emails += len(messages)
+                progress.count(listed=len(messages))
+                progress.emit("page", folder=folder, page=1, messages=len(messages))
 
                 for msg in messages:
                     message_id = msg.get("id")
+                    subject = msg.get("subject", "(无主题)")
 
                     # 检查是否已存在
-                    existing = (
-                        db.query(Email)
-                        .filter(
+                    existing = await db.scalar(
+                        select(Email.id).where(
                             Email.message_id == message_id, Email.user_id == user.id
                         )
-                        .first()
                     )
 
                     if existing:
+                        progress.count(skipped=1)
+                        progress.emit(
+                            "email", stage="exists", email_id=existing, subject=subject
+                        )
                         continue
 
                     # 获取邮件详情（包含完整正文）
+                    progress.emit("email", stage="download", subject=subject)
                     detail = await outlook.get_message_detail(message_id)
 
                     # 获取附件信息
@@ -126,19 +388,21 @@ async def fetch_emails(user=Depends(get_current_user), db: Session = Depends(get
                     email = Email(
                         user_id=user.id,
                         message_id=message_id,
-                        subject=msg.get("subject", "(无主题)"),
+                        subject=subject,
                         sender_email=from_addr.get("address", ""),
                         sender_name=from_addr.get("name", ""),
-                        received_at=datetime.fromisoformat(
-                            received_time.replace("Z", "+00:00")
+                        received_at=to_naive_utc(
+                            datetime.fromisoformat(received_time.replace("Z", "+00:00"))
                         )
                         if received_time
-                        else None,
+                        else datetime.utcnow(),
                         body_html=detail.get("body", {}).get("content", ""),
                         body_text=msg.get("bodyPreview", ""),
+                        body_preview=(msg.get("bodyPreview") or "")[:255],
                         has_attachments=msg.get("hasAttachments", False),
                         attachments=[
                             {
+                                "id": a.get("id"),
                                 "name": a.get("name"),
                                 "size": a.get("size"),
                                 "content_type": a.get("contentType"),
@@ -150,47 +414,146 @@ async def fetch_emails(user=Depends(get_current_user), db: Session = Depends(get
                         sent=False,
                     )
 
+                    # 检索记录（主题、发件人、清洗后的正文）
+                    email.search = build_search_document(
+                        user.id,
+                        email.subject,
+                        email.sender_name,
+                        email.sender_email,
+                        body_html=email.body_html,
+                        body_text=email.body_text,
+                    )
+
                     db.add(email)
+                    created.append(email)
                     new_emails += 1
+                    progress.count(new=1)
+                    progress.emit("email", stage="saved", subject=subject)
 
             except Exception as e:
                 print(f"抓取文件夹 {folder} 时出错: {e}")
+                progress.count(errors=1)
+                progress.emit("folder", folder=folder, stage="failed", error=str(e))
                 continue
 
-        db.commit()
+        if created:
+            await bump_data_version(db, user.id)
+        await db.commit()
 
         # 更新日志
         fetch_log.total_emails = total_emails
         fetch_log.new_emails = new_emails
         fetch_log.status = "success"
-        db.commit()
+        await record_stats(
+            db,
+            user.id,
+            fetch_runs=1,
+            fetched=total_emails,
+            new_emails=new_emails,
+            fetch_ms=(time.monotonic() - started) * 1000,
+        )
+        await db.commit()
 
-        return {"message": "抓取完成", "total": total_emails, "new": new_emails}
+        result = {"message": "抓取完成", "total": total_emails, "new": new_emails}
+
+        # 配置了关键词时，报告新邮件中会被处理的数量
+        if normalize_keywords(config.keyword_filter):
+            result["matched"] = await count_keyword_matches(
+                db, user.id, [email.id for email in created], config.keyword_filter
+            )
+
+        return result
+
+    except asyncio.CancelledError:
+        # 取消：未提交的新邮件回滚，日志标记为 cancelled
+        await db.rollback()
+        await db.execute(
+            update(FetchLog)
+            .where(FetchLog.id == fetch_log_id)
+            .values(status="cancelled", error_message="已取消")
+        )
+        await db.commit()
+        raise
 
     except Exception as e:
-        # 更新日志为失败
-        fetch_log.status = "failed"
-        fetch_log.error_message = str(e)
-        db.commit()
+        # 更新日志为失败：先回滚（出错的可能正是提交，如 IntegrityError，
+        # 会话处于需要回滚的状态），再按 ID 更新日志
+        await db.rollback()
+        await db.execute(
+            update(FetchLog)
+            .where(FetchLog.id == fetch_log_id)
+            .values(status="failed", error_message=str(e))
+        )
+        await record_stats(
+            db,
+            user_id,
+            fetch_runs=1,
+            fetch_failed=1,
+            fetch_ms=(time.monotonic() - started) * 1000,
+        )
+        await db.commit()
 
         raise HTTPException(status_code=500, detail=f"抓取失败: {str(e)}")
 
 
-@router.post("/process")
-async def process_emails(user=Depends(get_current_user), db: Session = Depends(get_db)):
+async def _iter_pending_email_ids(db: AsyncSession, pending: tuple):
+    """
+    按主键分批（keyset）遍历待处理邮件 ID
+
+    每批只查询 ID，邮件内容在认领时逐封加载，内存占用与积压数量无关；
+    批次之间会提交事务，因此不使用跨事务的服务端游标。
     """
-    处理邮件（AI + 发送）
+    last_id = 0
+    while True:
+        ids = (
+            await db.scalars(
+                select(Email.id)
+                .where(*pending, Email.id > last_id)
+                .order_by(Email.id)
+                .limit(settings.PROCESS_BATCH_SIZE)
+            )
+        ).all()
+        if not ids:
+            return
+
+        for email_id in ids:
+            yield email_id
+        last_id = ids[-1]
+
+
+@router.post(
+    "/process", response_model=ProcessResult, response_model_exclude_unset=True
+)
+async def process_emails(request: Request, user=Depends(get_current_user)):
+    """处理邮件（同一用户的并发触发合并为一次，避免重复发送）"""
+    mark_recent_write(request)
+    result = await run_guard.run(
+        "process",
+        user.id,
+        lambda progress, connection: _in_new_session(
+            _process_emails, user.id, progress, connection
+        ),
+    )
+    mark_recent_write(request)
+    return result
+
+
+async def _process_emails(
+    user: User, db: AsyncSession, progress: Optional[ProgressRun] = None
+):
+    """
+    处理邮件（AI + 发送，进度事件见 GET /api/runs/process/events）
 
     流程：
     1. 获取未处理且未发送的邮件
     2. AI 处理（翻译/摘要）
-    3. SMTP 发送
-    4. 更新状态
+    3. 渲染邮件，与处理状态在同一事务中写入发件箱
+    4. 发送发件箱中的邮件（失败的由后台 worker 退避重试）
     """
-    from database.models import UserConfig
+    progress = progress or ProgressRun("process", user.id)
 
-    # 获取用户配置
-    config = db.query(UserConfig).filter(UserConfig.user_id == user.id).first()
+    # 获取用户配置（短期缓存）
+    config = await user_cache.get_config(db, user.id)
     if not config:
         raise HTTPException(status_code=400, detail="用户配置不存在")
 
@@ -198,23 +561,57 @@ async def process_emails(user=Depends(get_current_user), db: Session = Depends(g
     if not config.smtp_recipient:
         raise HTTPException(status_code=400, detail="请先在配置中设置收件人邮箱")
 
-    # 获取未处理且未发送的邮件
-    emails = (
-        db.query(Email)
-        .filter(
-            Email.user_id == user.id, Email.is_processed == False, Email.sent == False
-        )
-        .all()
+    # 回滚会使会话中的对象过期，异步会话里再访问过期属性会报错；
+    # 配置从会话中分离，用户只使用 ID
+    db.expunge(config)
+    user_id = user.id
+
+    # 未处理且未发送的邮件
+    pending = (
+        Email.user_id == user_id,
+        Email.is_processed == False,
+        Email.sent == False,
     )
 
-    if not emails:
-        return {"message": "没有待处理的邮件", "processed": 0, "sent": 0}
+    # 关键词过滤：只处理命中任一关键词的邮件（走全文索引），其余保留为待处理
+    keyword_filter = keyword_condition(
+        db.bind.dialect.name, user_id, config.keyword_filter
+    )
+    if keyword_filter is not None:
+        pending += (keyword_filter,)
 
+    total_count = 0
     processed_count = 0
-    sent_count = 0
     errors = []
 
-    for email in emails:
+    async for email_id in _iter_pending_email_ids(db, pending):
+        # 认领：加行锁并跳过已被其他 worker 锁定的邮件，锁在本封邮件提交时释放
+        email = await db.scalar(
+            select(Email)
+            .where(Email.id == email_id, *pending)
+            .options(selectinload(Email.body))
+            .with_for_update(skip_locked=True)
+        )
+        if not email:
+            continue
+
+        total_count += 1
+        email_subject = email.subject
+
+        # 幂等键在入队时才会冲突，已入队的邮件在调用 AI 之前跳过，并同步处理状态
+        if await is_enqueued(db, email_id, config.smtp_recipient):
+            email.is_processed = True
+            email.processed_at = email.processed_at or datetime.utcnow()
+            await bump_data_version(db, user_id)
+            await db.commit()
+            errors.append(f"邮件 {email_id} 已在发件箱中，跳过处理")
+            progress.count(skipped=1)
+            progress.emit(
+                "email", stage="skipped", email_id=email_id, subject=email_subject
+            )
+            continue
+
+        progress.emit("email", stage="ai", email_id=email_id, subject=email_subject)
         try:
             # 1. AI 处理
             content_to_process = email.body_text or email.body_html or ""
@@ -229,118 +626,240 @@ async def process_emails(user=Depends(get_current_user), db: Session = Depends(g
                 # AI 关闭时，直接使用原文
                 processed_content = content_to_process
 
-            # 更新邮件处理状态
-            email.processed_content = processed_content
-            email.is_processed = True
-            email.processed_at = datetime.utcnow()
-            processed_count += 1
-
-            # 2. SMTP 发送
-            # 下载附件内容（如果需要）
-            attachments_with_content = []
+            # 2. 渲染邮件
+            # 附件按大小策略内联或替换为下载链接
+            attachments = None
             if email.has_attachments and config.include_attachments:
-                # 获取 access token
-                access_token = get_cached_token(user.id)
-                if not access_token:
-                    access_token = decrypt_token(user.access_token)
-
-                if access_token:
-                    outlook = OutlookService(access_token)
-                    for att_info in email.attachments:
-                        try:
-                            # 下载附件内容
-                            att_data = await outlook.get_attachment_content(
-                                email.message_id, att_info.get("name", "")
-                            )
-                            if att_data:
-                                attachments_with_content.append(
-                                    {
-                                        "name": att_info.get("name"),
-                                        "content_type": att_info.get(
-                                            "content_type", "application/octet-stream"
-                                        ),
-                                        "content": base64.b64encode(att_data).decode(),
-                                    }
-                                )
-                        except Exception as e:
-                            print(f"下载附件失败 {att_info.get('name')}: {e}")
-                            continue
-
-            # 发送邮件
-            send_result = await smtp_sender.send_processed_email(
-                to_email=config.smtp_recipient,
+                attachments = [
+                    {
+                        **att_info,
+                        "content_type": att_info.get(
+                            "content_type", "application/octet-stream"
+                        ),
+                        "url": make_attachment_link(
+                            user_id, email.message_id, att_info
+                        ),
+                    }
+                    for att_info in email.attachments
+                ]
+
+            inline_max_mb = config.attachment_inline_max_mb
+            message = smtp_sender.build_processed_email(
                 original_subject=email.subject,
                 original_sender=f"{email.sender_name} <{email.sender_email}>",
                 original_date=email.received_at,
                 processed_content=processed_content,
                 original_body=email.body_text if config.ai_mode != "none" else None,
-                attachments=attachments_with_content
-                if attachments_with_content
+                attachments=attachments,
+                inline_max_bytes=inline_max_mb * 1024 * 1024
+                if inline_max_mb is not None
                 else None,
             )
 
-            # 记录发送日志
-            send_log = SendLog(
-                user_id=user.id,
-                email_id=email.id,
-                recipient=config.smtp_recipient,
-                subject=f"[Outlook助手] {email.subject}",
-                status="success" if send_result["success"] else "failed",
-                error_message=send_result.get("message")
-                if not send_result["success"]
-                else None,
+            # 3. 处理结果和待发送邮件在同一事务中提交，崩溃后不会重复调用 AI
+            email.processed_content = processed_content
+            email.is_processed = True
+            email.processed_at = datetime.utcnow()
+            enqueue_email(db, user_id, email_id, config.smtp_recipient, message)
+            await record_stats(db, user_id, processed=1)
+            await bump_data_version(db, user_id)
+            await db.commit()
+            processed_count += 1
+            progress.count(processed=1)
+            progress.emit(
+                "email", stage="queued", email_id=email_id, subject=email_subject
             )
-            db.add(send_log)
 
-            if send_result["success"]:
-                email.sent = True
-                email.sent_at = datetime.utcnow()
-                sent_count += 1
-            else:
-                errors.append(f"邮件 {email.id}: {send_result['message']}")
-
-            db.commit()
+        except IntegrityError:
+            # 幂等键冲突：该邮件已由其他请求入队
+            await db.rollback()
+            errors.append(f"邮件 {email_id} 已由其他任务入队，跳过")
+            progress.count(skipped=1)
+            progress.emit(
+                "email", stage="skipped", email_id=email_id, subject=email_subject
+            )
+            continue
 
         except Exception as e:
-            error_msg = f"处理邮件 {email.id} 失败: {str(e)}"
+            await db.rollback()
+            error_msg = f"处理邮件 {email_id} 失败: {str(e)}"
             print(error_msg)
             errors.append(error_msg)
+            progress.count(errors=1)
+            progress.emit(
+                "email",
+                stage="failed",
+                email_id=email_id,
+                subject=email_subject,
+                error=str(e),
+            )
 
             # 记录失败日志
             send_log = SendLog(
-                user_id=user.id,
-                email_id=email.id,
+                user_id=user_id,
+                email_id=email_id,
                 recipient=config.smtp_recipient,
-                subject=f"[Outlook助手] {email.subject}",
+                subject=f"[Outlook助手] {email_subject}",
                 status="failed",
                 error_message=str(e),
             )
             db.add(send_log)
-            db.commit()
+            await record_stats(db, user_id, process_failed=1)
+            await db.commit()
             continue
 
+    # 4. 发送发件箱（包括之前失败后到期重试的邮件）
+    send_stats = await drain_outbox(db, user_id=user_id, progress=progress)
+    errors.extend(send_stats["errors"])
+
+    if not total_count and not send_stats["sent"] and not send_stats["failed"]:
+        return {"message": "没有待处理的邮件", "processed": 0, "sent": 0}
+
     return {
         "message": "处理完成",
-        "total": len(emails),
+        "total": total_count,
         "processed": processed_count,
-        "sent": sent_count,
+        "sent": send_stats["sent"],
         "errors": errors if errors else None,
     }
 
 
-@router.get("/emails/{email_id}")
+RUN_OPERATIONS = {"fetch": _fetch_emails, "process": _process_emails}
+
+
+def _sse_message(item: Optional[dict]) -> bytes:
+    """进度事件 -> SSE 消息（None 为心跳注释）"""
+    if item is None:
+        return b": ping\n\n"
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (
+        item["id"],
+        item["event"].encode(),
+        orjson.dumps(item),
+    )
+
+
+@router.post("/runs/{operation}", response_model=MessageResponse, status_code=202)
+async def start_run(
+    operation: str, request: Request, user=Depends(get_current_user)
+):
+    """
+    启动（或加入正在运行的）抓取 / 处理任务，不等待结果
+
+    与 POST /api/fetch、/api/process 共用单飞和限流；进度和结果通过
+    GET /api/runs/{operation}/events 订阅
+    """
+    func = RUN_OPERATIONS.get(operation)
+    if func is None:
+        raise HTTPException(status_code=404, detail="不支持的操作")
+
+    # 任务正在其他进程中运行时直接订阅它（在本进程启动会因任务锁返回 409）
+    progress = await run_guard.shared_progress(operation, user.id)
+    if progress is not None and not progress.finished:
+        mark_recent_write(request)
+        return {"message": "任务正在运行"}
+
+    run_guard.start(
+        operation,
+        user.id,
+        lambda progress, connection: _in_new_session(
+            func, user.id, progress, connection
+        ),
+    )
+    mark_recent_write(request)
+    return {"message": "已开始"}
+
+
+@router.get("/runs/{operation}/events")
+async def run_events(
+    operation: str, request: Request, user=Depends(get_current_user)
+):
+    """
+    以 SSE 推送抓取 / 处理任务的进度（只订阅，不启动任务）
+
+    operation: fetch 或 process
+    事件：start、folder、page、email（stage 为每封邮件的阶段）、
+    以及结束事件 done（result 同 POST 接口的返回）/ failed / cancelled；每个事件带累计计数 counts
+    没有正在运行（或刚结束）的任务时返回 204，EventSource 收到后不再重连；
+    带 Last-Event-ID 重连时只补发之后的事件。
+    关闭连接不会取消任务，取消请调用 POST /api/runs/{operation}/cancel
+    """
+    if operation not in RUN_OPERATIONS:
+        raise HTTPException(status_code=404, detail="不支持的操作")
+
+    last_event_id = request.headers.get("last-event-id") or ""
+    after = int(last_event_id) if last_event_id.isdigit() else 0
+    progress = await run_guard.shared_progress(operation, user.id)
+    if progress is None or (progress.finished and progress.last_id <= after):
+        return Response(status_code=204)
+    # 订阅时任务可能已经写入；响应头随第一个事件发出，之后无法再更新 Session
+    mark_recent_write(request)
+
+    async def stream():
+        async for item in progress.subscribe(after):
+            yield _sse_message(item)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/runs/{operation}/cancel", response_model=MessageResponse)
+async def cancel_run(operation: str, user=Depends(get_current_user)):
+    """取消正在运行的抓取 / 处理任务（在其他进程中运行时通过 Redis 通知该进程）"""
+    if operation not in RUN_OPERATIONS:
+        raise HTTPException(status_code=404, detail="不支持的操作")
+    if not await run_guard.cancel_shared(operation, user.id):
+        raise HTTPException(status_code=404, detail="没有正在运行的任务")
+    return {"message": "已取消"}
+
+
+@router.post("/outbox/retry", response_model=OutboxRetryResult)
+async def retry_dead_outbox(
+    user=Depends(get_current_user), db: AsyncSession = Depends(get_async_db)
+):
+    """重新发送进入 dead 状态的邮件"""
+    result = await db.execute(
+        update(Outbox)
+        .where(Outbox.user_id == user.id, Outbox.status == "dead")
+        .values(status="pending", attempts=0, next_attempt_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    count = result.rowcount
+    await db.commit()
+
+    send_stats = await drain_outbox(db, user_id=user.id)
+
+    return {
+        "message": "已重新加入发送队列",
+        "requeued": count,
+        "sent": send_stats["sent"],
+    }
+
+
+@router.get("/emails/{email_id}", response_model=EmailDetail)
 async def get_email_detail(
-    email_id: int, user=Depends(get_current_user), db: Session = Depends(get_db)
+    email_id: int,
+    request: Request,
+    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
 ):
     """获取单封邮件详情"""
-    email = (
-        db.query(Email).filter(Email.id == email_id, Email.user_id == user.id).first()
+    cond = await conditional_request(request, db, user.id)
+    if cond.response is not None:
+        return cond.response
+
+    email = await db.scalar(
+        select(Email)
+        .where(Email.id == email_id, Email.user_id == user.id)
+        .options(selectinload(Email.body))
     )
 
     if not email:
         raise HTTPException(status_code=404, detail="邮件不存在")
 
-    return {
+    result = {
         "id": email.id,
         "message_id": email.message_id,
         "subject": email.subject,
@@ -356,21 +875,108 @@ async def get_email_detail(
         "sent": email.sent,
         "processed_content": email.processed_content,
     }
+    return cond.respond(result)
 
 
-@router.delete("/emails/{email_id}")
+@router.delete("/emails/{email_id}", response_model=MessageResponse)
 async def delete_email(
-    email_id: int, user=Depends(get_current_user), db: Session = Depends(get_db)
+    email_id: int,
+    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """删除邮件记录"""
-    email = (
-        db.query(Email).filter(Email.id == email_id, Email.user_id == user.id).first()
+    deleted = await bulk_delete(
+        db, user.id, (Email.id == email_id, Email.user_id == user.id)
     )
-
-    if not email:
+    if not deleted:
         raise HTTPException(status_code=404, detail="邮件不存在")
 
-    db.delete(email)
-    db.commit()
-
     return {"message": "邮件已删除"}
+
+
+def _bulk_conditions(selection: BulkSelection, user_id: int) -> tuple:
+    if selection.ids is not None and len(selection.ids) > settings.BULK_MAX_IDS:
+        raise HTTPException(
+            status_code=400, detail=f"一次最多指定 {settings.BULK_MAX_IDS} 封邮件"
+        )
+    try:
+        return selection_conditions(
+            user_id,
+            ids=selection.ids,
+            sender=selection.sender,
+            since=selection.since,
+            until=selection.until,
+            status=selection.status,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/emails/bulk/delete", response_model=BulkResult)
+async def bulk_delete_emails(
+    selection: BulkSelection,
+    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """按 ID 列表或筛选条件批量删除邮件"""
+    conditions = _bulk_conditions(selection, user.id)
+    count = await bulk_delete(db, user.id, conditions)
+    return {"message": f"已删除 {count} 封邮件", "affected": count}
+
+
+@router.post("/emails/bulk/mark", response_model=BulkResult)
+async def bulk_mark_emails(
+    selection: BulkMarkRequest,
+    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """批量标记为已处理（processed=true，不再自动处理）或未处理"""
+    conditions = _bulk_conditions(selection, user.id)
+    count = await bulk_mark(db, user.id, conditions, selection.processed)
+    state = "已处理" if selection.processed else "未处理"
+    return {"message": f"已将 {count} 封邮件标记为{state}", "affected": count}
+
+
+@router.post("/emails/bulk/requeue", response_model=BulkResult)
+async def bulk_requeue_emails(
+    selection: BulkSelection,
+    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """批量重新排队，下次处理时重新 AI 处理并发送"""
+    conditions = _bulk_conditions(selection, user.id)
+    count = await bulk_requeue(db, user.id, conditions)
+    return {"message": f"已重新排队 {count} 封邮件", "affected": count}
+
+
+@router.get("/attachments/{token}")
+async def download_attachment(
+    token: str, db: AsyncSession = Depends(get_async_db)
+):
+    """大附件下载（邮件中的签名链接，无需登录）"""
+    link = load_attachment_link(token)
+    if not link:
+        raise HTTPException(status_code=404, detail="链接无效或已过期")
+
+    user = await db.get(User, link["user_id"])
+    if not user or not user.is_active:
+        raise HTTPException(status_code=404, detail="链接无效或已过期")
+
+    access_token = await get_access_token(user)
+
+    attachment = link["attachment"]
+    try:
+        cached = await attachment_cache.get_or_fetch(
+            OutlookService(access_token), link["message_id"], attachment
+        )
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"附件下载失败: {str(e)}")
+
+    if not cached:
+        raise HTTPException(status_code=404, detail="附件不存在")
+
+    return FileResponse(
+        cached["path"],
+        media_type=attachment.get("content_type") or "application/octet-stream",
+        filename=attachment.get("name") or "attachment",
+    )
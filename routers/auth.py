@@ -1,12 +1,15 @@
 from fastapi import APIRouter, Request, HTTPException, Depends
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
 import secrets
 
-from database.models import get_db, User, UserConfig
+from database.models import get_async_db, User, UserConfig
 from services.outlook import MicrosoftAuthService
-from utils import encrypt_token, decrypt_token, cache_token
+from services.user_cache import user_cache
+from services.token_refresh import TokenRefreshError, needs_refresh, refresh_user_token
+from utils import encrypt_token, cache_token
 from config import settings
 
 router = APIRouter()
@@ -37,7 +40,7 @@ async def callback(
     state: str = None,
     error: str = None,
     error_description: str = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """OAuth 回调处理"""
 
@@ -99,7 +102,7 @@ async def callback(
             raise HTTPException(status_code=400, detail="无法获取用户邮箱，请确保在 Azure Portal 中已 Grant admin consent User.Read 权限")
 
         # 检查用户是否已存在
-        user = db.query(User).filter(User.email == email).first()
+        user = await db.scalar(select(User).where(User.email == email))
 
         if user:
             # 更新现有用户
@@ -119,16 +122,17 @@ async def callback(
                 last_login=datetime.utcnow(),
             )
             db.add(user)
-            db.flush()  # 获取 user.id
+            await db.flush()  # 获取 user.id
 
             # 创建默认配置
             config = UserConfig(user_id=user.id)
             db.add(config)
 
-        db.commit()
+        await db.commit()
+        user_cache.invalidate(user.id)
 
-        # 缓存解密后的 Token 到内存（减少解密次数）
-        cache_token(user.id, access_token)
+        # 缓存解密后的 Token（本地 + Redis，减少解密次数），并让其他进程丢弃旧值
+        await cache_token(user.id, access_token, expires_at)
 
         # 设置 session
         request.session["user_id"] = user.id
@@ -152,57 +156,48 @@ async def logout(request: Request):
     if user_id:
         from utils import clear_token_cache
 
-        clear_token_cache(user_id)
+        await clear_token_cache(user_id)
+        user_cache.invalidate(user_id)
 
     return RedirectResponse(url="/")
 
 
-async def get_current_user(request: Request, db: Session = Depends(get_db)) -> User:
+async def get_current_user(
+    request: Request, db: AsyncSession = Depends(get_async_db)
+) -> User:
     """获取当前登录用户"""
     user_id = request.session.get("user_id")
 
     if not user_id:
         raise HTTPException(status_code=401, detail="未登录")
 
-    user = db.query(User).filter(User.id == user_id).first()
+    # 短期缓存的用户快照，命中时不查询数据库
+    user = await user_cache.get_user(db, user_id)
 
     if not user or not user.is_active:
         request.session.clear()
         raise HTTPException(status_code=401, detail="用户不存在或已禁用")
 
-    # 检查 Token 是否过期
-    if user.token_expires_at and user.token_expires_at < datetime.utcnow():
-        # 尝试刷新 Token
-        if user.refresh_token:
-            try:
-                refresh_token = decrypt_token(user.refresh_token)
-                token_data = await MicrosoftAuthService.refresh_access_token(
-                    refresh_token
-                )
-
-                user.access_token = encrypt_token(token_data.get("access_token"))
-                user.refresh_token = encrypt_token(
-                    token_data.get("refresh_token", refresh_token)
-                )
-                user.token_expires_at = token_data.get("expires_at")
-                db.commit()
-
-                # 更新缓存
-                cache_token(user.id, token_data.get("access_token"))
-
-            except Exception as e:
-                # Token 刷新失败，需要重新登录
-                request.session.clear()
-                raise HTTPException(status_code=401, detail="Token 已过期，请重新登录")
-        else:
+    # Token 已过期时刷新（通常已由后台任务提前刷新；并发请求共享同一次刷新）
+    if needs_refresh(user.token_expires_at):
+        try:
+            await refresh_user_token(user.id)
+        except TokenRefreshError:
+            # Token 刷新失败，需要重新登录
             request.session.clear()
             raise HTTPException(status_code=401, detail="Token 已过期，请重新登录")
+        # 刷新时已清除缓存，重新读取并缓存新的快照
+        db.expunge(user)
+        user = await user_cache.get_user(db, user.id)
+
+    # 结束查询事务，把主库连接还给连接池（只读接口的后续查询走从库会话）
+    await db.commit()
 
     return user
 
 
 async def get_current_user_optional(
-    request: Request, db: Session = Depends(get_db)
+    request: Request, db: AsyncSession = Depends(get_async_db)
 ) -> User:
     """获取当前登录用户（可选，未登录返回 None）"""
     try:
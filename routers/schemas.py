@@ -0,0 +1,124 @@
+"""
+API 请求 / 响应模型
+
+FastAPI 按 response_model 用 pydantic 序列化（不经过 jsonable_encoder），
+再由默认的 ORJSONResponse 输出；同时用于生成 OpenAPI 文档。
+邮件列表 / 详情通过 utils.http_cache 直接返回已序列化的响应，模型只用于文档。
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+
+
+class MessageResponse(BaseModel):
+    message: str
+
+
+class EmailListItem(BaseModel):
+    """列表字段（指定 fields 时只返回请求的字段）"""
+
+    id: Optional[int] = None
+    message_id: Optional[str] = None
+    subject: Optional[str] = None
+    sender_email: Optional[str] = None
+    sender_name: Optional[str] = None
+    received_at: Optional[datetime] = None
+    has_attachments: Optional[bool] = None
+    is_read: Optional[bool] = None
+    is_processed: Optional[bool] = None
+    sent: Optional[bool] = None
+    body_preview: Optional[str] = None
+
+
+class EmailListResponse(BaseModel):
+    count: int
+    estimated_total: Optional[int] = None
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    next: Optional[str] = None
+    prev: Optional[str] = None
+    emails: List[EmailListItem]
+
+
+class EmailDetail(BaseModel):
+    id: int
+    message_id: Optional[str] = None
+    subject: Optional[str] = None
+    sender_email: Optional[str] = None
+    sender_name: Optional[str] = None
+    received_at: Optional[datetime] = None
+    body_html: Optional[str] = None
+    body_text: Optional[str] = None
+    has_attachments: bool = False
+    attachments: Optional[List[Dict[str, Any]]] = None
+    is_read: Optional[bool] = None
+    is_processed: Optional[bool] = None
+    sent: Optional[bool] = None
+    processed_content: Optional[str] = None
+
+
+class SearchResult(BaseModel):
+    id: int
+    subject: Optional[str] = None
+    sender_email: Optional[str] = None
+    sender_name: Optional[str] = None
+    received_at: Optional[datetime] = None
+    rank: float
+    subject_highlight: Optional[str] = None
+    snippet: Optional[str] = None
+
+
+class SearchResponse(BaseModel):
+    query: str
+    count: int
+    offset: int
+    next_offset: Optional[int] = None
+    results: List[SearchResult]
+
+
+class StatsResponse(BaseModel):
+    totals: Dict[str, Optional[int]]
+    window: Dict[str, Any]
+    hourly: List[Dict[str, Any]]
+    updated_at: Optional[datetime] = None
+
+
+class FetchResult(BaseModel):
+    message: str
+    total: int
+    new: int
+    matched: Optional[int] = None  # 配置了关键词过滤时返回
+
+
+class ProcessResult(BaseModel):
+    message: str
+    total: Optional[int] = None
+    processed: int
+    sent: int
+    errors: Optional[List[str]] = None
+
+
+class BulkSelection(BaseModel):
+    """批量操作的邮件：ID 列表和 / 或筛选条件（同时给出时取交集）"""
+
+    ids: Optional[List[int]] = None
+    sender: Optional[str] = None  # 发件人邮箱（不区分大小写）
+    since: Optional[datetime] = None  # received_at >= since
+    until: Optional[datetime] = None  # received_at < until
+    status: Optional[str] = None  # pending / processed / unprocessed / sent
+
+
+class BulkMarkRequest(BulkSelection):
+    processed: bool = True
+
+
+class BulkResult(BaseModel):
+    message: str
+    affected: int
+
+
+class OutboxRetryResult(BaseModel):
+    message: str
+    requeued: int
+    sent: int
@@ -0,0 +1,299 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Dict, Optional
+import anyio
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from config import settings
+
+# 大附件下载链接签名
+_link_serializer = URLSafeTimedSerializer(settings.SECRET_KEY, salt="attachment-link")
+
+
+class _HashingWriter:
+    """写入文件的同时计算 sha256（在线程池中写入，不阻塞事件循环）"""
+
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    def _write(self, chunk: bytes):
+        self.sha256.update(chunk)
+        self.file.write(chunk)
+
+    async def write(self, chunk: bytes):
+        await anyio.to_thread.run_sync(self._write, chunk)
+
+
+class _KeyLock:
+    """按 key 的下载锁，users 为持有和等待该锁的协程数"""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class AttachmentCache:
+    """
+    附件内容寻址缓存
+
+    目录结构：
+        blobs/ab/abcdef...   按 sha256 存放的附件内容，相同内容只存一份
+        refs/<key>           (message_id, attachment_id) -> sha256 的映射
+        tmp/                 下载中的临时文件
+
+    重发、重试以及不同邮件中的相同附件都直接命中缓存。
+    总大小超过上限时按最近使用时间（mtime）淘汰最旧的内容。
+    下载写入、入库和淘汰的文件操作在线程池中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._total_bytes: Optional[int] = None
+        self._locks: Dict[str, _KeyLock] = {}
+        # 保护 _total_bytes 和淘汰（_store 在线程池中并发执行）
+        self._store_lock = threading.Lock()
+
+    # ---------- 路径 ----------
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "blobs", sha256[:2], sha256)
+
+    def _ref_path(self, message_id: str, attachment_id: str) -> str:
+        key = hashlib.sha256(f"{message_id}/{attachment_id}".encode()).hexdigest()
+        return os.path.join(self.root, "refs", key[:2], key)
+
+    # ---------- 读取 ----------
+
+    def lookup(self, message_id: str, attachment_id: str) -> Optional[dict]:
+        """查找已缓存的附件，未命中返回 None"""
+        try:
+            with open(self._ref_path(message_id, attachment_id)) as f:
+                sha256 = f.read().strip()
+        except FileNotFoundError:
+            return None
+
+        return self.get_blob(sha256)
+
+    def get_blob(self, sha256: str) -> Optional[dict]:
+        """按 sha256 获取缓存内容，并刷新其最近使用时间"""
+        path = self._blob_path(sha256)
+        try:
+            os.utime(path)
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+
+        return {"sha256": sha256, "path": path, "size": size}
+
+    # ---------- 写入 ----------
+
+    async def get_or_fetch(
+        self, outlook, message_id: str, attachment: dict
+    ) -> Optional[dict]:
+        """
+        获取附件内容，未命中时从 Graph 流式下载
+
+        Args:
+            outlook: OutlookService 实例
+            message_id: 邮件 ID
+            attachment: Email.attachments 中的一项 {id, name, size, content_type}
+
+        Returns:
+            {"sha256", "path", "size"}；附件不存在时返回 None
+        """
+        attachment_id = attachment.get("id")
+        if not attachment_id:
+            # 旧数据没有记录附件 ID，按名称查一次
+            attachment_id = await outlook.find_attachment_id(
+                message_id, attachment.get("name", "")
+            )
+            if not attachment_id:
+                return None
+
+        cached = self.lookup(message_id, attachment_id)
+        if cached:
+            return cached
+
+        # 同一附件的并发请求只下载一次；锁在没有协程持有或等待时才删除，
+        # 否则释放锁与等待者重新获得锁之间到来的请求会拿到新锁并重复下载
+        lock_key = f"{message_id}/{attachment_id}"
+        key_lock = self._locks.get(lock_key)
+        if key_lock is None:
+            key_lock = self._locks[lock_key] = _KeyLock()
+        key_lock.users += 1
+        try:
+            async with key_lock.lock:
+                cached = self.lookup(message_id, attachment_id)
+                if cached:
+                    return cached
+                return await self._fetch(outlook, message_id, attachment_id)
+        finally:
+            key_lock.users -= 1
+            if not key_lock.users:
+                self._locks.pop(lock_key, None)
+
+    def _open_tmp(self):
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        return tmp_path, os.fdopen(fd, "wb")
+
+    @staticmethod
+    def _discard(tmp_path: str):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    async def _fetch(self, outlook, message_id: str, attachment_id: str) -> dict:
+        tmp_path, f = await anyio.to_thread.run_sync(self._open_tmp)
+        try:
+            try:
+                writer = _HashingWriter(f)
+                size = await outlook.download_attachment(
+                    message_id, attachment_id, writer
+                )
+            finally:
+                await anyio.to_thread.run_sync(f.close)
+        except Exception:
+            await anyio.to_thread.run_sync(self._discard, tmp_path)
+            raise
+
+        return await anyio.to_thread.run_sync(
+            self._store,
+            tmp_path,
+            writer.sha256.hexdigest(),
+            size,
+            message_id,
+            attachment_id,
+        )
+
+    def _store(
+        self,
+        tmp_path: str,
+        sha256: str,
+        size: int,
+        message_id: str,
+        attachment_id: str,
+    ) -> dict:
+        """下载完成的临时文件入库、写入映射并按需淘汰（在线程池中执行）"""
+        with self._store_lock:
+            try:
+                blob_path = self._blob_path(sha256)
+                if os.path.exists(blob_path):
+                    # 相同内容已存在，丢弃本次下载
+                    os.remove(tmp_path)
+                else:
+                    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                    os.replace(tmp_path, blob_path)
+                    self._add_bytes(size)
+            except Exception:
+                self._discard(tmp_path)
+                raise
+
+            self._write_ref(message_id, attachment_id, sha256)
+            self.evict()
+
+        return self.get_blob(sha256) or {
+            "sha256": sha256,
+            "path": blob_path,
+            "size": size,
+        }
+
+    def _write_ref(self, message_id: str, attachment_id: str, sha256: str):
+        ref_path = self._ref_path(message_id, attachment_id)
+        os.makedirs(os.path.dirname(ref_path), exist_ok=True)
+        tmp_path = f"{ref_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(sha256)
+        os.replace(tmp_path, ref_path)
+
+    # ---------- 淘汰 ----------
+
+    def _scan_blobs(self) -> list:
+        blobs = []
+        blob_root = os.path.join(self.root, "blobs")
+        for dirpath, _, filenames in os.walk(blob_root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, path))
+        return blobs
+
+    def _add_bytes(self, size: int):
+        if self._total_bytes is None:
+            self._total_bytes = sum(b[1] for b in self._scan_blobs())
+        else:
+            self._total_bytes += size
+
+    def evict(self):
+        """
+        总大小超过上限时，删除最久未使用的内容直到降到上限的 90%
+
+        会遍历缓存目录，由 _store 在线程池中（持有 _store_lock 时）调用
+        """
+        if self._total_bytes is None:
+            self._add_bytes(0)
+        if self._total_bytes <= self.max_bytes:
+            return
+
+        blobs = sorted(self._scan_blobs())
+        total = sum(b[1] for b in blobs)
+        target = int(self.max_bytes * 0.9)
+
+        for _, size, path in blobs:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                continue
+
+        # 指向已淘汰内容的 refs 在下次 lookup 时视为未命中，无需清理
+        self._total_bytes = total
+
+
+# 全局实例
+attachment_cache = AttachmentCache(
+    settings.ATTACHMENT_CACHE_DIR, settings.ATTACHMENT_CACHE_MAX_BYTES
+)
+
+
+def make_attachment_link(user_id: int, message_id: str, attachment: dict) -> str:
+    """生成带签名、会过期的附件下载链接（下载时才从 Graph 拉取并写入缓存）"""
+    token = _link_serializer.dumps(
+        {
+            "u": user_id,
+            "m": message_id,
+            "a": attachment.get("id"),
+            "n": attachment.get("name"),
+            "t": attachment.get("content_type"),
+        }
+    )
+    return f"{settings.PUBLIC_BASE_URL.rstrip('/')}/api/attachments/{token}"
+
+
+def load_attachment_link(token: str) -> Optional[dict]:
+    """校验下载链接，无效或已过期返回 None"""
+    try:
+        data = _link_serializer.loads(
+            token, max_age=settings.ATTACHMENT_LINK_EXPIRE_HOURS * 3600
+        )
+    except BadSignature:
+        return None
+
+    return {
+        "user_id": data.get("u"),
+        "message_id": data.get("m"),
+        "attachment": {
+            "id": data.get("a"),
+            "name": data.get("n"),
+            "content_type": data.get("t"),
+        },
+    }
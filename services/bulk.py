@@ -0,0 +1,132 @@
+"""
+批量邮件操作（删除 / 标记处理状态 / 重新排队）
+
+按 ID 列表或筛选条件（发件人、收件时间、状态）选择邮件，每个操作是一条
+UPDATE / DELETE 语句，返回影响的行数；数据版本号在同一事务中加一。
+"""
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import delete, exists, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from database.models import Email, Outbox
+from services.data_version import bump_data_version
+from utils.dates import to_naive_utc
+
+# 状态筛选
+STATUS_CONDITIONS = {
+    "pending": lambda: (Email.is_processed == False, Email.sent == False),
+    "processed": lambda: (Email.is_processed == True,),
+    "unprocessed": lambda: (Email.is_processed == False,),
+    "sent": lambda: (Email.sent == True,),
+}
+
+
+class EmptySelection(ValueError):
+    """没有提供任何 ID 或筛选条件（避免误操作全部邮件）"""
+
+
+def selection_conditions(
+    user_id: int,
+    ids: Optional[List[int]] = None,
+    sender: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    status: Optional[str] = None,
+) -> tuple:
+    """WHERE 条件：当前用户的邮件，且满足所有给出的条件"""
+    if ids is None and not sender and not since and not until and not status:
+        raise EmptySelection("请提供邮件 ID 或筛选条件")
+    if status and status not in STATUS_CONDITIONS:
+        raise ValueError(f"不支持的状态，可选: {', '.join(STATUS_CONDITIONS)}")
+
+    conditions = (Email.user_id == user_id,)
+    if ids is not None:
+        conditions += (Email.id.in_(ids),)
+    if sender:
+        conditions += (func.lower(Email.sender_email) == sender.strip().lower(),)
+    if since:
+        conditions += (Email.received_at >= to_naive_utc(since),)
+    if until:
+        conditions += (Email.received_at < to_naive_utc(until),)
+    if status:
+        conditions += STATUS_CONDITIONS[status]()
+    return conditions
+
+
+async def _finish(db: AsyncSession, user_id: int, count: int) -> int:
+    if count:
+        await bump_data_version(db, user_id)
+    await db.commit()
+    return count
+
+
+async def bulk_delete(db: AsyncSession, user_id: int, conditions: tuple) -> int:
+    """删除邮件（email_bodies / email_search / outbox 级联删除，send_logs.email_id 置空）"""
+    result = await db.execute(
+        delete(Email).where(*conditions).execution_options(synchronize_session=False)
+    )
+    return await _finish(db, user_id, result.rowcount)
+
+
+async def _clear_outbox(db: AsyncSession, user_id: int, conditions: tuple) -> tuple:
+    """
+    删除所选邮件在发件箱中的记录，返回排除了正在发送中（sending）邮件的条件
+
+    邮件重新处理时会再次入队，旧记录留着会与幂等键冲突（或被重复发送）。
+    """
+    # 别名：在 DELETE FROM outbox 的子查询中不与外层的 outbox 关联
+    other = aliased(Outbox)
+    sending = exists().where(other.email_id == Email.id, other.status == "sending")
+    conditions += (~sending,)
+
+    await db.execute(
+        delete(Outbox)
+        .where(
+            Outbox.user_id == user_id,
+            Outbox.email_id.in_(select(Email.id).where(*conditions)),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return conditions
+
+
+async def bulk_mark(
+    db: AsyncSession, user_id: int, conditions: tuple, processed: bool
+) -> int:
+    """
+    标记为已处理（不再自动处理）或未处理，只更新状态实际改变的邮件
+
+    标记为未处理时同 bulk_requeue 一样删除发件箱记录，正在发送中的邮件跳过。
+    """
+    if not processed:
+        conditions = await _clear_outbox(db, user_id, conditions)
+    result = await db.execute(
+        update(Email)
+        .where(*conditions, Email.is_processed == (not processed))
+        .values(
+            is_processed=processed,
+            processed_at=datetime.utcnow() if processed else None,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return await _finish(db, user_id, result.rowcount)
+
+
+async def bulk_requeue(db: AsyncSession, user_id: int, conditions: tuple) -> int:
+    """
+    重新排队：清除处理和发送状态，下次 /api/process 会重新 AI 处理并发送
+
+    同时删除这些邮件在发件箱中的记录，否则重新入队会与幂等键冲突；
+    正在发送中（sending）的邮件跳过。
+    """
+    conditions = await _clear_outbox(db, user_id, conditions)
+    result = await db.execute(
+        update(Email)
+        .where(*conditions)
+        .values(is_processed=False, processed_at=None, sent=False, sent_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    return await _finish(db, user_id, result.rowcount)
@@ -0,0 +1,46 @@
+"""
+每用户数据版本号
+
+抓取、处理、发送、删除邮件和修改配置时调用 bump_data_version（不提交事务，
+与变更一起提交）；只读接口读取版本号生成 ETag，版本不变时返回 304 或缓存的响应。
+"""
+from datetime import datetime
+from typing import Iterable
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import UserDataVersion
+
+
+def bump_statement(dialect: str, user_ids: Iterable[int]):
+    """INSERT ... ON CONFLICT DO UPDATE SET version = version + 1（可用于同步连接）"""
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    table = UserDataVersion.__table__
+    now = datetime.utcnow()
+    stmt = insert(table).values(
+        [{"user_id": user_id, "version": 1, "updated_at": now} for user_id in user_ids]
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={"version": table.c.version + 1, "updated_at": now},
+    )
+
+
+async def bump_data_version(db: AsyncSession, *user_ids: int) -> None:
+    """用户数据已变化，版本号加一（不提交事务）"""
+    user_ids = sorted(set(user_ids))
+    if user_ids:
+        await db.execute(bump_statement(db.bind.dialect.name, user_ids))
+
+
+async def get_data_version(db: AsyncSession, user_id: int) -> int:
+    """当前版本号（从未变更过的用户为 0）"""
+    version = await db.scalar(
+        select(UserDataVersion.version).where(UserDataVersion.user_id == user_id)
+    )
+    return version or 0
@@ -0,0 +1,166 @@
+"""
+邮件导出（NDJSON / mbox）
+
+- 用服务端游标分批读取（stream + yield_per），不一次性加载全部邮件，
+  导出 10 万封邮件时内存占用与单批大小有关，与总数无关
+- 输出按 EXPORT_CHUNK_BYTES 攒成块后交给 StreamingResponse，可选 gzip 压缩成 .gz 文件
+- 流式响应在请求依赖结束后才发送，因此使用独立连接（有从库时走从库）
+"""
+import random
+import re
+import zlib
+from datetime import datetime, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime, formataddr
+from typing import AsyncIterator, Optional
+
+import orjson
+from sqlalchemy import select
+
+from config import settings
+from database.models import Email, EmailBody, async_engine, async_read_engines
+from utils.dates import to_naive_utc
+
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "mbox": ("application/mbox", "mbox"),
+}
+
+# mboxrd：正文中以 "From " 开头（含已转义的 ">From "）的行前面加 ">"
+_FROM_LINE_RE = re.compile(rb"^(>*From )", re.M)
+
+EXPORT_COLUMNS = (
+    Email.id,
+    Email.message_id,
+    Email.subject,
+    Email.sender_email,
+    Email.sender_name,
+    Email.received_at,
+    Email.has_attachments,
+    Email.attachments,
+    Email.is_read,
+    Email.is_processed,
+    Email.processed_at,
+    Email.sent,
+    Email.sent_at,
+    EmailBody.body_text,
+    EmailBody.body_html,
+    EmailBody.processed_content,
+)
+
+# 本进程中正在进行的导出数（每个导出长时间占用一个数据库连接）
+_exports_running = 0
+
+
+class ExportSlot:
+    """占用中的导出名额，release() 可重复调用，只释放一次"""
+
+    def __init__(self):
+        global _exports_running
+        _exports_running += 1
+        self._released = False
+
+    def release(self) -> None:
+        global _exports_running
+        if not self._released:
+            self._released = True
+            _exports_running -= 1
+
+
+def reserve_export_slot() -> Optional[ExportSlot]:
+    """
+    在返回响应前占用一个导出名额，已达 EXPORT_MAX_CONCURRENT 时返回 None
+
+    名额在导出生成器结束时释放；响应未开始发送就结束（生成器从未运行）时，
+    由响应的 background 任务释放。
+    """
+    if settings.EXPORT_MAX_CONCURRENT and (
+        _exports_running >= settings.EXPORT_MAX_CONCURRENT
+    ):
+        return None
+    return ExportSlot()
+
+
+def _ndjson_line(row) -> bytes:
+    return orjson.dumps(row._asdict()) + b"\n"
+
+
+def _mbox_message(row) -> bytes:
+    """一封邮件的 mbox 记录（From_ 行 + RFC 5322 邮件 + 空行）"""
+    received_at = (row.received_at or datetime.utcnow()).replace(tzinfo=timezone.utc)
+
+    message = EmailMessage()
+    message["Subject"] = row.subject or ""
+    message["From"] = formataddr((row.sender_name or "", row.sender_email or ""))
+    message["Date"] = format_datetime(received_at)
+    if row.message_id:
+        message["X-Outlook-Message-Id"] = row.message_id
+    message["X-Outlook-Processed"] = "yes" if row.is_processed else "no"
+    message["X-Outlook-Sent"] = "yes" if row.sent else "no"
+
+    message.set_content(row.body_text or "")
+    if row.body_html:
+        message.add_alternative(row.body_html, subtype="html")
+    if row.processed_content:
+        # AI 处理结果作为单独的文本附件
+        message.add_attachment(
+            row.processed_content, filename="processed.txt", disposition="inline"
+        )
+
+    body = message.as_bytes(policy=message.policy.clone(linesep="\n"))
+    body = _FROM_LINE_RE.sub(rb">\1", body)
+    sender = row.sender_email or "MAILER-DAEMON"
+    from_line = f"From {sender} {received_at.strftime('%a %b %d %H:%M:%S %Y')}\n"
+    return from_line.encode() + body.rstrip(b"\n") + b"\n\n"
+
+
+async def iter_export(
+    user_id: int,
+    fmt: str = "ndjson",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    compress: bool = False,
+    slot: Optional[ExportSlot] = None,
+) -> AsyncIterator[bytes]:
+    """按 received_at 升序逐块输出用户的邮件（slot 为已占用的导出名额，结束时释放）"""
+    render = _mbox_message if fmt == "mbox" else _ndjson_line
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    stmt = (
+        select(*EXPORT_COLUMNS)
+        .outerjoin(EmailBody, EmailBody.email_id == Email.id)
+        .where(Email.user_id == user_id)
+        .order_by(Email.received_at, Email.id)
+        .execution_options(yield_per=settings.EXPORT_BATCH_SIZE)
+    )
+    if since:
+        stmt = stmt.where(Email.received_at >= to_naive_utc(since))
+    if until:
+        stmt = stmt.where(Email.received_at < to_naive_utc(until))
+
+    engine = random.choice(async_read_engines) if async_read_engines else async_engine
+    buffer = bytearray()
+    slot = slot or ExportSlot()
+    try:
+        async with engine.connect() as connection:
+            result = await connection.stream(stmt)
+            async for rows in result.partitions():
+                for row in rows:
+                    buffer += render(row)
+                    # 每封邮件后检查：一批可能有 EXPORT_BATCH_SIZE 封大正文
+                    if len(buffer) >= settings.EXPORT_CHUNK_BYTES:
+                        chunk = bytes(buffer)
+                        buffer.clear()
+                        yield compressor.compress(chunk) if compressor else chunk
+
+        if compressor:
+            yield compressor.compress(bytes(buffer)) + compressor.flush()
+        elif buffer:
+            yield bytes(buffer)
+    finally:
+        slot.release()
+
+
+def export_filename(fmt: str, compress: bool) -> str:
+    extension = FORMATS[fmt][1] + (".gz" if compress else "")
+    return f"emails_{datetime.utcnow():%Y%m%d%H%M%S}.{extension}"
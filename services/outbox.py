@@ -0,0 +1,265 @@
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database.models import AsyncSessionLocal, User, Email, Outbox, SendLog
+from services.attachment_cache import attachment_cache
+from services.data_version import bump_data_version
+from services.outlook import OutlookService
+from services.progress import ProgressRun
+from services.smtp_sender import smtp_sender
+from services.stats import record_stats
+from utils import get_access_token
+
+
+def make_idempotency_key(email_id: int, recipient: str) -> str:
+    """同一封邮件发往同一收件人只入队一次"""
+    return f"email:{email_id}:{recipient.lower()}"
+
+
+def make_message_id(idempotency_key: str) -> str:
+    """由幂等键生成固定的 Message-ID，重试时收件端可据此去重"""
+    digest = hashlib.sha256(idempotency_key.encode()).hexdigest()[:32]
+    domain = "localhost"
+    if "@" in settings.SMTP_USER:
+        domain = settings.SMTP_USER.rsplit("@", 1)[-1]
+    return f"<{digest}@{domain}>"
+
+
+async def is_enqueued(db: AsyncSession, email_id: int, recipient: str) -> bool:
+    """该邮件是否已入队发往 recipient（处理前检查，避免重复调用 AI）"""
+    key = make_idempotency_key(email_id, recipient)
+    return (
+        await db.scalar(select(Outbox.id).where(Outbox.idempotency_key == key))
+    ) is not None
+
+
+def enqueue_email(
+    db: AsyncSession, user_id: int, email_id: int, recipient: str, message: dict
+) -> Outbox:
+    """
+    把渲染好的邮件加入发件箱（不提交事务）
+
+    调用方应在同一事务中更新邮件的处理状态，保证 AI 结果和待发送邮件同时落库。
+    """
+    item = Outbox(
+        user_id=user_id,
+        email_id=email_id,
+        idempotency_key=make_idempotency_key(email_id, recipient),
+        recipient=recipient,
+        subject=message["subject"],
+        body_html=message["body_html"],
+        body_text=message.get("body_text"),
+        attachments=message.get("attachments") or [],
+        status="pending",
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.add(item)
+    return item
+
+
+async def _claim_next(
+    db: AsyncSession, user_id: Optional[int] = None
+) -> Optional[Outbox]:
+    """认领一条到期的待发送邮件（多个 worker 之间用 SKIP LOCKED 避免重复认领）"""
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=settings.OUTBOX_SENDING_TIMEOUT_SECONDS)
+
+    stmt = select(Outbox).where(
+        or_(
+            and_(Outbox.status == "pending", Outbox.next_attempt_at <= now),
+            # 发送中途崩溃的记录，超时后重新认领（Message-ID 不变）
+            and_(Outbox.status == "sending", Outbox.claimed_at < stale_before),
+        )
+    )
+    if user_id is not None:
+        stmt = stmt.where(Outbox.user_id == user_id)
+
+    item = await db.scalar(
+        stmt.order_by(Outbox.next_attempt_at, Outbox.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    if not item:
+        return None
+
+    item.status = "sending"
+    item.claimed_at = now
+    item.attempts = (item.attempts or 0) + 1
+    await db.commit()
+    return item
+
+
+async def _make_attachment_loader(user: Optional[User], email: Optional[Email]):
+    """为内联附件构造加载函数（命中本地缓存时不访问 Graph）"""
+    if not user or not email:
+        return None
+
+    access_token = await get_access_token(user)
+    if not access_token:
+        return None
+
+    outlook = OutlookService(access_token)
+
+    async def loader(att_info: dict):
+        cached = await attachment_cache.get_or_fetch(
+            outlook, email.message_id, att_info
+        )
+        return open(cached["path"], "rb") if cached else None
+
+    return loader
+
+
+async def send_outbox_item(db: AsyncSession, item: Outbox) -> dict:
+    """发送一条已认领的邮件，并根据结果更新状态（成功/退避重试/dead）"""
+    user = await db.get(User, item.user_id)
+    email = await db.get(Email, item.email_id) if item.email_id else None
+
+    message = {
+        "subject": item.subject,
+        "body_html": item.body_html,
+        "body_text": item.body_text,
+        "attachments": item.attachments,
+    }
+
+    started = time.monotonic()
+    loader = await _make_attachment_loader(user, email) if item.attachments else None
+    if item.attachments and loader is None:
+        # 原邮件已删除或暂时拿不到访问令牌：不发送缺附件的邮件，按失败退避重试
+        result = {
+            "success": False,
+            "message": "无法加载附件（原邮件不存在或访问令牌不可用）",
+        }
+    else:
+        try:
+            result = await smtp_sender.send_rendered(
+                to_email=item.recipient,
+                message=message,
+                attachment_loader=loader,
+                message_id=make_message_id(item.idempotency_key),
+            )
+        except Exception as e:
+            result = {"success": False, "message": f"邮件发送失败: {str(e)}"}
+    send_ms = (time.monotonic() - started) * 1000
+
+    now = datetime.utcnow()
+    if result["success"]:
+        item.status = "sent"
+        item.sent_at = now
+        item.last_error = None
+        delivery_delay_s = 0
+        if email:
+            email.sent = True
+            email.sent_at = now
+            await bump_data_version(db, item.user_id)
+            if email.received_at:
+                delivery_delay_s = max(0, (now - email.received_at).total_seconds())
+        await record_stats(
+            db,
+            item.user_id,
+            sent=1,
+            send_ms=send_ms,
+            delivery_delay_s=delivery_delay_s,
+        )
+    else:
+        item.last_error = result.get("message")
+        if item.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            item.status = "dead"
+        else:
+            item.status = "pending"
+            item.next_attempt_at = now + timedelta(
+                seconds=settings.OUTBOX_RETRY_BASE_SECONDS * 2 ** (item.attempts - 1)
+            )
+        await record_stats(db, item.user_id, send_failed=1, send_ms=send_ms)
+
+    db.add(
+        SendLog(
+            user_id=item.user_id,
+            email_id=item.email_id,
+            recipient=item.recipient,
+            subject=item.subject,
+            status="success" if result["success"] else "failed",
+            error_message=None if result["success"] else result.get("message"),
+        )
+    )
+    await db.commit()
+
+    return {
+        "success": result["success"],
+        "status": item.status,
+        "message": result.get("message"),
+    }
+
+
+async def drain_outbox(
+    db: AsyncSession,
+    user_id: Optional[int] = None,
+    limit: int = 100,
+    progress: Optional[ProgressRun] = None,
+) -> dict:
+    """
+    发送到期的发件箱邮件
+
+    Args:
+        db: 数据库会话
+        user_id: 只处理该用户的邮件（None 表示所有用户）
+        limit: 本次最多发送的数量
+        progress: 发送每封邮件后发布进度事件
+
+    Returns:
+        {"sent": int, "failed": int, "dead": int, "errors": [str]}
+    """
+    stats = {"sent": 0, "failed": 0, "dead": 0, "errors": []}
+
+    for _ in range(limit):
+        item = await _claim_next(db, user_id)
+        if not item:
+            break
+
+        email_id = item.email_id
+        result = await send_outbox_item(db, item)
+        if result["success"]:
+            stats["sent"] += 1
+        else:
+            stats["failed"] += 1
+            if result["status"] == "dead":
+                stats["dead"] += 1
+            stats["errors"].append(f"邮件 {email_id}: {result['message']}")
+
+        if progress is not None:
+            if result["success"]:
+                progress.count(sent=1)
+                progress.emit("email", stage="sent", email_id=email_id)
+            else:
+                progress.count(send_failed=1)
+                progress.emit(
+                    "email",
+                    stage="send_failed",
+                    email_id=email_id,
+                    error=result["message"],
+                )
+
+    return stats
+
+
+async def run_outbox_worker():
+    """后台发件箱发送循环，负责重试和崩溃后的续发"""
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                stats = await drain_outbox(db)
+                if stats["sent"] or stats["failed"]:
+                    print(
+                        f"📤 发件箱: 发送 {stats['sent']} 封, 失败 {stats['failed']} 封, "
+                        f"放弃 {stats['dead']} 封"
+                    )
+        except Exception as e:
+            print(f"发件箱发送出错: {e}")
+
+        await asyncio.sleep(settings.OUTBOX_POLL_SECONDS)
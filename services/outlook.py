@@ -1,8 +1,16 @@
+import asyncio
+import inspect
 import httpx
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, IO
 from config import settings
 
+# 限制同时下载的附件数量，避免并发处理大附件时占满内存/磁盘
+_attachment_semaphore = asyncio.Semaphore(settings.ATTACHMENT_DOWNLOAD_CONCURRENCY)
+
+# 流式读取附件时的块大小
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+
 
 class MicrosoftAuthService:
     """Microsoft OAuth 2.0 服务"""
@@ -170,35 +178,67 @@ class OutlookService:
             return response.json()
 
     async def get_attachments(self, message_id: str) -> list:
-        """获取邮件附件列表"""
+        """获取邮件附件列表（仅元数据，不包含 contentBytes）"""
         url = f"{self.GRAPH_API_BASE}/me/messages/{message_id}/attachments"
+        params = {"$select": "id,name,size,contentType"}
 
         async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=self.headers)
+            response = await client.get(url, headers=self.headers, params=params)
             response.raise_for_status()
             data = response.json()
             return data.get("value", [])
 
-    async def get_attachment_content(
+    async def find_attachment_id(
         self, message_id: str, attachment_name: str
-    ) -> bytes:
-        """获取附件内容（二进制）"""
-        # 首先获取附件列表找到 ID
-        attachments = await self.get_attachments(message_id)
-        attachment_id = None
-
-        for att in attachments:
+    ) -> Optional[str]:
+        """按名称查找附件 ID（兼容抓取时未记录 ID 的旧邮件）"""
+        for att in await self.get_attachments(message_id):
             if att.get("name") == attachment_name:
-                attachment_id = att.get("id")
-                break
+                return att.get("id")
+        return None
 
-        if not attachment_id:
-            return b""
+    async def download_attachment(
+        self,
+        message_id: str,
+        attachment_id: str,
+        dest: IO[bytes],
+        max_bytes: Optional[int] = None,
+    ) -> int:
+        """
+        流式下载附件到文件对象
+
+        Args:
+            message_id: 邮件 ID
+            attachment_id: 附件 ID
+            dest: 写入目标（只需要 write 方法，write 可以是协程）
+            max_bytes: 附件大小上限，默认 ATTACHMENT_MAX_BYTES
+
+        Returns:
+            写入的字节数
+        """
+        if max_bytes is None:
+            max_bytes = settings.ATTACHMENT_MAX_BYTES
 
-        # 获取附件内容
         url = f"{self.GRAPH_API_BASE}/me/messages/{message_id}/attachments/{attachment_id}/$value"
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=self.headers)
-            response.raise_for_status()
-            return response.content
+        async with _attachment_semaphore:
+            async with httpx.AsyncClient(timeout=60.0) as client:
+                async with client.stream("GET", url, headers=self.headers) as response:
+                    response.raise_for_status()
+
+                    content_length = response.headers.get("Content-Length")
+                    if content_length and int(content_length) > max_bytes:
+                        raise ValueError(
+                            f"附件超过大小限制 ({content_length} > {max_bytes})"
+                        )
+
+                    written = 0
+                    async for chunk in response.aiter_bytes(ATTACHMENT_CHUNK_SIZE):
+                        written += len(chunk)
+                        if written > max_bytes:
+                            raise ValueError(f"附件超过大小限制 ({max_bytes})")
+                        result = dest.write(chunk)
+                        if inspect.isawaitable(result):
+                            await result
+
+        return written
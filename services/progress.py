@@ -0,0 +1,94 @@
+"""
+抓取 / 处理任务的进度事件
+
+每次运行对应一个 ProgressRun：任务通过 emit() 发布结构化事件（文件夹、分页、
+每封邮件的阶段、累计计数），SSE 接口通过 subscribe() 订阅。保留最近的事件，
+中途加入（合并到同一任务的触发、断线重连）的订阅者先收到已发生的事件。
+多进程部署时事件另外写入 Redis（services/run_registry.py）。
+"""
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Optional
+
+from config import settings
+
+# 任务结束的事件（由 RunGuard 发出），之后不再有事件
+FINAL_EVENTS = ("done", "failed", "cancelled")
+
+# 任务结束后保留进度的秒数（POST 启动与 SSE 订阅之间任务可能已经结束）
+FINISHED_PROGRESS_SECONDS = 60
+
+
+class ProgressRun:
+    def __init__(self, operation: str, user_id: int):
+        self.operation = operation
+        self.user_id = user_id
+        self.counts = {}
+        self.history = deque(maxlen=settings.PROGRESS_HISTORY_EVENTS)
+        self.finished = False
+        self._seq = 0
+        self._subscribers = set()
+        self._listeners = []
+
+    @property
+    def last_id(self) -> int:
+        """最后一个事件的 id（还没有事件时为 0）"""
+        return self._seq
+
+    def add_listener(self, callback) -> None:
+        """注册回调：之后的每个事件调用 callback(item)"""
+        self._listeners.append(callback)
+
+    def count(self, **increments: int) -> None:
+        """累加计数，随下一个事件发出"""
+        for name, value in increments.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def emit(self, event: str, **data) -> None:
+        if self.finished:
+            return
+        self._seq += 1
+        item = {
+            "id": self._seq,
+            "event": event,
+            "operation": self.operation,
+            "time": time.time(),
+            "counts": dict(self.counts),
+            **data,
+        }
+        self.history.append(item)
+        self.finished = event in FINAL_EVENTS
+        for queue in self._subscribers:
+            queue.put_nowait(item)
+        for callback in self._listeners:
+            callback(item)
+
+    async def subscribe(self, after: int = 0) -> AsyncIterator[Optional[dict]]:
+        """
+        依次产出 id 大于 after 的事件，任务结束后停止
+
+        超过 PROGRESS_HEARTBEAT_SECONDS 没有事件时产出 None（用于发送心跳）
+        """
+        queue = asyncio.Queue()
+        backlog = [item for item in self.history if item["id"] > after]
+        if not self.finished:
+            self._subscribers.add(queue)
+        try:
+            for item in backlog:
+                yield item
+                if item["event"] in FINAL_EVENTS:
+                    return
+            while not self.finished or not queue.empty():
+                try:
+                    item = await asyncio.wait_for(
+                        queue.get(), settings.PROGRESS_HEARTBEAT_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield item
+                if item["event"] in FINAL_EVENTS:
+                    return
+        finally:
+            self._subscribers.discard(queue)
@@ -0,0 +1,374 @@
+"""
+数据保留任务
+
+用法：
+    python -m services.retention
+
+- send_logs / fetch_logs: PostgreSQL 上为月度分区表，整月过期的分区先导出
+  （CSV + gzip）再 DETACH / DROP，不逐行删除；DEFAULT 分区和其他数据库按批删除
+- emails: 按 received_at 分批导出（NDJSON + gzip，含正文）后删除，
+  正文、检索记录和发件箱由外键级联删除；只在配置了持久的 RETENTION_ARCHIVE_DIR 时执行，
+  且不删除任何用户抓取窗口（days_to_scrape）内的邮件，否则会被重新抓取、处理和发送
+- stats_hourly: 直接删除过期的小时汇总（数据量小，不导出）
+- 提前创建未来几个月的分区
+
+应用启动后由 run_retention_worker 定期执行；多实例部署时用 advisory lock 保证只有一个实例运行。
+"""
+import asyncio
+import csv
+import gzip
+import json
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, select, text
+
+from config import settings
+from database.models import engine, Email, EmailBody, StatsHourly, UserConfig
+from services.data_version import bump_statement
+
+RETENTION_LOCK_ID = 727002
+
+# 日志表 -> 保留天数配置项
+LOG_TABLES = {
+    "send_logs": "RETENTION_SEND_LOGS_DAYS",
+    "fetch_logs": "RETENTION_FETCH_LOGS_DAYS",
+}
+
+
+def _add_months(value: datetime, months: int) -> datetime:
+    """value 所在月份往后 months 个月的第一天"""
+    month = value.month - 1 + months
+    return value.replace(
+        year=value.year + month // 12, month=month % 12 + 1, day=1,
+        hour=0, minute=0, second=0, microsecond=0,
+    )
+
+
+def _archive_path(name: str, suffix: str) -> Optional[str]:
+    if not settings.RETENTION_ARCHIVE_DIR:
+        return None
+    os.makedirs(settings.RETENTION_ARCHIVE_DIR, exist_ok=True)
+    return os.path.join(settings.RETENTION_ARCHIVE_DIR, f"{name}{suffix}")
+
+
+def email_archive_problem() -> Optional[str]:
+    """删除邮件前必须能持久保存归档，返回不能删除的原因（可以删除时为 None）"""
+    archive_dir = settings.RETENTION_ARCHIVE_DIR
+    if not archive_dir:
+        return "未配置 RETENTION_ARCHIVE_DIR，不删除邮件"
+    real_dir = os.path.realpath(archive_dir)
+    tmp_dir = os.path.realpath(tempfile.gettempdir())
+    if real_dir == tmp_dir or real_dir.startswith(tmp_dir + os.sep):
+        return f"RETENTION_ARCHIVE_DIR 位于临时目录 {tmp_dir}，重启后会丢失，不删除邮件"
+    return None
+
+
+def email_retention_days(connection) -> int:
+    """
+    邮件实际保留天数：不短于任何用户的抓取窗口（多留 1 天）
+
+    抓取窗口内的邮件删除后会被重新抓取，再次调用 AI 并重复发送。
+    """
+    default_days = UserConfig.__table__.c.days_to_scrape.default.arg
+    max_scrape_days = connection.execute(
+        select(func.max(func.coalesce(UserConfig.days_to_scrape, default_days)))
+    ).scalar()
+    connection.commit()
+    return max(settings.RETENTION_EMAILS_DAYS, (max_scrape_days or default_days) + 1)
+
+
+def _is_partitioned(connection, table: str) -> bool:
+    if connection.dialect.name != "postgresql":
+        return False
+    return (
+        connection.execute(
+            text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"),
+            {"table": table},
+        ).scalar()
+        == "p"
+    )
+
+
+def _partitions(connection, table: str) -> list:
+    """月度分区列表 [(分区名, 起始时间, 结束时间)]，按起始时间排序"""
+    names = connection.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:table)"
+        ),
+        {"table": table},
+    ).scalars()
+
+    pattern = re.compile(rf"^{table}_p(\d{{4}})_(\d{{2}})$")
+    result = []
+    for name in names:
+        match = pattern.match(name)
+        if match:
+            start = datetime(int(match.group(1)), int(match.group(2)), 1)
+            result.append((name, start, _add_months(start, 1)))
+    return sorted(result, key=lambda p: p[1])
+
+
+def ensure_partitions(connection, table: str, months_ahead: int) -> list:
+    """创建当前月到未来 months_ahead 个月的分区，返回新建的分区名"""
+    existing = {name for name, _, _ in _partitions(connection, table)}
+    connection.commit()
+    created = []
+    now = datetime.utcnow()
+    for offset in range(months_ahead + 1):
+        start = _add_months(now, offset)
+        name = f"{table}_p{start:%Y_%m}"
+        if name in existing:
+            continue
+        # DEFAULT 分区中若已有该月的数据，创建会失败，留待人工处理
+        try:
+            connection.execute(
+                text(
+                    f"CREATE TABLE {name} PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{start:%Y-%m-%d}') "
+                    f"TO ('{_add_months(start, 1):%Y-%m-%d}')"
+                )
+            )
+            connection.commit()
+            created.append(name)
+        except Exception as e:
+            connection.rollback()
+            print(f"创建分区 {name} 失败: {e}")
+    return created
+
+
+def _export_csv(connection, sql: str, name: str) -> Optional[str]:
+    """把查询结果导出为 gzip 压缩的 CSV（PostgreSQL 上使用 COPY 流式导出）"""
+    path = _archive_path(name, ".csv.gz")
+    if not path:
+        return None
+
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8", newline="") as f:
+        if connection.dialect.name == "postgresql":
+            raw = connection.connection.driver_connection
+            with raw.cursor() as cursor:
+                cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH CSV HEADER", f)
+        else:
+            result = connection.execute(text(sql).execution_options(yield_per=1000))
+            writer = csv.writer(f)
+            writer.writerow(result.keys())
+            for row in result:
+                writer.writerow(row)
+    os.replace(tmp_path, path)
+    return path
+
+
+def archive_partition(connection, table: str, partition: str) -> Optional[str]:
+    """导出整个分区后 DETACH 并 DROP（只持有很短的元数据锁）"""
+    path = _export_csv(connection, f"SELECT * FROM {partition}", partition)
+    connection.commit()
+
+    connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {partition}"))
+    connection.execute(text(f"DROP TABLE {partition}"))
+    connection.commit()
+    return path
+
+
+def purge_log_rows(connection, table: str, cutoff: datetime) -> int:
+    """
+    分批删除 created_at 早于 cutoff 的日志行（非分区表 / DEFAULT 分区）
+
+    删除前整体导出一次，之后每批提交，避免长事务和大量锁。
+    """
+    cutoff_sql = f"created_at < '{cutoff:%Y-%m-%d %H:%M:%S}'"
+    has_rows = connection.execute(
+        text(f"SELECT 1 FROM {table} WHERE {cutoff_sql} LIMIT 1")
+    ).scalar()
+    connection.commit()
+    if not has_rows:
+        return 0
+
+    _export_csv(
+        connection,
+        f"SELECT * FROM {table} WHERE {cutoff_sql} ORDER BY id",
+        f"{table}_{datetime.utcnow():%Y%m%d%H%M%S}",
+    )
+    connection.commit()
+
+    deleted = 0
+    while True:
+        count = connection.execute(
+            text(
+                f"DELETE FROM {table} WHERE id IN ("
+                f"SELECT id FROM {table} WHERE {cutoff_sql} "
+                "ORDER BY id LIMIT :batch)"
+            ),
+            {"batch": settings.RETENTION_BATCH_SIZE},
+        ).rowcount
+        connection.commit()
+        deleted += count
+        if count < settings.RETENTION_BATCH_SIZE:
+            return deleted
+
+
+def purge_emails(connection, cutoff: datetime) -> int:
+    """分批导出（含正文）并删除 received_at 早于 cutoff 的邮件"""
+    path = _archive_path(f"emails_{datetime.utcnow():%Y%m%d%H%M%S}", ".ndjson.gz")
+    tmp_path = f"{path}.tmp" if path else None
+    archive = gzip.open(tmp_path, "wt", encoding="utf-8") if path else None
+
+    emails = Email.__table__
+    bodies = EmailBody.__table__
+    deleted = 0
+    last_id = 0
+    try:
+        while True:
+            batch = connection.execute(
+                select(emails.c.id, emails.c.user_id)
+                .where(emails.c.received_at < cutoff, emails.c.id > last_id)
+                .order_by(emails.c.id)
+                .limit(settings.RETENTION_BATCH_SIZE)
+            ).all()
+            if not batch:
+                connection.commit()
+                break
+            ids = [row.id for row in batch]
+
+            if archive:
+                rows = connection.execute(
+                    select(
+                        emails,
+                        bodies.c.body_html,
+                        bodies.c.body_text,
+                        bodies.c.processed_content,
+                    )
+                    .select_from(
+                        emails.outerjoin(bodies, bodies.c.email_id == emails.c.id)
+                    )
+                    .where(emails.c.id.in_(ids))
+                    .order_by(emails.c.id)
+                )
+                for row in rows:
+                    archive.write(
+                        json.dumps(row._asdict(), ensure_ascii=False, default=str)
+                        + "\n"
+                    )
+
+            # email_bodies / email_search / outbox 级联删除，send_logs.email_id 置空
+            deleted += connection.execute(
+                delete(emails).where(emails.c.id.in_(ids))
+            ).rowcount
+            user_ids = sorted({row.user_id for row in batch if row.user_id is not None})
+            if user_ids:
+                connection.execute(bump_statement(connection.dialect.name, user_ids))
+            connection.commit()
+            last_id = ids[-1]
+    finally:
+        if archive:
+            archive.close()
+            if deleted:
+                os.replace(tmp_path, path)
+            else:
+                os.remove(tmp_path)
+
+    return deleted
+
+
+def run_retention() -> dict:
+    """执行一轮保留策略，返回各表的处理结果"""
+    stats = {}
+    now = datetime.utcnow()
+
+    with engine.connect() as connection:
+        is_pg = connection.dialect.name == "postgresql"
+        if is_pg:
+            locked = connection.execute(
+                text(f"SELECT pg_try_advisory_lock({RETENTION_LOCK_ID})")
+            ).scalar()
+            connection.commit()
+            if not locked:
+                return {"skipped": "其他实例正在执行"}
+
+        try:
+            for table, setting in LOG_TABLES.items():
+                days = getattr(settings, setting)
+                table_stats = {}
+
+                partitioned = _is_partitioned(connection, table)
+                connection.commit()
+
+                if partitioned:
+                    table_stats["created"] = ensure_partitions(
+                        connection, table, settings.PARTITION_PREMAKE_MONTHS
+                    )
+                    connection.commit()
+
+                    if days:
+                        cutoff = now - timedelta(days=days)
+                        expired = [
+                            name
+                            for name, _, end in _partitions(connection, table)
+                            if end <= cutoff
+                        ]
+                        connection.commit()
+                        table_stats["archived"] = [
+                            archive_partition(connection, table, name) or name
+                            for name in expired
+                        ]
+                        table_stats["deleted"] = purge_log_rows(
+                            connection, f"{table}_default", cutoff
+                        )
+                elif days:
+                    table_stats["deleted"] = purge_log_rows(
+                        connection, table, now - timedelta(days=days)
+                    )
+
+                stats[table] = table_stats
+
+            if settings.RETENTION_STATS_HOURLY_DAYS:
+                stats["stats_hourly"] = {
+                    "deleted": connection.execute(
+                        delete(StatsHourly).where(
+                            StatsHourly.hour
+                            < now - timedelta(days=settings.RETENTION_STATS_HOURLY_DAYS)
+                        )
+                    ).rowcount
+                }
+                connection.commit()
+
+            if settings.RETENTION_EMAILS_DAYS:
+                problem = email_archive_problem()
+                if problem:
+                    stats["emails"] = {"skipped": problem}
+                else:
+                    days = email_retention_days(connection)
+                    stats["emails"] = {
+                        "days": days,
+                        "deleted": purge_emails(connection, now - timedelta(days=days)),
+                    }
+        finally:
+            if is_pg:
+                connection.rollback()
+                connection.execute(
+                    text(f"SELECT pg_advisory_unlock({RETENTION_LOCK_ID})")
+                )
+                connection.commit()
+
+    return stats
+
+
+async def run_retention_worker():
+    """后台定期执行保留策略（同步引擎，放到线程中运行）"""
+    while True:
+        try:
+            stats = await asyncio.to_thread(run_retention)
+            print(f"🗄️ 数据保留: {stats}")
+        except Exception as e:
+            print(f"数据保留任务出错: {e}")
+
+        await asyncio.sleep(settings.RETENTION_INTERVAL_HOURS * 3600)
+
+
+if __name__ == "__main__":
+    print(run_retention())
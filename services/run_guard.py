@@ -0,0 +1,260 @@
+"""
+抓取 / 处理任务的并发控制
+
+- 单飞：同一用户同一操作只运行一次，运行期间的重复触发等待并返回同一结果；
+  多进程部署时 PostgreSQL advisory lock 保证同一时间只有一个进程在运行，
+  其他进程上的触发返回 409；锁加在任务自己的数据库连接上，每个任务只占用一个连接
+- 限流（每个进程）：每用户 / 全局在 TRIGGER_RATE_LIMIT_WINDOW_SECONDS 内的触发次数，
+  以及同时运行的任务数，超出返回 429
+- 每次运行带一个 ProgressRun（services/progress.py），SSE 接口订阅进度；任务结束后
+  进度再保留 FINISHED_PROGRESS_SECONDS 秒，启动后才订阅的客户端也能收到结果；
+  cancel() 取消正在运行的任务，等待结果的请求收到 409
+- 进度和取消句柄只在运行任务的进程中；多进程部署时由 run_registry（Redis）
+  让其他进程订阅进度、发送取消请求
+"""
+import asyncio
+import time
+import zlib
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from config import settings
+from database.models import IS_SQLITE, async_engine
+from services.progress import FINISHED_PROGRESS_SECONDS, ProgressRun
+from services.run_registry import run_registry
+
+
+class SlidingWindowLimiter:
+    """滑动窗口计数：窗口内最多 limit 次，返回需要等待的秒数（0 表示放行）"""
+
+    def __init__(self, limit: int, window: int):
+        self.limit = limit
+        self.window = window
+        self._hits: Dict[object, deque] = {}
+
+    def hit(self, key) -> float:
+        if not self.limit:
+            return 0
+        now = time.monotonic()
+        hits = self._hits.setdefault(key, deque())
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+        if len(hits) >= self.limit:
+            return hits[0] + self.window - now
+        hits.append(now)
+        return 0
+
+    def __len__(self):
+        return len(self._hits)
+
+    def cleanup(self):
+        """删除窗口外已空的 key，避免用户数增长后字典无限变大"""
+        cutoff = time.monotonic() - self.window
+        for key in [k for k, hits in self._hits.items() if not hits or hits[-1] <= cutoff]:
+            self._hits.pop(key, None)
+
+
+def _too_many(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(int(retry_after + 0.999), 1))},
+    )
+
+
+class RunGuard:
+    def __init__(self):
+        self._inflight: Dict[Tuple[str, int], asyncio.Task] = {}
+        self._progress: Dict[Tuple[str, int], ProgressRun] = {}
+        self._user_limiter = SlidingWindowLimiter(
+            settings.TRIGGER_RATE_LIMIT_PER_USER, settings.TRIGGER_RATE_LIMIT_WINDOW_SECONDS
+        )
+        self._global_limiter = SlidingWindowLimiter(
+            settings.TRIGGER_RATE_LIMIT_GLOBAL, settings.TRIGGER_RATE_LIMIT_WINDOW_SECONDS
+        )
+        self._running: Dict[str, int] = {}
+
+    def start(
+        self,
+        operation: str,
+        user_id: int,
+        func: Callable[[ProgressRun, AsyncConnection], Awaitable],
+    ) -> Tuple[asyncio.Task, ProgressRun]:
+        """
+        启动 func(progress, connection)，已在运行时返回正在运行的任务和它的进度
+
+        func 需在传入的连接上创建自己的数据库会话（不能使用请求的会话）：
+        发起请求的连接断开后任务仍会继续，等待同一任务的其他请求也会拿到结果。
+        PostgreSQL 上该连接持有 advisory lock，任务不再额外占用连接池。
+        """
+        key = (operation, user_id)
+        task = self._inflight.get(key)
+        if task is None:
+            self._check_limits(operation, user_id)
+            progress = ProgressRun(operation, user_id)
+            task = asyncio.create_task(
+                self._run_with_progress(operation, user_id, func, progress)
+            )
+            self._inflight[key] = task
+            self._progress[key] = progress
+            self._running[operation] = self._running.get(operation, 0) + 1
+
+            def done(finished: asyncio.Task):
+                # 只有 SSE 订阅者时没有人读取异常，这里标记为已读取（失败已通过进度事件发出）
+                if not finished.cancelled():
+                    finished.exception()
+                # 启动前就被取消时任务没有运行，补发结束事件，订阅者不会一直等待
+                if not progress.finished:
+                    progress.emit("cancelled")
+                self._inflight.pop(key, None)
+                self._running[operation] -= 1
+                asyncio.get_running_loop().call_later(
+                    FINISHED_PROGRESS_SECONDS, self._forget, key, progress
+                )
+
+            task.add_done_callback(done)
+
+        return task, self._progress[key]
+
+    async def run(
+        self,
+        operation: str,
+        user_id: int,
+        func: Callable[[ProgressRun, AsyncConnection], Awaitable],
+    ):
+        """以单飞方式运行 func(progress, connection) 并等待结果"""
+        task, _ = self.start(operation, user_id, func)
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled():
+                raise HTTPException(status_code=409, detail="任务已取消")
+            raise
+
+    def progress(self, operation: str, user_id: int) -> Optional[ProgressRun]:
+        """正在运行或刚结束的任务的进度（没有时为 None）"""
+        return self._progress.get((operation, user_id))
+
+    async def shared_progress(self, operation: str, user_id: int):
+        """
+        本进程或其他进程（run_registry）中正在运行或刚结束的任务的进度
+
+        本进程的任务已结束、其他进程中有正在运行的任务时返回后者。
+        """
+        local = self.progress(operation, user_id)
+        if local is not None and not local.finished:
+            return local
+        remote = await run_registry.progress(operation, user_id)
+        if remote is not None and (local is None or not remote.finished):
+            return remote
+        return local
+
+    async def cancel_shared(self, operation: str, user_id: int) -> bool:
+        """取消本进程中的任务，没有时请求其他进程取消"""
+        return self.cancel(operation, user_id) or await run_registry.request_cancel(
+            operation, user_id
+        )
+
+    def _forget(self, key: Tuple[str, int], progress: ProgressRun):
+        # 期间已经启动了新任务时保留新任务的进度
+        if self._progress.get(key) is progress:
+            del self._progress[key]
+
+    def cancel(self, operation: str, user_id: int) -> bool:
+        """取消正在运行的任务（在下一个 await 处抛出 CancelledError）"""
+        task = self._inflight.get((operation, user_id))
+        if task is None or task.done():
+            return False
+        return task.cancel()
+
+    def _check_limits(self, operation: str, user_id: int):
+        if settings.TRIGGER_MAX_CONCURRENT and (
+            self._running.get(operation, 0) >= settings.TRIGGER_MAX_CONCURRENT
+        ):
+            raise _too_many("系统繁忙，请稍后再试", 5)
+
+        retry_after = self._user_limiter.hit((operation, user_id))
+        if retry_after:
+            raise _too_many(
+                f"操作过于频繁，请 {int(retry_after + 0.999)} 秒后再试", retry_after
+            )
+
+        retry_after = self._global_limiter.hit(operation)
+        if retry_after:
+            raise _too_many("系统繁忙，请稍后再试", retry_after)
+
+        if len(self._user_limiter) > 10000:
+            self._user_limiter.cleanup()
+
+    async def _run_with_progress(
+        self, operation: str, user_id: int, func, progress: ProgressRun
+    ):
+        progress.emit("start")
+        try:
+            result = await self._run_locked(
+                operation,
+                user_id,
+                lambda connection: self._run_shared(func, progress, connection),
+            )
+        except asyncio.CancelledError:
+            progress.emit("cancelled")
+            raise
+        except HTTPException as e:
+            progress.emit("failed", status_code=e.status_code, detail=e.detail)
+            raise
+        except Exception as e:
+            progress.emit("failed", status_code=500, detail=str(e))
+            raise
+        progress.emit("done", result=result)
+        return result
+
+    async def _run_shared(self, func, progress: ProgressRun, connection):
+        """取得任务锁后运行：进度同步到 Redis，并接收其他进程发来的取消请求"""
+        run_registry.attach(progress)
+        watcher = asyncio.create_task(
+            run_registry.watch_cancel(
+                progress.operation, progress.user_id, asyncio.current_task()
+            )
+        )
+        try:
+            return await func(progress, connection)
+        finally:
+            watcher.cancel()
+
+    async def _run_locked(self, operation: str, user_id: int, func):
+        async with async_engine.connect() as connection:
+            if IS_SQLITE:
+                return await func(connection)
+
+            # 跨进程互斥：会话级 advisory lock 持有到任务结束，不受 func 内提交影响；
+            # func 的会话绑定在同一连接上，任务只占用这一个连接
+            lock_key = zlib.crc32(operation.encode()) & 0x7FFFFFFF
+            locked = await connection.scalar(
+                text("SELECT pg_try_advisory_lock(:op, :user_id)"),
+                {"op": lock_key, "user_id": user_id},
+            )
+            await connection.commit()
+            if not locked:
+                raise HTTPException(status_code=409, detail="已有相同任务正在运行，请稍后刷新")
+            try:
+                return await func(connection)
+            finally:
+                try:
+                    await connection.rollback()
+                    await connection.execute(
+                        text("SELECT pg_advisory_unlock(:op, :user_id)"),
+                        {"op": lock_key, "user_id": user_id},
+                    )
+                    await connection.commit()
+                except Exception as e:
+                    # 解锁失败（如任务取消时连接处于异常状态）：关闭底层连接，锁随之释放，
+                    # 不把持有锁的连接还回连接池
+                    print(f"⚠️  释放任务锁失败，关闭连接: {e}")
+                    await connection.invalidate()
+
+
+run_guard = RunGuard()
@@ -0,0 +1,228 @@
+"""
+多进程共享的抓取 / 处理任务进度（Redis）
+
+任务只在启动它的进程中运行，进度（ProgressRun）和取消句柄也只在该进程中。
+配置了 REDIS_URL 时，持有任务锁的进程把进度事件写入 Redis 列表，其他进程的
+SSE 请求轮询该列表推送进度，取消请求写入取消标记，由运行任务的进程轮询后取消。
+
+未配置 Redis 时只能单进程部署（WEB_CONCURRENCY=1），启动时会检查。
+"""
+import asyncio
+import time
+from typing import AsyncIterator, Optional
+
+import orjson
+
+from config import settings
+from services.progress import FINAL_EVENTS, FINISHED_PROGRESS_SECONDS, ProgressRun
+
+KEY_PREFIX = "run:"
+
+# 运行中的事件列表的过期时间（每个事件刷新；进程崩溃时遗留的记录最终会过期）
+RUNNING_TTL_SECONDS = 3600
+# 取消标记的有效期（任务已经结束时不会被后续的运行误用）
+CANCEL_TTL_SECONDS = 60
+# 其他进程轮询事件 / 取消标记的间隔
+POLL_SECONDS = 0.5
+# Redis 连接失败后多少秒内不再尝试
+REDIS_RETRY_SECONDS = 30
+
+
+def _events_key(operation: str, user_id: int) -> str:
+    return f"{KEY_PREFIX}{operation}:{user_id}:events"
+
+
+def _cancel_key(operation: str, user_id: int) -> str:
+    return f"{KEY_PREFIX}{operation}:{user_id}:cancel"
+
+
+class RemoteProgress:
+    """其他进程中运行的任务的进度（接口与 ProgressRun 的订阅部分相同）"""
+
+    def __init__(
+        self, registry: "RunRegistry", operation: str, user_id: int, items: list
+    ):
+        self._registry = registry
+        self.operation = operation
+        self.user_id = user_id
+        self._items = items
+
+    @property
+    def finished(self) -> bool:
+        return bool(self._items) and self._items[-1]["event"] in FINAL_EVENTS
+
+    @property
+    def last_id(self) -> int:
+        return self._items[-1]["id"] if self._items else 0
+
+    async def subscribe(self, after: int = 0) -> AsyncIterator[Optional[dict]]:
+        """依次产出 id 大于 after 的事件，任务结束（或记录过期）后停止"""
+        items = self._items
+        idle_since = time.monotonic()
+        while True:
+            for item in items:
+                if item["id"] <= after:
+                    continue
+                after = item["id"]
+                idle_since = time.monotonic()
+                yield item
+                if item["event"] in FINAL_EVENTS:
+                    return
+
+            if time.monotonic() - idle_since >= settings.PROGRESS_HEARTBEAT_SECONDS:
+                idle_since = time.monotonic()
+                yield None
+
+            await asyncio.sleep(POLL_SECONDS)
+            items = await self._registry.read(self.operation, self.user_id)
+            if items is None:
+                return
+
+
+class RunRegistry:
+    def __init__(self):
+        self._redis = None
+        self._redis_down_until = 0.0
+        self._redis_warned = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.REDIS_URL)
+
+    def _get_redis(self):
+        """Redis 客户端；未配置或最近连接失败时返回 None"""
+        if not settings.REDIS_URL or time.monotonic() < self._redis_down_until:
+            return None
+        if self._redis is None:
+            import redis.asyncio as redis
+
+            self._redis = redis.from_url(
+                settings.REDIS_URL,
+                socket_timeout=settings.TOKEN_CACHE_REDIS_TIMEOUT,
+                socket_connect_timeout=settings.TOKEN_CACHE_REDIS_TIMEOUT,
+            )
+        return self._redis
+
+    def _redis_failed(self, e: Exception):
+        if not self._redis_warned:
+            print(f"⚠️ 任务进度 Redis 不可用，暂时无法跨进程查看 / 取消任务: {str(e)[:100]}")
+            self._redis_warned = True
+        self._redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+
+    # ---------- 运行任务的进程 ----------
+
+    def attach(self, progress: ProgressRun) -> None:
+        """
+        开始把进度事件写入 Redis（在取得任务锁之后调用）
+
+        先写入已发生的事件，替换同一用户同一操作上一次运行的记录；
+        写入在后台按顺序进行，不阻塞任务。
+        """
+        if not self.enabled:
+            return
+        key = _events_key(progress.operation, progress.user_id)
+        pending = list(progress.history)
+        state = {"reset": True, "writer": None}
+
+        async def write():
+            while pending:
+                items = pending[:]
+                del pending[: len(items)]
+                client = self._get_redis()
+                if client is None:
+                    continue
+                finished = items[-1]["event"] in FINAL_EVENTS
+                try:
+                    async with client.pipeline(transaction=True) as pipe:
+                        if state["reset"]:
+                            pipe.delete(key)
+                        pipe.rpush(key, *(orjson.dumps(item) for item in items))
+                        pipe.ltrim(key, -settings.PROGRESS_HISTORY_EVENTS, -1)
+                        ttl = FINISHED_PROGRESS_SECONDS if finished else RUNNING_TTL_SECONDS
+                        pipe.expire(key, ttl)
+                        await pipe.execute()
+                    state["reset"] = False
+                except Exception as e:
+                    self._redis_failed(e)
+
+        def schedule():
+            if state["writer"] is None or state["writer"].done():
+                state["writer"] = asyncio.get_running_loop().create_task(write())
+
+        def on_event(item: dict):
+            pending.append(item)
+            schedule()
+
+        progress.add_listener(on_event)
+        if pending:
+            schedule()
+
+    async def watch_cancel(self, operation: str, user_id: int, task: asyncio.Task):
+        """
+        轮询其他进程写入的取消标记，收到后取消本进程中的任务
+
+        由运行任务的进程在取得任务锁后启动，任务结束时取消该轮询。
+        启动时先清除残留的标记（上一次运行结束后才到达的取消请求）。
+        """
+        if not self.enabled:
+            return
+        key = _cancel_key(operation, user_id)
+        client = self._get_redis()
+        if client is not None:
+            try:
+                await client.delete(key)
+            except Exception as e:
+                self._redis_failed(e)
+
+        while True:
+            await asyncio.sleep(POLL_SECONDS)
+            client = self._get_redis()
+            if client is None:
+                continue
+            try:
+                requested = await client.delete(key)
+            except Exception as e:
+                self._redis_failed(e)
+                continue
+            if requested:
+                task.cancel()
+                return
+
+    # ---------- 其他进程 ----------
+
+    async def read(self, operation: str, user_id: int) -> Optional[list]:
+        """Redis 中记录的事件（没有记录或 Redis 不可用时为 None）"""
+        client = self._get_redis()
+        if client is None:
+            return None
+        try:
+            values = await client.lrange(_events_key(operation, user_id), 0, -1)
+        except Exception as e:
+            self._redis_failed(e)
+            return None
+        return [orjson.loads(value) for value in values] or None
+
+    async def progress(self, operation: str, user_id: int) -> Optional[RemoteProgress]:
+        """其他进程中正在运行或刚结束的任务的进度（没有时为 None）"""
+        items = await self.read(operation, user_id)
+        if items is None:
+            return None
+        return RemoteProgress(self, operation, user_id, items)
+
+    async def request_cancel(self, operation: str, user_id: int) -> bool:
+        """请求取消其他进程中正在运行的任务，没有正在运行的任务时返回 False"""
+        remote = await self.progress(operation, user_id)
+        if remote is None or remote.finished:
+            return False
+        client = self._get_redis()
+        if client is None:
+            return False
+        try:
+            await client.set(_cancel_key(operation, user_id), 1, ex=CANCEL_TTL_SECONDS)
+        except Exception as e:
+            self._redis_failed(e)
+            return False
+        return True
+
+
+run_registry = RunRegistry()
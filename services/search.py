@@ -0,0 +1,399 @@
+import html
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import DateTime, and_, case, func, literal_column, or_, select, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database.models import Email, EmailSearch
+from utils.text import html_to_text
+
+# 分词配置需与迁移 0006 中生成列使用的一致；simple 不做词干提取，
+# 中英文混合的邮件里行为更可预期
+TS_CONFIG = "simple"
+_TS_CONFIG = literal_column(f"'{TS_CONFIG}'::regconfig")
+
+# PostgreSQL 生成列，ORM 中未声明
+_SEARCH_VECTOR = literal_column("email_search.search_vector", TSVECTOR)
+
+# 中日韩文字：simple 分词 / FTS5 unicode61 把连续的汉字当作一个词，"发票" 匹配不到
+# "请查收本月发票"，含这些字符的词改用子串匹配（PostgreSQL 上由 pg_trgm 索引加速）
+_CJK_RE = re.compile(
+    r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]"
+)
+
+# 子串匹配时各列的权重（与全文检索的 主题 > 发件人 > 正文 一致）
+_SUBSTRING_WEIGHTS = (
+    (EmailSearch.subject, 10.0),
+    (EmailSearch.sender, 5.0),
+    (EmailSearch.body, 1.0),
+)
+
+# 子串匹配的摘要：命中位置前后的字符数
+_SNIPPET_CONTEXT_CHARS = 40
+
+# 高亮占位符：数据库先用私有区字符标记，转义 HTML 后再替换为 <mark>
+_MARK_START = "\ue000"
+_MARK_END = "\ue001"
+
+_HEADLINE_OPTIONS = (
+    f'StartSel="{_MARK_START}", StopSel="{_MARK_END}", '
+    "MaxFragments=2, MaxWords=24, MinWords=8"
+)
+_SUBJECT_HEADLINE_OPTIONS = (
+    f'StartSel="{_MARK_START}", StopSel="{_MARK_END}", HighlightAll=true'
+)
+
+# SQLite FTS5: 各列 (subject, sender, body) 的 bm25 权重
+_FTS_SEARCH_SQL = """
+SELECT e.id, e.subject, e.sender_email, e.sender_name, e.received_at,
+       -bm25(email_search_fts, 10.0, 5.0, 1.0) AS rank,
+       highlight(email_search_fts, 0, :mark_start, :mark_end) AS subject_highlight,
+       snippet(email_search_fts, 2, :mark_start, :mark_end, '…', 24) AS snippet
+FROM email_search_fts
+JOIN email_search s ON s.email_id = email_search_fts.rowid
+JOIN emails e ON e.id = s.email_id
+WHERE email_search_fts MATCH :query AND s.user_id = :user_id
+ORDER BY bm25(email_search_fts, 10.0, 5.0, 1.0), e.id DESC
+LIMIT :limit OFFSET :offset
+"""
+
+
+def _sender_text(sender_name: Optional[str], sender_email: Optional[str]) -> str:
+    """发件人检索文本：地址整体之外再拆出用户名和域名，便于按片段搜索"""
+    parts = [sender_name or "", sender_email or ""]
+    if sender_email and "@" in sender_email:
+        parts.extend(sender_email.split("@", 1))
+    return " ".join(p for p in parts if p)
+
+
+def build_search_document(
+    user_id: int,
+    subject: Optional[str],
+    sender_name: Optional[str],
+    sender_email: Optional[str],
+    body_html: Optional[str] = None,
+    body_text: Optional[str] = None,
+) -> EmailSearch:
+    """构造邮件的检索记录（正文清洗为纯文本并截断）"""
+    body = html_to_text(body_html) or html_to_text(body_text)
+    return EmailSearch(
+        user_id=user_id,
+        subject=subject or "",
+        sender=_sender_text(sender_name, sender_email),
+        body=body[: settings.SEARCH_BODY_MAX_CHARS],
+    )
+
+
+def normalize_keywords(keywords) -> List[str]:
+    """清理 UserConfig.keyword_filter（去空白、去重）"""
+    result = []
+    for keyword in keywords or []:
+        keyword = str(keyword).replace('"', " ").strip()
+        if keyword and keyword not in result:
+            result.append(keyword)
+    return result
+
+
+def _any_keyword_query(keywords: List[str]) -> str:
+    """关键词之间为 OR，每个关键词按短语匹配（websearch 语法）"""
+    return " OR ".join(f'"{keyword}"' for keyword in keywords)
+
+
+def _fts5_query(query: str) -> str:
+    """
+    把 websearch 风格的查询转换为 FTS5 语法
+
+    每个词/短语加引号，避免用户输入中的特殊字符被当作 FTS5 运算符；
+    词之间为 AND，保留大写 OR。
+    """
+    terms = []
+    for token in re.findall(r'"[^"]*"|\S+', query):
+        if token == "OR":
+            if terms and terms[-1] != "OR":
+                terms.append("OR")
+            continue
+        token = token.strip('"').strip()
+        if token:
+            terms.append('"' + token.replace('"', '""') + '"')
+    while terms and terms[-1] == "OR":
+        terms.pop()
+    return " ".join(terms)
+
+
+def has_cjk(value: str) -> bool:
+    return bool(_CJK_RE.search(value))
+
+
+def _query_groups(query: str) -> List[List[Tuple[str, bool]]]:
+    """
+    websearch 风格的查询拆分为 OR 分组，组内各词为 AND：[[(词, 是否排除), ...], ...]
+
+    "短语" 作为一个词，-词 表示排除
+    """
+    groups = [[]]
+    for token in re.findall(r'-?"[^"]*"|\S+', query):
+        if token == "OR":
+            if groups[-1]:
+                groups.append([])
+            continue
+        negate = token.startswith("-") and len(token) > 1
+        term = token[1:] if negate else token
+        term = term.strip('"').strip()
+        if term:
+            groups[-1].append((term, negate))
+    return [group for group in groups if any(not negate for _, negate in group)]
+
+
+def _term_condition(term: str):
+    return or_(
+        *(column.icontains(term, autoescape=True) for column, _ in _SUBSTRING_WEIGHTS)
+    )
+
+
+def _substring_condition(groups: List[List[Tuple[str, bool]]]):
+    return or_(
+        *(
+            and_(
+                *(
+                    ~_term_condition(term) if negate else _term_condition(term)
+                    for term, negate in group
+                )
+            )
+            for group in groups
+        )
+    )
+
+
+def _matching_ids(dialect: str, user_id: int, query: str):
+    """匹配查询的邮件 ID 子查询（走 GIN / FTS5 索引）"""
+    if dialect == "postgresql":
+        return select(EmailSearch.email_id).where(
+            EmailSearch.user_id == user_id,
+            _SEARCH_VECTOR.op("@@")(func.websearch_to_tsquery(_TS_CONFIG, query)),
+        )
+
+    return (
+        select(literal_column("rowid"))
+        .select_from(text("email_search_fts"))
+        .where(
+            text("email_search_fts MATCH :fts_query").bindparams(
+                fts_query=_fts5_query(query)
+            )
+        )
+    )
+
+
+def keyword_condition(dialect: str, user_id: int, keywords) -> Optional[object]:
+    """
+    邮件命中任一关键词的过滤条件
+
+    未配置关键词时返回 None（不过滤）。
+    """
+    keywords = normalize_keywords(keywords)
+    if not keywords:
+        return None
+
+    conditions = []
+    words = [keyword for keyword in keywords if not has_cjk(keyword)]
+    if words:
+        conditions.append(
+            Email.id.in_(_matching_ids(dialect, user_id, _any_keyword_query(words)))
+        )
+    cjk = [keyword for keyword in keywords if has_cjk(keyword)]
+    if cjk:
+        conditions.append(
+            Email.id.in_(
+                select(EmailSearch.email_id).where(
+                    EmailSearch.user_id == user_id,
+                    _substring_condition([[(keyword, False)] for keyword in cjk]),
+                )
+            )
+        )
+    return or_(*conditions)
+
+
+async def count_keyword_matches(
+    db: AsyncSession, user_id: int, email_ids: List[int], keywords
+) -> int:
+    """统计给定邮件中命中关键词的数量"""
+    condition = keyword_condition(db.bind.dialect.name, user_id, keywords)
+    if condition is None or not email_ids:
+        return len(email_ids)
+
+    return await db.scalar(
+        select(func.count())
+        .select_from(Email)
+        .where(Email.id.in_(email_ids), condition)
+    )
+
+
+def _mark_terms(value: Optional[str], terms: List[str]) -> Optional[str]:
+    """用占位符标记命中的词（不区分大小写）"""
+    if not value or not terms:
+        return value
+    pattern = "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    return re.sub(
+        pattern, lambda m: f"{_MARK_START}{m.group(0)}{_MARK_END}", value, flags=re.I
+    )
+
+
+def _substring_snippet(body: Optional[str], terms: List[str]) -> Optional[str]:
+    """命中位置附近的一段正文（没有命中时取开头），与 ts_headline 的行为一致"""
+    if not body:
+        return body
+    lowered = body.lower()
+    positions = [lowered.find(term.lower()) for term in terms]
+    start = min((p for p in positions if p >= 0), default=0)
+    begin = max(0, start - _SNIPPET_CONTEXT_CHARS)
+    end = start + _SNIPPET_CONTEXT_CHARS * 3
+    snippet = body[begin:end]
+    return ("…" if begin else "") + _mark_terms(snippet, terms) + (
+        "…" if end < len(body) else ""
+    )
+
+
+async def _search_substring(
+    db: AsyncSession, user_id: int, query: str, limit: int, offset: int
+) -> List[dict]:
+    """含中日韩文字的查询：子串匹配，按命中的列加权排序，高亮在应用中计算"""
+    groups = _query_groups(query)
+    if not groups:
+        return []
+    terms = list(
+        dict.fromkeys(term for group in groups for term, negate in group if not negate)
+    )
+    rank = sum(
+        case((column.icontains(term, autoescape=True), weight), else_=0.0)
+        for term in terms
+        for column, weight in _SUBSTRING_WEIGHTS
+    ).label("rank")
+
+    rows = (
+        await db.execute(
+            select(
+                Email.id,
+                Email.sender_email,
+                Email.sender_name,
+                Email.received_at,
+                EmailSearch.subject,
+                EmailSearch.body,
+                rank,
+            )
+            .join(EmailSearch, EmailSearch.email_id == Email.id)
+            .where(EmailSearch.user_id == user_id, _substring_condition(groups))
+            .order_by(rank.desc(), Email.id.desc())
+            .limit(limit)
+            .offset(offset)
+        )
+    ).all()
+
+    return [
+        {
+            "id": row.id,
+            "subject": row.subject,
+            "sender_email": row.sender_email,
+            "sender_name": row.sender_name,
+            "received_at": row.received_at.isoformat() if row.received_at else None,
+            "rank": round(float(row.rank or 0), 6),
+            "subject_highlight": _render_highlight(_mark_terms(row.subject, terms)),
+            "snippet": _render_highlight(_substring_snippet(row.body, terms)),
+        }
+        for row in rows
+    ]
+
+
+def _render_highlight(value: Optional[str]) -> Optional[str]:
+    """转义 HTML 后把占位符替换为 <mark>"""
+    if value is None:
+        return None
+    return (
+        html.escape(value)
+        .replace(_MARK_START, "<mark>")
+        .replace(_MARK_END, "</mark>")
+    )
+
+
+async def search_emails(
+    db: AsyncSession, user_id: int, query: str, limit: int = 20, offset: int = 0
+) -> List[dict]:
+    """
+    全文检索用户的邮件，按相关度排序
+
+    PostgreSQL: websearch_to_tsquery + ts_rank_cd，高亮用 ts_headline
+    （只对当前页的结果计算）；SQLite: FTS5 MATCH + bm25，高亮用 snippet。
+    含中日韩文字的查询改用子串匹配（分词器无法切分连续的汉字）。
+
+    Returns:
+        [{id, subject, sender_email, sender_name, received_at, rank,
+          subject_highlight, snippet}]，高亮片段已转义，命中部分用 <mark> 包裹
+    """
+    if has_cjk(query):
+        return await _search_substring(db, user_id, query, limit, offset)
+
+    dialect = db.bind.dialect.name
+
+    if dialect == "postgresql":
+        tsquery = func.websearch_to_tsquery(_TS_CONFIG, query)
+        rank = func.ts_rank_cd(_SEARCH_VECTOR, tsquery).label("rank")
+        ranked = (
+            select(EmailSearch.email_id, rank)
+            .where(EmailSearch.user_id == user_id, _SEARCH_VECTOR.op("@@")(tsquery))
+            .order_by(rank.desc(), EmailSearch.email_id.desc())
+            .limit(limit)
+            .offset(offset)
+            .subquery()
+        )
+        stmt = (
+            select(
+                Email.id,
+                Email.subject,
+                Email.sender_email,
+                Email.sender_name,
+                Email.received_at,
+                ranked.c.rank,
+                func.ts_headline(
+                    _TS_CONFIG, EmailSearch.subject, tsquery, _SUBJECT_HEADLINE_OPTIONS
+                ).label("subject_highlight"),
+                func.ts_headline(
+                    _TS_CONFIG, EmailSearch.body, tsquery, _HEADLINE_OPTIONS
+                ).label("snippet"),
+            )
+            .join(ranked, ranked.c.email_id == Email.id)
+            .join(EmailSearch, EmailSearch.email_id == Email.id)
+            .order_by(ranked.c.rank.desc(), Email.id.desc())
+        )
+        rows = (await db.execute(stmt)).all()
+    else:
+        fts_query = _fts5_query(query)
+        if not fts_query:
+            return []
+        rows = (
+            await db.execute(
+                text(_FTS_SEARCH_SQL).columns(received_at=DateTime),
+                {
+                    "query": fts_query,
+                    "user_id": user_id,
+                    "limit": limit,
+                    "offset": offset,
+                    "mark_start": _MARK_START,
+                    "mark_end": _MARK_END,
+                },
+            )
+        ).all()
+
+    return [
+        {
+            "id": row.id,
+            "subject": row.subject,
+            "sender_email": row.sender_email,
+            "sender_name": row.sender_name,
+            "received_at": row.received_at.isoformat() if row.received_at else None,
+            "rank": round(float(row.rank or 0), 6),
+            "subject_highlight": _render_highlight(row.subject_highlight),
+            "snippet": _render_highlight(row.snippet),
+        }
+        for row in rows
+    ]
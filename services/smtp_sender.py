@@ -1,12 +1,37 @@
+import asyncio
 import aiosmtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
-from typing import List, Optional
+from typing import Awaitable, Callable, List, Optional, Tuple
 from datetime import datetime
 import base64
 from config import settings
+from utils.templates import env
+
+# 按 57 字节的整数倍读取，保证每块 base64 编码后正好是完整的 76 字符行
+BASE64_READ_CHUNK = 57 * 1024
+
+# 带附件的邮件在发送时整封保存在内存中（base64 正文 + 发送前序列化的整封邮件），
+# 限制同时发送的数量，避免多个大附件同时发送时内存占用叠加
+_attachment_send_semaphore = asyncio.Semaphore(settings.ATTACHMENT_SEND_CONCURRENCY)
+
+
+def encode_file_base64(file) -> str:
+    """
+    分块将文件内容编码为 MIME base64
+
+    原始内容不整体读入内存，但返回的 base64 字符串（约为文件大小的 4/3）仍完整保存在内存中
+    """
+    file.seek(0)
+    lines = []
+    while True:
+        chunk = file.read(BASE64_READ_CHUNK)
+        if not chunk:
+            break
+        lines.append(base64.encodebytes(chunk).decode("ascii"))
+    return "".join(lines)
 
 
 class SMTPSender:
@@ -26,6 +51,7 @@ class SMTPSender:
         body_html: str,
         body_text: Optional[str] = None,
         attachments: Optional[List[dict]] = None,
+        message_id: Optional[str] = None,
     ) -> dict:
         """
         发送邮件
@@ -35,7 +61,9 @@ class SMTPSender:
             subject: 邮件主题
             body_html: HTML 正文
             body_text: 纯文本正文（可选）
-            attachments: 附件列表 [{name, content_type, content(base64)}]
+            attachments: 附件列表 [{name, content_type, file}]
+                file 为已下载的文件对象；兼容旧格式 content(base64)
+            message_id: 固定的 Message-ID（重试时保持不变，便于收件端去重）
 
         Returns:
             {"success": bool, "message": str}
@@ -47,6 +75,8 @@ class SMTPSender:
             msg["From"] = self.user
             msg["To"] = to_email
             msg["Date"] = datetime.utcnow().strftime("%a, %d %b %Y %H:%M:%S +0000")
+            if message_id:
+                msg["Message-ID"] = message_id
 
             # 添加正文
             if body_text:
@@ -54,35 +84,49 @@ class SMTPSender:
             if body_html:
                 msg.attach(MIMEText(body_html, "html", "utf-8"))
 
-            # 添加附件
-            if attachments:
+            if not attachments:
+                await self._deliver(msg)
+                return {"success": True, "message": "邮件发送成功"}
+
+            # 带附件：从编码附件到发送完成，整封邮件都在内存中，限制同时进行的数量
+            async with _attachment_send_semaphore:
                 for attachment in attachments:
                     try:
                         part = MIMEBase("application", "octet-stream")
-                        content = base64.b64decode(attachment["content"])
-                        part.set_payload(content)
-                        encoders.encode_base64(part)
+                        if attachment.get("file") is not None:
+                            # 分块读取文件编码，不把原始内容整体读入内存
+                            part.set_payload(encode_file_base64(attachment["file"]))
+                            part["Content-Transfer-Encoding"] = "base64"
+                        else:
+                            content = base64.b64decode(attachment["content"])
+                            part.set_payload(content)
+                            encoders.encode_base64(part)
                         part.add_header(
                             "Content-Disposition",
                             f'attachment; filename="{attachment["name"]}"',
                         )
                         msg.attach(part)
                     except Exception as e:
-                        print(f"附件处理失败 {attachment.get('name')}: {e}")
-                        continue
+                        # 不发送缺附件的邮件，由调用方重试
+                        return {
+                            "success": False,
+                            "message": f"附件 {attachment.get('name')} 处理失败: {str(e)[:200]}",
+                        }
 
-            # 发送邮件
-            async with aiosmtplib.SMTP(
-                hostname=self.host, port=self.port, use_tls=self.use_tls
-            ) as smtp:
-                await smtp.login(self.user, self.password)
-                await smtp.send_message(msg)
+                await self._deliver(msg)
 
             return {"success": True, "message": "邮件发送成功"}
 
         except Exception as e:
             return {"success": False, "message": f"邮件发送失败: {str(e)}"}
 
+    async def _deliver(self, msg: MIMEMultipart):
+        async with aiosmtplib.SMTP(
+            hostname=self.host, port=self.port, use_tls=self.use_tls
+        ) as smtp:
+            await smtp.login(self.user, self.password)
+            await smtp.send_message(msg)
+
     async def send_processed_email(
         self,
         to_email: str,
@@ -92,6 +136,8 @@ class SMTPSender:
         processed_content: str,
         original_body: Optional[str] = None,
         attachments: Optional[List[dict]] = None,
+        attachment_loader: Optional[Callable[[dict], Awaitable]] = None,
+        inline_max_bytes: Optional[int] = None,
     ) -> dict:
         """
         发送处理后的邮件
@@ -103,135 +149,182 @@ class SMTPSender:
             original_date: 原邮件日期
             processed_content: AI 处理后的内容
             original_body: 原文内容（可选）
-            attachments: 附件列表
+            attachments: 附件列表 [{name, size, content_type, url}]
+            attachment_loader: 加载内联附件内容的协程，返回文件对象
+            inline_max_bytes: 单个附件内联上限（字节），None 表示不限制
 
         Returns:
             {"success": bool, "message": str}
         """
-        # 构建主题
-        subject = f"[Outlook助手] {original_subject}"
-
-        # 构建 HTML 正文
-        html_body = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <style>
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            line-height: 1.6;
-            color: #333;
-            max-width: 800px;
-            margin: 0 auto;
-            padding: 20px;
-        }}
-        .header {{
-            background: #f8f9fa;
-            padding: 15px;
-            border-radius: 8px;
-            margin-bottom: 20px;
-            border-left: 4px solid #0078d4;
-        }}
-        .header-item {{
-            margin: 5px 0;
-            font-size: 14px;
-        }}
-        .header-label {{
-            color: #666;
-            font-weight: 500;
-        }}
-        .content {{
-            background: white;
-            padding: 20px;
-            border: 1px solid #e9ecef;
-            border-radius: 8px;
-            margin-bottom: 20px;
-        }}
-        .content h2 {{
-            margin-top: 0;
-            color: #0078d4;
-            font-size: 18px;
-        }}
-        .original {{
-            background: #f8f9fa;
-            padding: 15px;
-            border-radius: 8px;
-            border: 1px solid #e9ecef;
-        }}
-        .original h3 {{
-            margin-top: 0;
-            color: #666;
-            font-size: 14px;
-        }}
-        .footer {{
-            text-align: center;
-            color: #999;
-            font-size: 12px;
-            margin-top: 30px;
-            padding-top: 20px;
-            border-top: 1px solid #e9ecef;
-        }}
-    </style>
-</head>
-<body>
-    <div class="header">
-        <div class="header-item"><span class="header-label">原邮件主题：</span>{
-            original_subject
-        }</div>
-        <div class="header-item"><span class="header-label">发件人：</span>{
-            original_sender
-        }</div>
-        <div class="header-item"><span class="header-label">时间：</span>{
-            original_date.strftime("%Y-%m-%d %H:%M:%S") if original_date else "未知"
-        }</div>
-    </div>
-    
-    <div class="content">
-        <h2>🤖 AI 处理结果</h2>
-        <div>{processed_content.replace(chr(10), "<br>")}</div>
-    </div>
-    
-    {
-            f'''
-    <div class="original">
-        <h3>📧 原始邮件内容</h3>
-        <div>{original_body.replace(chr(10), "<br>")}</div>
-    </div>
-    '''
-            if original_body
-            else ""
-        }
-    
-    <div class="footer">
-        由 Outlook Web Tool 自动处理发送<br>
-        发送时间：{datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")}
-    </div>
-</body>
-</html>
-        """
+        message = self.build_processed_email(
+            original_subject=original_subject,
+            original_sender=original_sender,
+            original_date=original_date,
+            processed_content=processed_content,
+            original_body=original_body,
+            attachments=attachments,
+            inline_max_bytes=inline_max_bytes,
+        )
 
-        # 构建纯文本正文
-        text_body = f"""原邮件主题：{original_subject}
-发件人：{original_sender}
-时间：{original_date.strftime("%Y-%m-%d %H:%M:%S") if original_date else "未知"}
+        return await self.send_rendered(
+            to_email=to_email,
+            message=message,
+            attachment_loader=attachment_loader,
+        )
 
---- AI 处理结果 ---
+    def build_processed_email(
+        self,
+        original_subject: str,
+        original_sender: str,
+        original_date: datetime,
+        processed_content: str,
+        original_body: Optional[str] = None,
+        attachments: Optional[List[dict]] = None,
+        inline_max_bytes: Optional[int] = None,
+    ) -> dict:
+        """
+        渲染处理后的邮件（不发送），结果可直接存入发件箱
 
-{processed_content}
+        附件按大小分流：不超过 inline_max_bytes 且总量不超过
+        ATTACHMENT_INLINE_TOTAL_MAX_BYTES 的附件随邮件发送，其余替换为下载链接。
 
----
-由 Outlook Web Tool 自动处理发送
+        Returns:
+            {"subject", "body_html", "body_text", "attachments"(内联附件)}
         """
+        inline, linked = self.split_attachments(attachments or [], inline_max_bytes)
 
-        return await self.send_email(
-            to_email=to_email,
-            subject=subject,
-            body_html=html_body,
-            body_text=text_body,
-            attachments=attachments,
+        html_body, text_body = self._render_processed_email(
+            original_subject=original_subject,
+            original_sender=original_sender,
+            original_date=original_date,
+            processed_content=processed_content,
+            original_body=original_body,
+            linked_attachments=linked,
         )
 
+        return {
+            "subject": f"[Outlook助手] {original_subject}",
+            "body_html": html_body,
+            "body_text": text_body,
+            "attachments": inline,
+        }
+
+    async def send_rendered(
+        self,
+        to_email: str,
+        message: dict,
+        attachment_loader: Optional[Callable[[dict], Awaitable]] = None,
+        message_id: Optional[str] = None,
+    ) -> dict:
+        """
+        发送 build_processed_email 渲染好的邮件
+
+        内联附件由 attachment_loader 加载；没有 attachment_loader 时附件必须自带 content。
+        任一附件无法加载（加载出错或返回 None）时返回失败，由调用方按退避重试，
+        不发送缺附件的邮件。
+        """
+        opened = []
+
+        try:
+            attachments = []
+            for att in message.get("attachments") or []:
+                if attachment_loader is None:
+                    if "content" not in att:
+                        return {
+                            "success": False,
+                            "message": f"附件 {att.get('name')} 无法加载",
+                        }
+                    attachments.append(att)
+                    continue
+                try:
+                    att_file = await attachment_loader(att)
+                except Exception as e:
+                    return {
+                        "success": False,
+                        "message": f"附件 {att.get('name')} 加载失败: {str(e)[:200]}",
+                    }
+                if att_file is None:
+                    return {
+                        "success": False,
+                        "message": f"附件 {att.get('name')} 无法加载",
+                    }
+
+                opened.append(att_file)
+                attachments.append({**att, "file": att_file})
+
+            return await self.send_email(
+                to_email=to_email,
+                subject=message["subject"],
+                body_html=message["body_html"],
+                body_text=message.get("body_text"),
+                attachments=attachments or None,
+                message_id=message_id,
+            )
+        finally:
+            for att_file in opened:
+                att_file.close()
+
+    @staticmethod
+    def split_attachments(
+        attachments: List[dict], inline_max_bytes: Optional[int]
+    ) -> Tuple[List[dict], List[dict]]:
+        """按大小策略把附件分为 (内联, 链接) 两组；没有链接的附件始终内联"""
+        inline, linked = [], []
+        budget = settings.ATTACHMENT_INLINE_TOTAL_MAX_BYTES
+
+        for att in attachments:
+            size = att.get("size") or 0
+            fits = (inline_max_bytes is None or size <= inline_max_bytes) and (
+                size <= budget
+            )
+            if fits or not att.get("url"):
+                inline.append(att)
+                budget -= size
+            else:
+                linked.append(att)
+
+        return inline, linked
+
+    def _render_processed_email(
+        self,
+        original_subject: str,
+        original_sender: str,
+        original_date: datetime,
+        processed_content: str,
+        original_body: Optional[str] = None,
+        linked_attachments: Optional[List[dict]] = None,
+    ) -> Tuple[str, str]:
+        """渲染处理后邮件的 (HTML, 纯文本) 正文（模板 email/processed.*，CSS 已内联）"""
+        context = {
+            "original_subject": original_subject,
+            "original_sender": original_sender,
+            "original_date": original_date,
+            "processed_content": processed_content,
+            "original_body": original_body,
+            "linked_attachments": [
+                {
+                    "url": att["url"],
+                    "name": att.get("name") or "附件",
+                    "size": _format_size(att.get("size")),
+                }
+                for att in linked_attachments or []
+            ],
+            "link_expire_hours": settings.ATTACHMENT_LINK_EXPIRE_HOURS,
+            "sent_at": datetime.utcnow(),
+        }
+        html_body = env.get_template("email/processed.html").render(context)
+        text_body = env.get_template("email/processed.txt").render(context)
+        return html_body, text_body
+
+
+def _format_size(size: Optional[int]) -> str:
+    """格式化附件大小"""
+    if not size:
+        return "未知大小"
+    if size >= 1024 * 1024:
+        return f"{size / 1024 / 1024:.1f} MB"
+    return f"{size / 1024:.0f} KB"
+
 
 # 全局实例
 smtp_sender = SMTPSender()
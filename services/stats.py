@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import StatsHourly, StatsTotal
+
+COUNTERS = [
+    "fetch_runs",
+    "fetch_failed",
+    "fetched",
+    "new_emails",
+    "processed",
+    "process_failed",
+    "sent",
+    "send_failed",
+    "fetch_ms",
+    "send_ms",
+    "delivery_delay_s",
+]
+
+
+def _insert(dialect: str):
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def _upsert(dialect: str, model, keys: dict, increments: dict, extra: dict = None):
+    """INSERT ... ON CONFLICT DO UPDATE SET 计数 = 计数 + 增量"""
+    table = model.__table__
+    stmt = _insert(dialect)(table).values(**keys, **increments, **(extra or {}))
+    return stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={
+            **{name: table.c[name] + stmt.excluded[name] for name in increments},
+            **(extra or {}),
+        },
+    )
+
+
+async def record_stats(db: AsyncSession, user_id: int, **increments) -> None:
+    """
+    累加用户当前小时和累计的统计（不提交事务）
+
+    与日志/状态更新在同一事务中执行，统计与实际写入保持一致。
+
+    用法：
+        await record_stats(db, user.id, fetch_runs=1, fetched=10, new_emails=3)
+    """
+    increments = {k: int(v) for k, v in increments.items() if v}
+    if not increments:
+        return
+
+    unknown = set(increments) - set(COUNTERS)
+    if unknown:
+        raise ValueError(f"未知的统计项: {', '.join(sorted(unknown))}")
+
+    dialect = db.bind.dialect.name
+    now = datetime.utcnow()
+    hour = now.replace(minute=0, second=0, microsecond=0)
+
+    await db.execute(
+        _upsert(dialect, StatsHourly, {"user_id": user_id, "hour": hour}, increments)
+    )
+    await db.execute(
+        _upsert(
+            dialect,
+            StatsTotal,
+            {"user_id": user_id},
+            increments,
+            extra={"updated_at": now},
+        )
+    )
+
+
+def _averages(counts: dict) -> dict:
+    send_attempts = counts["sent"] + counts["send_failed"]
+    return {
+        "avg_fetch_ms": round(counts["fetch_ms"] / counts["fetch_runs"])
+        if counts["fetch_runs"]
+        else None,
+        "avg_send_ms": round(counts["send_ms"] / send_attempts)
+        if send_attempts
+        else None,
+        "avg_delivery_delay_s": round(counts["delivery_delay_s"] / counts["sent"])
+        if counts["sent"]
+        else None,
+    }
+
+
+async def get_user_stats(db: AsyncSession, user_id: int, hours: int = 24) -> dict:
+    """
+    读取用户统计：累计值 + 最近 hours 小时的逐小时数据
+
+    只按主键读取一行累计值和至多 hours 行小时数据，耗时与历史数据量无关。
+    """
+    total = await db.get(StatsTotal, user_id, populate_existing=True)
+    totals = {name: getattr(total, name) if total else 0 for name in COUNTERS}
+
+    since = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(
+        hours=hours - 1
+    )
+    rows = (
+        await db.scalars(
+            select(StatsHourly)
+            .where(StatsHourly.user_id == user_id, StatsHourly.hour >= since)
+            .order_by(StatsHourly.hour)
+        )
+    ).all()
+
+    hourly = [
+        {"hour": row.hour.isoformat(), **{name: getattr(row, name) for name in COUNTERS}}
+        for row in rows
+    ]
+    window = {name: sum(row[name] for row in hourly) for name in COUNTERS}
+
+    return {
+        "totals": {**totals, **_averages(totals)},
+        "window": {"hours": hours, "since": since.isoformat(), **window, **_averages(window)},
+        "hourly": hourly,
+        "updated_at": total.updated_at.isoformat() if total and total.updated_at else None,
+    }
@@ -0,0 +1,138 @@
+"""
+OAuth Token 刷新
+
+- 同一用户同一时间只有一次刷新：进程内共享同一个刷新任务，
+  跨进程通过锁定 users 行（SELECT ... FOR UPDATE）串行，拿到锁后发现已被刷新则直接返回
+- 后台任务在 Token 过期前 TOKEN_REFRESH_AHEAD_SECONDS 主动刷新，用户请求不用等待刷新
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+from sqlalchemy import select
+
+from config import settings
+from database.models import AsyncSessionLocal, User
+from services.outlook import MicrosoftAuthService
+from services.user_cache import user_cache
+from utils import cache_token, decrypt_token, encrypt_token
+
+# user_id -> 进行中的刷新任务
+_inflight: Dict[int, asyncio.Task] = {}
+
+# 后台刷新失败的用户 -> 下次重试时间（monotonic），避免反复请求失效的 Refresh Token
+_retry_after: Dict[int, float] = {}
+
+
+class TokenRefreshError(Exception):
+    """Refresh Token 缺失或刷新失败，需要重新登录"""
+
+
+def needs_refresh(expires_at, ahead_seconds: int = 0) -> bool:
+    """Token 是否已过期或将在 ahead_seconds 秒内过期（没有过期时间的不刷新）"""
+    return expires_at is not None and expires_at <= datetime.utcnow() + timedelta(
+        seconds=ahead_seconds
+    )
+
+
+async def _refresh(user_id: int, ahead_seconds: int) -> datetime:
+    async with AsyncSessionLocal() as db:
+        user = await db.scalar(
+            select(User).where(User.id == user_id).with_for_update()
+        )
+        if not user or not user.is_active:
+            raise TokenRefreshError("用户不存在或已禁用")
+
+        # 等锁期间其他进程可能已经刷新
+        if not needs_refresh(user.token_expires_at, ahead_seconds):
+            await db.commit()
+            return user.token_expires_at
+
+        refresh_token = decrypt_token(user.refresh_token)
+        if not refresh_token:
+            raise TokenRefreshError("没有可用的 Refresh Token")
+
+        try:
+            token_data = await MicrosoftAuthService.refresh_access_token(refresh_token)
+        except Exception as e:
+            raise TokenRefreshError(f"Token 刷新失败: {str(e)[:200]}") from e
+
+        access_token = token_data.get("access_token")
+        user.access_token = encrypt_token(access_token)
+        # Refresh Token 可能轮换，未返回新值时沿用旧值
+        user.refresh_token = encrypt_token(token_data.get("refresh_token", refresh_token))
+        user.token_expires_at = token_data.get("expires_at")
+        await db.commit()
+        user_cache.invalidate(user_id)
+
+        # 更新缓存并通知其他进程丢弃旧 Token
+        await cache_token(user_id, access_token, user.token_expires_at)
+        return user.token_expires_at
+
+
+async def refresh_user_token(user_id: int, ahead_seconds: int = 0) -> datetime:
+    """
+    刷新用户 Token（单飞），返回新的过期时间
+
+    ahead_seconds: 距过期不足该秒数即刷新；拿到锁后若 Token 已不需要刷新则直接返回
+    """
+    task = _inflight.get(user_id)
+    if task is None:
+        task = asyncio.create_task(_refresh(user_id, ahead_seconds))
+        _inflight[user_id] = task
+        task.add_done_callback(lambda _: _inflight.pop(user_id, None))
+
+    # 取消某个等待者不影响其他等待同一次刷新的请求
+    return await asyncio.shield(task)
+
+
+async def refresh_expiring_tokens() -> dict:
+    """刷新即将过期的 Token，返回刷新 / 失败数量"""
+    deadline = datetime.utcnow() + timedelta(seconds=settings.TOKEN_REFRESH_AHEAD_SECONDS)
+    async with AsyncSessionLocal() as db:
+        user_ids = (
+            await db.scalars(
+                select(User.id).where(
+                    User.is_active.is_(True),
+                    # 登录时没有返回 Refresh Token 的用户存的是空字符串（encrypt_token）
+                    User.refresh_token.isnot(None),
+                    User.refresh_token != "",
+                    User.token_expires_at <= deadline,
+                )
+            )
+        ).all()
+
+    now = time.monotonic()
+    user_ids = [uid for uid in user_ids if _retry_after.get(uid, 0) <= now]
+    semaphore = asyncio.Semaphore(settings.TOKEN_REFRESH_CONCURRENCY)
+    stats = {"refreshed": 0, "failed": 0}
+
+    async def refresh_one(user_id: int):
+        async with semaphore:
+            try:
+                await refresh_user_token(user_id, settings.TOKEN_REFRESH_AHEAD_SECONDS)
+                _retry_after.pop(user_id, None)
+                stats["refreshed"] += 1
+            except Exception as e:
+                _retry_after[user_id] = (
+                    time.monotonic() + settings.TOKEN_REFRESH_FAILURE_BACKOFF_SECONDS
+                )
+                stats["failed"] += 1
+                print(f"用户 {user_id}: {str(e)[:100]}")
+
+    await asyncio.gather(*(refresh_one(uid) for uid in user_ids))
+    return stats
+
+
+async def run_token_refresh_worker():
+    """后台定期刷新即将过期的 Token"""
+    while True:
+        try:
+            stats = await refresh_expiring_tokens()
+            if stats["refreshed"] or stats["failed"]:
+                print(f"🔑 Token 刷新: {stats}")
+        except Exception as e:
+            print(f"Token 刷新任务出错: {e}")
+
+        await asyncio.sleep(settings.TOKEN_REFRESH_INTERVAL_SECONDS)
@@ -0,0 +1,93 @@
+"""
+当前用户 / 用户配置的短期缓存
+
+get_current_user 和大多数接口每次请求都要查询 users 和 user_configs。
+这里按 user_id 缓存一份与会话无关的快照，每个请求通过
+merge(load=False) 复制到自己的会话中，不访问数据库。
+
+- 有效期 USER_CACHE_TTL_SECONDS（每个进程独立）
+- 修改配置、刷新 Token、登录 / 登出时主动失效；其他进程刷新 Token 或
+  登出时通过 Token 缓存的失效通知同步删除，配置修改在其他进程最多延迟一个有效期
+"""
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+
+from config import settings
+from database.models import User, UserConfig
+from utils.token_cache import token_cache
+
+
+def _snapshot(obj):
+    """复制已加载的列属性，得到一个可在多个会话间 merge 的 detached 对象"""
+    mapper = inspect(obj).mapper
+    copy = mapper.class_()
+    for attr in mapper.column_attrs:
+        setattr(copy, attr.key, getattr(obj, attr.key))
+    make_transient_to_detached(copy)
+    return copy
+
+
+class UserCache:
+    def __init__(self, ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # (类型, user_id) -> (快照, 过期时间 monotonic)
+        self._entries = OrderedDict()
+
+    def _get(self, key) -> Optional[object]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _set(self, key, obj):
+        if not self.ttl:
+            return
+        self._entries[key] = (_snapshot(obj), time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_user(self, db: AsyncSession, user_id: int) -> Optional[User]:
+        cached = self._get(("user", user_id))
+        if cached is not None:
+            return await db.merge(cached, load=False)
+
+        user = await db.get(User, user_id)
+        if user is not None:
+            self._set(("user", user_id), user)
+        return user
+
+    async def get_config(self, db: AsyncSession, user_id: int) -> Optional[UserConfig]:
+        cached = self._get(("config", user_id))
+        if cached is not None:
+            return await db.merge(cached, load=False)
+
+        config = await db.scalar(select(UserConfig).where(UserConfig.user_id == user_id))
+        if config is not None:
+            self._set(("config", user_id), config)
+        return config
+
+    def invalidate(self, user_id: Optional[int] = None):
+        if user_id is None:
+            self._entries.clear()
+            return
+        self._entries.pop(("user", user_id), None)
+        self._entries.pop(("config", user_id), None)
+
+
+user_cache = UserCache(
+    ttl=settings.USER_CACHE_TTL_SECONDS, max_entries=settings.USER_CACHE_MAX_ENTRIES
+)
+
+# 其他进程刷新 Token / 登出时，同时丢弃本进程的用户快照
+token_cache.add_invalidation_listener(user_cache.invalidate)
@@ -0,0 +1,78 @@
+"""
+抓取 / 处理任务写入后，同一用户随后的只读请求走主库（READ_YOUR_WRITES_SECONDS）
+
+从库是主库的旧副本（没有任务写入的邮件），读到邮件说明请求走了主库。
+"""
+import os
+import shutil
+import tempfile
+
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/primary.db"
+os.environ["DATABASE_READ_URLS"] = f"sqlite:///{_tmp}/replica.db"
+os.environ["REDIS_URL"] = ""
+
+import pytest
+from fastapi import Request
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+import database.models as models
+from database.models import Email
+from routers import api
+from services.data_version import bump_data_version
+
+models.init_db()
+with models.engine.begin() as connection:
+    connection.execute(text("INSERT INTO users (id, email, is_active) VALUES (1, 'a@b.c', 1)"))
+    connection.execute(text("INSERT INTO user_configs (user_id) VALUES (1)"))
+shutil.copy(f"{_tmp}/primary.db", f"{_tmp}/replica.db")
+
+from main import app
+
+
+@app.get("/_test/login")
+async def _login(request: Request):
+    request.session["user_id"] = 1
+    return {}
+
+
+async def _fake_fetch(user, db, progress):
+    db.add(Email(user_id=user.id, message_id="m1", subject="new", attachments=[]))
+    await bump_data_version(db, user.id)
+    await db.commit()
+    return {"message": "抓取完成", "total": 1, "new": 1}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api, "_fetch_emails", _fake_fetch)
+    monkeypatch.setitem(api.RUN_OPERATIONS, "fetch", _fake_fetch)
+    with models.engine.begin() as connection:
+        connection.execute(text("DELETE FROM emails"))
+    with TestClient(app) as client:
+        client.get("/_test/login")
+        yield client
+
+
+def _listed(client) -> int:
+    return len(client.get("/api/emails").json()["emails"])
+
+
+def test_fetch_then_list_reads_primary(client):
+    assert _listed(client) == 0
+    assert client.post("/api/fetch").json()["new"] == 1
+    assert _listed(client) == 1
+
+
+def test_started_run_then_list_reads_primary(client):
+    assert client.post("/api/runs/fetch").status_code == 202
+    events = client.get("/api/runs/fetch/events").text
+    assert "event: done" in events
+    assert _listed(client) == 1
+
+
+def test_list_reads_replica_outside_window(client, monkeypatch):
+    client.post("/api/fetch")
+    monkeypatch.setattr(models.settings, "READ_YOUR_WRITES_SECONDS", 0)
+    assert _listed(client) == 0
@@ -34,26 +34,10 @@ def decrypt_token(encrypted_token: str) -> str:
         return ""
 
 
-# 为了安全，限制 Token 只在内存中短暂存在
-token_cache = {}
-
-
-def get_cached_token(user_id: int) -> str:
-    """从缓存获取解密后的 Token（避免频繁解密）"""
-    return token_cache.get(user_id, "")
-
-
-def cache_token(user_id: int, token: str):
-    """缓存解密后的 Token"""
-    token_cache[user_id] = token
-
-
-from typing import Optional
-
-
-def clear_token_cache(user_id: Optional[int] = None):
-    """清除 Token 缓存"""
-    if user_id is not None:
-        token_cache.pop(user_id, None)
-    else:
-        token_cache.clear()
+# Token 缓存（本地 LRU/TTL + Redis 共享），依赖上面的加解密函数
+from utils.token_cache import (  # noqa: E402
+    cache_token,
+    clear_token_cache,
+    get_access_token,
+    get_cached_token,
+)
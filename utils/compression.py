@@ -0,0 +1,176 @@
+"""
+响应压缩中间件（brotli / gzip）
+
+- 按 Accept-Encoding 选择：安装了 brotli 且客户端支持时用 br，否则 gzip
+- 只压缩文本类响应（HTML、JSON、CSS、NDJSON 等），小于 COMPRESSION_MINIMUM_SIZE 的不压缩；
+  附件下载等二进制内容、已设置 Content-Encoding 的响应原样返回
+- 流式响应逐块压缩并立即刷新，客户端能及时收到每一块；SSE（text/event-stream）不压缩
+- 压缩后的响应把强 ETag 改为弱 ETag（W/"..."），If-None-Match 仍能匹配（见 utils/http_cache.py）
+"""
+import zlib
+from typing import Optional
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # 可选依赖，未安装时只用 gzip
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "application/mbox",
+    "image/svg+xml",
+)
+UNCOMPRESSIBLE_TYPES = ("text/event-stream",)
+
+# 超过该大小的块放到线程中压缩，避免阻塞事件循环（300 KB 的正文 gzip 约 15 ms）
+THREAD_THRESHOLD_BYTES = 64 * 1024
+
+
+class _GzipEncoder:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        mode = zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH
+        return self._compressor.compress(data) + self._compressor.flush(mode)
+
+
+class _BrotliEncoder:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        body = self._compressor.process(data)
+        return body + (self._compressor.finish() if final else self._compressor.flush())
+
+
+def _accepted_encodings(header: str) -> dict:
+    """'br;q=1.0, gzip;q=0.8' -> {'br': 1.0, 'gzip': 0.8}"""
+    accepted = {}
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = _accepted_encodings(accept_encoding)
+    candidates = ("br", "gzip") if brotli is not None else ("gzip",)
+    for encoding in candidates:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def is_compressible(content_type: str) -> bool:
+    content_type = content_type.lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES) and not content_type.startswith(
+        UNCOMPRESSIBLE_TYPES
+    )
+
+
+async def _compress(encoder, data: bytes, final: bool) -> bytes:
+    if len(data) > THREAD_THRESHOLD_BYTES:
+        return await anyio.to_thread.run_sync(encoder.compress, data, final)
+    return encoder.compress(data, final)
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def make_encoder(self, encoding: str):
+        if encoding == "br":
+            return _BrotliEncoder(self.brotli_quality)
+        return _GzipEncoder(self.gzip_level)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+            if encoding:
+                responder = _CompressionResponder(self, encoding, send)
+                await self.app(scope, receive, responder.send)
+                return
+        await self.app(scope, receive, send)
+
+
+class _CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send: Send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self.initial_message: Message = {}
+        self.started = False
+        self.encoder = None
+
+    def _should_compress(self, headers: Headers, body: bytes, more_body: bool) -> bool:
+        status = self.initial_message["status"]
+        if status < 200 or status in (204, 304) or "content-encoding" in headers:
+            return False
+        if not is_compressible(headers.get("content-type", "")):
+            return False
+        return more_body or len(body) >= self.middleware.minimum_size
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # 看到第一块响应体后才能决定是否压缩，先不发送响应头
+            self.initial_message = message
+            return
+
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if not self.started:
+            self.started = True
+            headers = MutableHeaders(raw=self.initial_message["headers"])
+            if is_compressible(headers.get("content-type", "")):
+                headers.add_vary_header("Accept-Encoding")
+
+            if self._should_compress(headers, body, more_body):
+                self.encoder = self.middleware.make_encoder(self.encoding)
+                headers["Content-Encoding"] = self.encoding
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = f"W/{etag}"
+                body = await _compress(self.encoder, body, not more_body)
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    headers["Content-Length"] = str(len(body))
+
+            await self._send(self.initial_message)
+        elif self.encoder is not None:
+            body = await _compress(self.encoder, body, not more_body)
+
+        await self._send({"type": "http.response.body", "body": body, "more_body": more_body})
@@ -0,0 +1,132 @@
+"""
+邮件 CSS 内联
+
+很多邮件客户端会忽略 <style>，样式需要写在元素的 style 属性上。
+这里在模板加载时对模板源码做一次内联（而不是每封邮件渲染后再处理），
+编译结果随模板一起进入 Jinja2 缓存，模板文件变化后才会重新内联。
+
+只支持邮件模板用到的简单选择器：标签、.class、tag.class 及其后代组合
+（如 ".content h2"）；伪类、@media 等无法内联的规则保留在 <style> 中。
+"""
+import re
+from typing import List, Tuple
+
+_STYLE_RE = re.compile(r"<style[^>]*>(.*?)</style>\s*", re.S | re.I)
+_RULE_RE = re.compile(r"([^{}]+)\{([^{}]*)\}")
+_COMMENT_RE = re.compile(r"/\*.*?\*/", re.S)
+_COMPOUND_RE = re.compile(r"^([a-zA-Z][a-zA-Z0-9]*)?((?:\.[\w-]+)*)$")
+_TAG_RE = re.compile(r"<(/?)([a-zA-Z][a-zA-Z0-9]*)((?:[^>\"']|\"[^\"]*\"|'[^']*')*)>")
+_CLASS_RE = re.compile(r"""\sclass\s*=\s*["']([^"']*)["']""", re.I)
+_STYLE_ATTR_RE = re.compile(r"""\sstyle\s*=\s*["']([^"']*)["']""", re.I)
+
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "wbr"}
+
+
+def _parse_selector(selector: str):
+    """'.content h2' -> [(None, {'content'}), ('h2', set())]；不支持时返回 None"""
+    parts = []
+    for compound in selector.split():
+        match = _COMPOUND_RE.match(compound)
+        if not match or not compound:
+            return None
+        tag, classes = match.groups()
+        parts.append((tag.lower() if tag else None, set(filter(None, classes.split(".")))))
+    return parts or None
+
+
+def _matches(part, tag: str, classes: set) -> bool:
+    return (part[0] is None or part[0] == tag) and part[1] <= classes
+
+
+def _selector_matches(parts, stack: List[Tuple[str, set]]) -> bool:
+    """stack 最后一项是当前元素，其余为祖先"""
+    if not _matches(parts[-1], *stack[-1]):
+        return False
+    i = len(stack) - 2
+    for part in reversed(parts[:-1]):
+        while i >= 0 and not _matches(part, *stack[i]):
+            i -= 1
+        if i < 0:
+            return False
+        i -= 1
+    return True
+
+
+def _specificity(parts) -> Tuple[int, int]:
+    return sum(len(p[1]) for p in parts), sum(1 for p in parts if p[0])
+
+
+def _parse_rules(css: str):
+    """返回 (可内联的规则列表, 保留在 <style> 中的 CSS)"""
+    rules, kept = [], []
+    css = _COMMENT_RE.sub("", css)
+    order = 0
+    for selectors, body in _RULE_RE.findall(css):
+        declarations = "; ".join(
+            d.strip() for d in body.split(";") if d.strip()
+        )
+        leftover = []
+        for selector in selectors.split(","):
+            selector = selector.strip()
+            parts = _parse_selector(selector)
+            if parts is None:
+                leftover.append(selector)
+                continue
+            rules.append((_specificity(parts), order, parts, declarations))
+            order += 1
+        if leftover:
+            kept.append(f"{', '.join(leftover)} {{ {declarations} }}")
+    rules.sort(key=lambda r: (r[0], r[1]))
+    return rules, "\n".join(kept)
+
+
+def inline_css(source: str) -> str:
+    """把 <style> 中的规则写入匹配元素的 style 属性（元素自带的 style 优先）"""
+    styles = _STYLE_RE.findall(source)
+    if not styles:
+        return source
+
+    rules, kept = _parse_rules("\n".join(styles))
+    source = _STYLE_RE.sub("", source, count=len(styles))
+    if kept:
+        source = source.replace("</head>", f"<style>\n{kept}\n</style>\n</head>", 1)
+
+    stack: List[Tuple[str, set]] = []
+    out = []
+    pos = 0
+    for match in _TAG_RE.finditer(source):
+        closing, tag, attrs = match.group(1), match.group(2).lower(), match.group(3)
+        if closing:
+            # 从栈中弹出到对应的开始标签
+            for i in range(len(stack) - 1, -1, -1):
+                if stack[i][0] == tag:
+                    del stack[i:]
+                    break
+            continue
+
+        class_match = _CLASS_RE.search(attrs)
+        classes = set(class_match.group(1).split()) if class_match else set()
+        stack.append((tag, classes))
+
+        declarations = [
+            rule[3] for rule in rules if rule[3] and _selector_matches(rule[2], stack)
+        ]
+        if declarations:
+            style_match = _STYLE_ATTR_RE.search(attrs)
+            if style_match:
+                declarations.append(style_match.group(1).strip().rstrip(";"))
+                attrs = attrs[: style_match.start()] + attrs[style_match.end():]
+            self_closing = attrs.rstrip().endswith("/")
+            if self_closing:
+                attrs = attrs.rstrip()[:-1].rstrip()
+            style = "; ".join(declarations).replace('"', "'")
+            attrs += f' style="{style}"' + (" /" if self_closing else "")
+            out.append(source[pos:match.start()])
+            out.append(f"<{match.group(2)}{attrs}>")
+            pos = match.end()
+
+        if tag in _VOID_TAGS or attrs.rstrip().endswith("/"):
+            stack.pop()
+
+    out.append(source[pos:])
+    return "".join(out)
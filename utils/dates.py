@@ -0,0 +1,15 @@
+"""
+时间处理
+
+数据库中的 DateTime 列不带时区，统一保存 UTC 时间。asyncpg 不接受带时区的值
+写入 / 比较不带时区的列，外部传入的时间（Graph 返回、查询参数）先转换为不带时区的 UTC。
+"""
+from datetime import datetime, timezone
+from typing import Optional
+
+
+def to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """带时区的时间转换为 UTC 并去掉时区；不带时区的视为 UTC，原样返回"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
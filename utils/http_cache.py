@@ -0,0 +1,121 @@
+"""
+只读接口的 HTTP 缓存
+
+ETag 由 (用户, 数据版本号, 请求地址, salt) 生成：客户端带 If-None-Match 且版本未变时
+直接返回 304，不查询邮件、不渲染。另有可选的进程内响应缓存（RESPONSE_CACHE_MAX_ENTRIES），
+以同样的键保存渲染好的响应体，版本号变化后旧条目自然不再命中，由 LRU 淘汰。
+
+用法：
+    cond = await conditional_request(request, db, user.id)
+    if cond.response is not None:
+        return cond.response
+    ...
+    return cond.respond(payload)  # dict / list 或 Response
+"""
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import ORJSONResponse, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from services.data_version import get_data_version
+
+# 浏览器每次使用前都要验证（304 很便宜），且只能由当前用户的浏览器缓存
+CACHE_CONTROL = "private, no-cache"
+
+
+class ResponseCache:
+    """渲染好的响应体：键 -> (body, media_type)，LRU"""
+
+    def __init__(self, max_entries: int, max_entry_bytes: int):
+        self.max_entries = max_entries
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = OrderedDict()
+
+    def get(self, key) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key, body: bytes, media_type: str):
+        if not self.max_entries or len(body) > self.max_entry_bytes:
+            return
+        self._entries[key] = (body, media_type)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+response_cache = ResponseCache(
+    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+    max_entry_bytes=settings.RESPONSE_CACHE_MAX_ENTRY_BYTES,
+)
+
+
+def make_etag(user_id: int, version: int, url: str, salt: str = "") -> str:
+    digest = hashlib.sha256(f"{url}|{salt}".encode()).hexdigest()[:16]
+    return f'"u{user_id}-v{version}-{digest}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match 使用弱比较
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag in candidates
+
+
+class ConditionalRequest:
+    def __init__(self, etag: str, cache_key: tuple, response: Optional[Response]):
+        self.etag = etag
+        self.cache_key = cache_key
+        # 304 或缓存命中时不为空，直接返回
+        self.response = response
+
+    def _headers(self) -> dict:
+        return {"ETag": self.etag, "Cache-Control": CACHE_CONTROL, "Vary": "Cookie"}
+
+    def respond(self, content) -> Response:
+        """为新渲染的响应加上 ETag，并写入响应缓存（只缓存 200）"""
+        if isinstance(content, Response):
+            response = content
+        else:
+            response = ORJSONResponse(content)
+
+        if response.status_code != 200:
+            return response
+
+        response.headers.update(self._headers())
+        response_cache.set(self.cache_key, response.body, response.media_type)
+        return response
+
+
+async def conditional_request(
+    request: Request, db: AsyncSession, user_id: int, salt: str = ""
+) -> ConditionalRequest:
+    """
+    读取数据版本号，判断能否返回 304 或缓存的响应
+
+    salt: 版本号之外影响响应内容的因素（如模板版本）
+    """
+    version = await get_data_version(db, user_id)
+    url = str(request.url)
+    etag = make_etag(user_id, version, url, salt)
+    cond = ConditionalRequest(etag, (user_id, version, url, salt), None)
+
+    if _etag_matches(request, etag):
+        cond.response = Response(status_code=304, headers=cond._headers())
+        return cond
+
+    cached = response_cache.get(cond.cache_key)
+    if cached is not None:
+        body, media_type = cached
+        cond.response = Response(body, media_type=media_type, headers=cond._headers())
+    return cond
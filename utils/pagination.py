@@ -0,0 +1,108 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import Select, func, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Email
+from utils.dates import to_naive_utc
+
+
+class InvalidCursor(ValueError):
+    """游标格式错误或已被篡改"""
+
+
+def encode_cursor(received_at: datetime, email_id: int, direction: str = "next") -> str:
+    """把 (received_at, id) 编码为不透明的游标"""
+    payload = json.dumps(
+        [received_at.isoformat(), email_id, direction], separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int, str]:
+    """解析游标，返回 (received_at, id, direction)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        received_at, email_id, direction = json.loads(
+            base64.urlsafe_b64decode(padded.encode())
+        )
+        if direction not in ("next", "prev"):
+            raise ValueError(direction)
+        received_at = to_naive_utc(datetime.fromisoformat(received_at))
+        return received_at, int(email_id), direction
+    except Exception as e:
+        raise InvalidCursor(f"无效的游标: {cursor}") from e
+
+
+async def paginate_emails(
+    db: AsyncSession, stmt: Select, cursor: Optional[str], limit: int
+) -> Tuple[list, Optional[str], Optional[str]]:
+    """
+    按 (received_at DESC, id DESC) 做 keyset 分页
+
+    stmt 必须已按用户过滤，且查询列中包含 Email.received_at 和 Email.id。
+    翻页代价与页码无关，只取决于 limit。
+
+    Returns:
+        (当前页的行, 下一页游标, 上一页游标)
+    """
+    key = tuple_(Email.received_at, Email.id)
+
+    if cursor:
+        received_at, email_id, direction = decode_cursor(cursor)
+    else:
+        received_at, email_id, direction = None, None, "next"
+
+    if direction == "next":
+        if received_at is not None:
+            stmt = stmt.where(key < tuple_(received_at, email_id))
+        stmt = stmt.order_by(Email.received_at.desc(), Email.id.desc())
+    else:
+        stmt = stmt.where(key > tuple_(received_at, email_id))
+        stmt = stmt.order_by(Email.received_at.asc(), Email.id.asc())
+
+    # 多取一条判断是否还有更多
+    rows = list((await db.execute(stmt.limit(limit + 1))).all())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if direction == "prev":
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, cursor is not None
+
+    if not rows:
+        return rows, None, None
+
+    first, last = rows[0], rows[-1]
+    next_cursor = (
+        encode_cursor(last.received_at, last.id, "next") if has_next else None
+    )
+    prev_cursor = (
+        encode_cursor(first.received_at, first.id, "prev") if has_prev else None
+    )
+    return rows, next_cursor, prev_cursor
+
+
+async def estimate_email_count(db: AsyncSession, user_id: int) -> int:
+    """
+    估算用户的邮件总数
+
+    PostgreSQL 上读取执行计划的行数估计（不扫描数据）；其他数据库直接 COUNT。
+    """
+    if db.bind.dialect.name == "postgresql":
+        plan = await db.scalar(
+            text("EXPLAIN (FORMAT JSON) SELECT 1 FROM emails WHERE user_id = :user_id"),
+            {"user_id": user_id},
+        )
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    return await db.scalar(
+        select(func.count()).select_from(Email).where(Email.user_id == user_id)
+    )
@@ -0,0 +1,127 @@
+"""
+Jinja2 模板环境（页面和邮件共用）
+
+- 模板编译一次后缓存在进程内，编译结果同时写入字节码缓存，
+  重启或多进程部署时不用重新编译；DEBUG 下修改模板自动重新加载
+- email/ 下的 HTML 模板在加载时内联 CSS（见 utils.css_inline），每个模板版本只做一次
+- 静态文件用 static_url() 生成带内容哈希的地址，可以长期缓存
+"""
+import hashlib
+import os
+from functools import lru_cache
+
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    select_autoescape,
+)
+from markupsafe import Markup, escape
+
+from config import settings
+from utils.css_inline import inline_css
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+
+# 带版本号的静态文件缓存一年，内容变化后地址随之变化
+STATIC_IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class EmailInliningLoader(FileSystemLoader):
+    """加载 email/*.html 时内联 CSS，内联后的源码再交给 Jinja2 编译和缓存"""
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = super().get_source(environment, template)
+        if template.startswith("email/") and template.endswith(".html"):
+            source = inline_css(source)
+        return source, filename, uptodate
+
+
+def _bytecode_cache():
+    if settings.TEMPLATE_BYTECODE_CACHE_DIR:
+        os.makedirs(settings.TEMPLATE_BYTECODE_CACHE_DIR, exist_ok=True)
+        return FileSystemBytecodeCache(settings.TEMPLATE_BYTECODE_CACHE_DIR)
+    # 未配置时使用系统临时目录
+    return FileSystemBytecodeCache()
+
+
+@lru_cache(maxsize=None)
+def _file_version(path: str, mtime: float) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+def static_url(path: str) -> str:
+    """/static/<path>?v=<内容哈希>"""
+    full_path = os.path.join(STATIC_DIR, path)
+    try:
+        version = _file_version(full_path, os.stat(full_path).st_mtime)
+    except OSError:
+        return f"/static/{path}"
+    return f"/static/{path}?v={version}"
+
+
+def _templates_digest() -> str:
+    digest = hashlib.sha256()
+    for root in (TEMPLATE_DIR, STATIC_DIR):
+        for dirpath, dirnames, filenames in sorted(os.walk(root)):
+            dirnames.sort()
+            for name in sorted(filenames):
+                with open(os.path.join(dirpath, name), "rb") as f:
+                    digest.update(name.encode())
+                    digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+_templates_version = None
+
+
+def templates_version() -> str:
+    """模板和静态文件的内容哈希，用作页面 ETag 的一部分（部署新模板后旧 ETag 失效）"""
+    global _templates_version
+    if _templates_version is None or settings.DEBUG:
+        _templates_version = _templates_digest()
+    return _templates_version
+
+
+def nl2br(value) -> Markup:
+    """转义后把换行替换为 <br>"""
+    if not value:
+        return Markup("")
+    return escape(value).replace("\n", Markup("<br>"))
+
+
+class CachedStaticFiles(StaticFiles):
+    """带版本号（?v=）的请求返回长期缓存头，其他请求每次用 ETag 重新验证"""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if b"v=" in scope.get("query_string", b""):
+            response.headers["Cache-Control"] = STATIC_IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+env = Environment(
+    loader=EmailInliningLoader(TEMPLATE_DIR),
+    autoescape=select_autoescape(["html"]),
+    bytecode_cache=_bytecode_cache(),
+    auto_reload=settings.DEBUG,
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
+env.globals["static_url"] = static_url
+env.filters["nl2br"] = nl2br
+
+templates = Jinja2Templates(env=env)
+
+
+def preload_templates():
+    """启动时编译全部模板，第一个请求不用等待编译"""
+    for name in env.list_templates(extensions=["html", "txt"]):
+        env.get_template(name)
@@ -0,0 +1,59 @@
+import html
+import re
+from html.parser import HTMLParser
+
+# 不产生可见文本的标签
+_SKIP_TAGS = {"script", "style", "head", "title", "noscript", "template"}
+# 换行的块级标签
+_BLOCK_TAGS = {
+    "br", "p", "div", "li", "tr", "td", "th", "table", "ul", "ol",
+    "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "hr",
+}
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+
+def html_to_text(value: str) -> str:
+    """
+    把 HTML 正文清洗为纯文本（去掉标签、脚本和样式，合并空白）
+
+    非 HTML 内容原样清理空白后返回。
+    """
+    if not value:
+        return ""
+
+    if "<" in value:
+        parser = _TextExtractor()
+        try:
+            parser.feed(value)
+            parser.close()
+            value = "".join(parser.parts)
+        except Exception:
+            # 极端畸形的 HTML：退化为粗略去标签
+            value = html.unescape(re.sub(r"<[^>]+>", " ", value))
+
+    value = value.replace("\xa0", " ")
+    value = re.sub(r"[ \t\r\f\v]+", " ", value)
+    value = re.sub(r"\s*\n\s*", "\n", value)
+    return value.strip()
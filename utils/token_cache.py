@@ -0,0 +1,267 @@
+"""
+两级 Access Token 缓存
+
+- 本进程：LRU + TTL（不超过 TOKEN_CACHE_LOCAL_TTL_SECONDS，也不超过 Token 本身的过期时间），
+  条目数上限 TOKEN_CACHE_MAX_ENTRIES
+- Redis：多个进程 / 实例共享，值用 ENCRYPTION_KEY 加密存储，随 Token 过期自动删除
+
+刷新或登出时通过 Redis pub/sub 通知其他进程删除本地缓存。
+Redis 不可用时只使用本地缓存，一段时间后自动重试连接。
+"""
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from config import settings
+from utils import decrypt_token, encrypt_token
+
+KEY_PREFIX = "token:"
+INVALIDATE_CHANNEL = "token_cache:invalidate"
+
+# Redis 连接失败后多少秒内不再尝试
+REDIS_RETRY_SECONDS = 30
+
+
+class TokenCache:
+    def __init__(self, max_entries: int, local_ttl: int):
+        self.max_entries = max_entries
+        self.local_ttl = local_ttl
+        # user_id -> (token, 过期时间 monotonic)
+        self._local = OrderedDict()
+        self._redis = None
+        self._redis_down_until = 0.0
+        self._redis_warned = False
+        # 区分自己发出的失效通知
+        self.instance_id = uuid.uuid4().hex
+        # 收到其他进程的失效通知时额外调用，参数为 user_id（None 表示全部）
+        self._listeners = []
+
+    # ---------- 本地 ----------
+
+    def _get_local(self, user_id: int) -> Optional[str]:
+        entry = self._local.get(user_id)
+        if entry is None:
+            return None
+        token, expires = entry
+        if expires <= time.monotonic():
+            self._local.pop(user_id, None)
+            return None
+        self._local.move_to_end(user_id)
+        return token
+
+    def _set_local(self, user_id: int, token: str, ttl: float):
+        self._local[user_id] = (token, time.monotonic() + min(ttl, self.local_ttl))
+        self._local.move_to_end(user_id)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    def _evict_local(self, user_id: Optional[int]):
+        if user_id is None:
+            self._local.clear()
+        else:
+            self._local.pop(user_id, None)
+
+    def add_invalidation_listener(self, callback):
+        """注册回调：其他进程刷新 Token / 登出时，同步清理与该用户相关的本地缓存"""
+        self._listeners.append(callback)
+
+    def _on_remote_invalidate(self, user_id: Optional[int]):
+        self._evict_local(user_id)
+        for callback in self._listeners:
+            callback(user_id)
+
+    # ---------- Redis ----------
+
+    def _get_redis(self):
+        """Redis 客户端；未配置或最近连接失败时返回 None"""
+        if not settings.REDIS_URL or time.monotonic() < self._redis_down_until:
+            return None
+        if self._redis is None:
+            import redis.asyncio as redis
+
+            # 缓存读写是请求路径上的操作，超时要短，失败时退回本地缓存
+            self._redis = redis.from_url(
+                settings.REDIS_URL,
+                socket_timeout=settings.TOKEN_CACHE_REDIS_TIMEOUT,
+                socket_connect_timeout=settings.TOKEN_CACHE_REDIS_TIMEOUT,
+            )
+        return self._redis
+
+    def _redis_failed(self, e: Exception):
+        if not self._redis_warned:
+            print(f"⚠️ Token 缓存 Redis 不可用，暂时只使用本地缓存: {str(e)[:100]}")
+            self._redis_warned = True
+        self._redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+
+    async def _publish(self, user_id: Optional[int]):
+        client = self._get_redis()
+        if client is None:
+            return
+        try:
+            await client.publish(
+                INVALIDATE_CHANNEL,
+                json.dumps({"user_id": user_id, "origin": self.instance_id}),
+            )
+        except Exception as e:
+            self._redis_failed(e)
+
+    # ---------- 接口 ----------
+
+    @staticmethod
+    def ttl_for(expires_at: Optional[datetime]) -> float:
+        """Token 剩余可用秒数（提前 TOKEN_CACHE_EXPIRY_SKEW_SECONDS 视为过期）"""
+        if expires_at is None:
+            return settings.TOKEN_CACHE_LOCAL_TTL_SECONDS
+        return (
+            expires_at - datetime.utcnow()
+        ).total_seconds() - settings.TOKEN_CACHE_EXPIRY_SKEW_SECONDS
+
+    async def get(self, user_id: int) -> Optional[str]:
+        token = self._get_local(user_id)
+        if token is not None:
+            return token
+
+        client = self._get_redis()
+        if client is None:
+            return None
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                value, ttl_ms = await pipe.get(f"{KEY_PREFIX}{user_id}").pttl(
+                    f"{KEY_PREFIX}{user_id}"
+                ).execute()
+        except Exception as e:
+            self._redis_failed(e)
+            return None
+
+        token = decrypt_token(value.decode()) if value else ""
+        if not token:
+            return None
+        self._set_local(user_id, token, ttl_ms / 1000 if ttl_ms > 0 else 0)
+        return token
+
+    async def set(
+        self,
+        user_id: int,
+        token: str,
+        expires_at: Optional[datetime] = None,
+        broadcast: bool = False,
+    ):
+        """
+        写入两级缓存
+
+        broadcast: Token 被刷新 / 替换时通知其他进程丢弃旧的本地缓存
+        """
+        ttl = self.ttl_for(expires_at)
+        if not token or ttl <= 0:
+            self._evict_local(user_id)
+            return
+
+        self._set_local(user_id, token, ttl)
+
+        client = self._get_redis()
+        if client is not None:
+            try:
+                await client.set(
+                    f"{KEY_PREFIX}{user_id}", encrypt_token(token), ex=max(int(ttl), 1)
+                )
+            except Exception as e:
+                self._redis_failed(e)
+
+        if broadcast:
+            await self._publish(user_id)
+
+    async def invalidate(self, user_id: Optional[int] = None):
+        """删除指定用户（None 为全部）的缓存，并通知其他进程"""
+        self._evict_local(user_id)
+
+        client = self._get_redis()
+        if client is not None:
+            try:
+                if user_id is not None:
+                    await client.delete(f"{KEY_PREFIX}{user_id}")
+                else:
+                    async for key in client.scan_iter(match=f"{KEY_PREFIX}*", count=500):
+                        await client.delete(key)
+            except Exception as e:
+                self._redis_failed(e)
+
+        await self._publish(user_id)
+
+    async def run_invalidation_listener(self):
+        """后台订阅失效通知，删除本进程中对应的本地缓存"""
+        if not settings.REDIS_URL:
+            return
+
+        import redis.asyncio as redis
+
+        # 订阅连接长时间阻塞读取，不能使用带 socket_timeout 的客户端
+        client = redis.from_url(
+            settings.REDIS_URL,
+            socket_connect_timeout=settings.TOKEN_CACHE_REDIS_TIMEOUT,
+        )
+        while True:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                # 断开期间的通知收不到，重新订阅时清空本地缓存
+                self._on_remote_invalidate(None)
+                if self._redis_warned:
+                    print("✅ Token 缓存 Redis 已恢复")
+                    self._redis_warned = False
+                    self._redis_down_until = 0.0
+                async for message in pubsub.listen():
+                    try:
+                        data = json.loads(message["data"])
+                    except (TypeError, ValueError):
+                        continue
+                    if data.get("origin") != self.instance_id:
+                        self._on_remote_invalidate(data.get("user_id"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._redis_failed(e)
+                await asyncio.sleep(REDIS_RETRY_SECONDS)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+token_cache = TokenCache(
+    max_entries=settings.TOKEN_CACHE_MAX_ENTRIES,
+    local_ttl=settings.TOKEN_CACHE_LOCAL_TTL_SECONDS,
+)
+
+
+async def get_cached_token(user_id: int) -> str:
+    """从缓存获取解密后的 Token（未命中返回空字符串）"""
+    return await token_cache.get(user_id) or ""
+
+
+async def cache_token(
+    user_id: int, token: str, expires_at: Optional[datetime] = None, broadcast: bool = True
+):
+    """缓存解密后的 Token（默认通知其他进程丢弃旧值）"""
+    await token_cache.set(user_id, token, expires_at, broadcast=broadcast)
+
+
+async def clear_token_cache(user_id: Optional[int] = None):
+    """清除 Token 缓存（所有进程）"""
+    await token_cache.invalidate(user_id)
+
+
+async def get_access_token(user) -> str:
+    """用户的 Access Token：先查缓存，未命中时解密数据库中的值并写入缓存"""
+    token = await token_cache.get(user.id)
+    if token:
+        return token
+
+    token = decrypt_token(user.access_token)
+    if token:
+        await token_cache.set(user.id, token, user.token_expires_at)
+    return token